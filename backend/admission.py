@@ -0,0 +1,147 @@
+'''
+Admission control for the servers, so that a flood of students cannot slow
+the tutors down.
+
+At the start of a session every student makes a request at once and their
+pages poll /remaining. The routes students call are rate limited with token
+buckets, per zid and per route, and calls over the limits are turned away
+with 429 Too Many Requests before they reach the engine. Reads, the GET routes
+other than event streams, are served at most config.READ_CONCURRENCY at a time
+and the rest are turned away with 503 Service Unavailable, rather than queued
+up in front of everything else. Both come with a Retry-After header saying
+when to try again. The routes tutors call to change the queue are neither
+limited nor counted, so they are never turned away or kept waiting.
+'''
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+# the routes that stay open, sending events, which are not counted as reads.
+STREAM_ROUTES = ('/queue/stream', '/remaining/stream')
+
+class TokenBucket:
+    '''
+    Holds up to burst tokens, refilled at rate tokens a second. Each call
+    takes a token, so calls may come at rate a second on average, and burst
+    at once after a pause.
+    '''
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def wait(self, now):
+        '''
+        Returns how many seconds from now until a token can be taken, 0 if
+        one can be now.
+        '''
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(1 - self.tokens, 0) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class RateLimiter:
+    '''
+    The token buckets of the rate limited routes: one per route, shared by
+    every zid, for the routes in route_limits, and one per route and zid for
+    those in zid_limits, each a dictionary of route to (rate, burst).
+
+    The buckets of at most max_zids zids are kept, the least recently used
+    being dropped first. A zid whose bucket was dropped starts again with a
+    full one, which only lets a zid that has been quiet for a while burst.
+    '''
+
+    def __init__(self, route_limits, zid_limits, max_zids):
+        self.route_limits = route_limits
+        self.zid_limits = zid_limits
+        self.max_zids = max_zids
+        self.routes = {}
+        # the buckets of each (route, zid), least recently used first.
+        self.zids = OrderedDict()
+        self.lock = threading.Lock()
+
+    def limited(self, route):
+        return route in self.route_limits or route in self.zid_limits
+
+    def wait(self, route, zid, now=None):
+        '''
+        Takes a token for a call to route by zid, from every bucket it is
+        limited by, unless one of them is empty.
+
+        Returns:
+          (float) : 0 if the call may go ahead, otherwise how many seconds
+          until it could.
+        '''
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            buckets = []
+            if route in self.route_limits:
+                if route not in self.routes:
+                    self.routes[route] = TokenBucket(*self.route_limits[route], now)
+                buckets.append(self.routes[route])
+            if route in self.zid_limits:
+                key = (route, zid)
+                if key in self.zids:
+                    self.zids.move_to_end(key)
+                else:
+                    self.zids[key] = TokenBucket(*self.zid_limits[route], now)
+                    if len(self.zids) > self.max_zids:
+                        self.zids.popitem(last=False)
+                buckets.append(self.zids[key])
+            wait = max((bucket.wait(now) for bucket in buckets), default=0)
+            if wait == 0:
+                for bucket in buckets:
+                    bucket.take()
+            return wait
+
+class Admission:
+    '''
+    Decides which calls a server answers, see the module's docstring.
+    '''
+
+    def __init__(self):
+        self.limiter = RateLimiter(config.ROUTE_RATE_LIMITS, config.ZID_RATE_LIMITS,
+                                   config.RATE_LIMITED_ZIDS)
+        self.reads = threading.BoundedSemaphore(config.READ_CONCURRENCY)
+
+    def limited(self, route):
+        '''
+        Returns whether calls to route are rate limited, and so need their zid
+        to be admitted.
+        '''
+        return self.limiter.limited(route)
+
+    def admit(self, method, route, zid=None):
+        '''
+        Decides whether to answer a call to route, made by zid if it is rate
+        limited.
+
+        Returns:
+          (tuple) : None if the call may be answered, in which case done()
+          must be called once it has been, otherwise (status, retry_after),
+          the status to turn it away with and the seconds to retry after.
+        '''
+        wait = self.limiter.wait(route, zid) if self.limited(route) else 0
+        if wait > 0:
+            return 429, max(math.ceil(wait), 1)
+        if self.is_read(method, route) and not self.reads.acquire(blocking=False):
+            return 503, config.READ_RETRY_AFTER
+        return None
+
+    def done(self, method, route):
+        if self.is_read(method, route):
+            self.reads.release()
+
+    def is_read(self, method, route):
+        return method == 'GET' and route not in STREAM_ROUTES
@@ -0,0 +1,56 @@
+'''
+Unit tests for admission control of the servers
+'''
+
+import config
+from admission import Admission, RateLimiter
+
+def test_rate_limits():
+    """
+    one zid calls a route in a burst, then calls it again after a pause.
+    it is turned away once its bucket is empty, and told how long to wait.
+    """
+    limiter = RateLimiter({}, {'/make_request': (2, 3)}, 100)
+    assert [limiter.wait('/make_request', "z1234567", 10) for _ in range(4)] == [0, 0, 0, 0.5]
+    assert limiter.wait('/make_request', "z7654321", 10) == 0
+    assert limiter.wait('/make_request', "z1234567", 10.25) == 0.25
+    assert limiter.wait('/make_request', "z1234567", 10.5) == 0
+    assert limiter.wait('/help', "z1234567", 10.5) == 0
+
+def test_route_limits():
+    """
+    many zids call a route limited for every zid together.
+    calls are turned away once its bucket is empty, without taking the tokens of any zid.
+    """
+    limiter = RateLimiter({'/remaining': (1, 2)}, {'/remaining': (1, 2)}, 100)
+    assert limiter.wait('/remaining', "z1234567", 0) == 0
+    assert limiter.wait('/remaining', "z7654321", 0) == 0
+    assert limiter.wait('/remaining', "z5555555", 0) == 1
+    assert limiter.wait('/remaining', "z5555555", 1) == 0
+
+def test_zids_are_bounded():
+    """
+    more zids call a route than the limiter keeps buckets for.
+    the least recently used are dropped.
+    """
+    limiter = RateLimiter({}, {'/make_request': (1, 1)}, 2)
+    for zid in ("z1111111", "z2222222", "z1111111", "z3333333"):
+        limiter.wait('/make_request', zid, 0)
+    assert list(limiter.zids) == [('/make_request', "z1111111"), ('/make_request', "z3333333")]
+
+def test_read_budget(monkeypatch):
+    """
+    reads come in while as many are being answered as the budget allows.
+    they are turned away until one is done; streams and tutors' operations never are.
+    """
+    monkeypatch.setattr(config, "READ_CONCURRENCY", 2)
+    monkeypatch.setattr(config, "ZID_RATE_LIMITS", {})
+    monkeypatch.setattr(config, "ROUTE_RATE_LIMITS", {})
+    admission = Admission()
+    assert admission.admit('GET', '/queue') is None
+    assert admission.admit('GET', '/statistics') is None
+    assert admission.admit('GET', '/queue') == (503, config.READ_RETRY_AFTER)
+    assert admission.admit('GET', '/queue/stream') is None
+    assert admission.admit('POST', '/help') is None
+    admission.done('GET', '/queue')
+    assert admission.admit('GET', '/queue') is None
@@ -0,0 +1,768 @@
+'''
+The routes of the backend of the 'helpr' application, which every entry point
+serves: server.py on Flask, and async_server.py and stdlib_server.py on the
+standard library alone. Each entry point only turns HTTP requests into Calls
+for admit(), handle() and finish() and sends their answers, so every one of
+them answers the same, from one cache, one admission control and one store of
+idempotency keys.
+
+A route is a function taking a Call, the parts of an HTTP request the routes
+look at, and returning a Reply, or a Stream for /queue/stream and
+/remaining/stream, whose events each entry point sends in its own way.
+
+GET routes are passed arguments as URL parameters. POST and DELETE routes are
+passed arguments as JSON data in the body of the request. All routes return
+data as JSON, with CORS headers.
+
+/queue, /remaining and /statistics answer with a strong ETag naming the
+version of the queue they were computed at. A GET with a matching
+If-None-Match header is answered with 304 Not Modified, and the encoded
+answers at the latest version are cached, so polling a queue that has not
+changed costs almost nothing.
+
+Every route takes an optional "session" argument naming the help session,
+e.g. the lab, it is for, see sessions.py. With config.SHARDS shards, each
+session is served by the process of its shard, listening on config.PORT +
+shard, and requests sent to any other shard are redirected there with 307
+Temporary Redirect. A session is created by the first POST or DELETE for it,
+and GETs for a session that has not been are answered 404 Not Found.
+
+The routes block on the engine's lock and on storage, so the async entry point
+calls handle() on worker threads, never on its event loop.
+'''
+
+import gzip
+import json
+import logging
+import threading
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
+
+import config
+import helpr
+from admission import Admission
+from encoding import encode
+from idempotency import IdempotencyCache, fingerprint
+from replication import FOLLOWER_ROUTES
+from sessions import shard_of, valid_session
+
+# part of every ETag, so that an ETag from before the server restarted, when
+# the versions may have started again from 0, never matches.
+EPOCH = uuid4().hex[:8]
+
+# the encoded answers of each session at its cache's 'version', keyed by route
+# and zid.
+CACHE = {}
+CACHE_LOCK = threading.Lock()
+
+# sent with every reply, so that pages on any origin can call the routes.
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+
+# the comment sent on an idle event stream, so that proxies do not close it.
+KEEPALIVE = b": keepalive\n\n"
+
+# the routes by path, each with the methods it allows.
+ROUTES = {}
+
+# turns calls away while students flood the server, see admission.py.
+ADMISSION = Admission()
+
+# the answers to the calls made with each Idempotency-Key, see idempotency.py.
+IDEMPOTENCY = IdempotencyCache(config.IDEMPOTENCY_KEYS, config.IDEMPOTENCY_TTL)
+
+class HTTPError(Exception):
+    '''
+    Answers a call with status and headers instead of the route's answer.
+    '''
+
+    def __init__(self, status, headers=None):
+        super().__init__(status)
+        self.status = status
+        self.headers = headers or {}
+
+class Call:
+    '''
+    An HTTP request: its method, path, URL params and headers, with lowercase
+    names, and its body.
+    '''
+
+    def __init__(self, method, target, headers, body=b""):
+        parts = urlsplit(target)
+        self.method = method
+        self.target = target
+        self.path = parts.path
+        self.args = {name: values[0] for name, values in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.body = body
+
+    def json(self, silent=False):
+        '''
+        Returns the JSON object in the body.
+
+        Raises:
+          HTTPError: 400 if the body is not a JSON object, unless silent, in
+          which case {} is returned.
+        '''
+        try:
+            data = json.loads(self.body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            if silent:
+                return {}
+            raise HTTPError(400)
+        return data
+
+class Reply:
+    '''
+    The answer to a call, its body already encoded.
+    '''
+
+    def __init__(self, body=b"", status=200, headers=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+
+class Stream:
+    '''
+    The answer to /queue/stream and /remaining/stream: an event stream, each
+    event sent as a Server-Sent Event, see event_text(), until the client goes
+    away.
+
+    subscribe(listener) returns the first event and has listener called with
+    every event after it, from any thread, until unsubscribe(listener).
+    '''
+
+    def __init__(self, subscribe, unsubscribe):
+        self.subscribe = subscribe
+        self.unsubscribe = unsubscribe
+        self.status = 200
+        self.headers = {
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+        }
+
+def chunk(data):
+    '''
+    Returns data framed as one chunk of a chunked body. The empty chunk ends
+    the body.
+    '''
+    return b"%x\r\n%s\r\n" % (len(data), data)
+
+def event_text(event):
+    return b"data: " + encode(event) + b"\n\n"
+
+def json_reply(result, status=200):
+    return Reply(encode(result), status, {'Content-Type': 'application/json'})
+
+def route(path, *methods):
+    def register(function):
+        ROUTES[path] = (methods, function)
+        return function
+    return register
+
+def handle(call):
+    '''
+    Answers a call by the route for its path.
+
+    Returns:
+      (Reply or Stream) : the answer, with CORS headers. Unknown paths are
+      answered 404, unknown methods 405 and routes a follower does not serve
+      503. A POST or DELETE with an Idempotency-Key header is answered as
+      the first call with that key was, see idempotency.py, or 422 if that
+      call was another.
+    '''
+    if call.method == 'OPTIONS':
+        reply = preflight(call)
+    elif call.path not in ROUTES:
+        reply = Reply(status=404)
+    elif helpr.following() and call.path not in FOLLOWER_ROUTES:
+        # a follower is read-only until it is promoted.
+        reply = Reply(status=503)
+    else:
+        methods, function = ROUTES[call.path]
+        if call.method not in methods:
+            reply = Reply(status=405, headers={'Allow': ", ".join(methods + ('OPTIONS',))})
+        elif call.method in ('POST', 'DELETE') and 'idempotency-key' in call.headers:
+            reply = idempotent(function, call)
+        else:
+            reply = respond(function, call)
+    reply.headers.update(CORS_HEADERS)
+    return reply
+
+def respond(function, call):
+    try:
+        return function(call)
+    except HTTPError as error:
+        return Reply(status=error.status, headers=error.headers)
+
+def failure(call):
+    '''
+    Answers a call whose route raised something other than an HTTPError, so
+    that the client gets an answer instead of the connection being dropped.
+    Called by the entry points in an except block, where the exception is
+    logged.
+
+    Returns:
+      (Reply) : 500 Internal Server Error, with CORS headers.
+    '''
+    logging.exception("%s %s raised", call.method, call.path)
+    reply = json_reply({}, 500)
+    reply.headers.update(CORS_HEADERS)
+    return reply
+
+def idempotent(function, call):
+    '''
+    Returns the answer of a route to the first call with the Idempotency-Key
+    of call, calling it only if call is the first.
+    '''
+    try:
+        first, replayed = IDEMPOTENCY.run(call.headers['idempotency-key'],
+                                          fingerprint(call.method, call.path, call.body),
+                                          lambda: respond(function, call))
+    except ValueError:
+        return Reply(status=422)
+    # a copy, as the answer kept is shared by every retry.
+    reply = Reply(first.body, first.status, dict(first.headers))
+    if replayed:
+        reply.headers['Idempotent-Replayed'] = 'true'
+    return reply
+
+def admit(call):
+    '''
+    Decides whether to answer a call, before handle() is called, see
+    admission.py. Only calls to known routes with known methods are counted.
+
+    Returns:
+      (Reply) : the answer turning the call away, with a Retry-After header,
+      or None if it may be handled, in which case finish(call) must be called
+      once it has been.
+    '''
+    if not counted(call):
+        return None
+    zid = None
+    if ADMISSION.limited(call.path):
+        input_data = call.args if call.method == 'GET' else call.json(silent=True)
+        zid = input_data.get('zid')
+    # a zid that is not a string is answered 400 by the route anyway.
+    refusal = ADMISSION.admit(call.method, call.path, zid if isinstance(zid, str) else None)
+    if refusal is None:
+        return None
+    status, retry_after = refusal
+    reply = Reply(status=status, headers={'Retry-After': str(retry_after)})
+    reply.headers.update(CORS_HEADERS)
+    return reply
+
+def finish(call):
+    if counted(call):
+        ADMISSION.done(call.method, call.path)
+
+def counted(call):
+    return call.path in ROUTES and call.method in ROUTES[call.path][0]
+
+def preflight(call):
+    '''
+    Answers a CORS preflight request, allowing any method and headers asked
+    for.
+    '''
+    if call.path not in ROUTES:
+        return Reply(status=404)
+    methods, _ = ROUTES[call.path]
+    headers = {'Access-Control-Allow-Methods': ", ".join(methods + ('OPTIONS',))}
+    if 'access-control-request-headers' in call.headers:
+        headers['Access-Control-Allow-Headers'] = call.headers['access-control-request-headers']
+    return Reply(headers=headers)
+
+def reason(status):
+    return HTTPStatus(status).phrase
+
+def param(input_data, name):
+    '''
+    Returns a param of a call's JSON data.
+
+    Raises:
+      HTTPError: 400 if the param is missing.
+    '''
+    try:
+        return input_data[name]
+    except KeyError:
+        raise HTTPError(400)
+
+def session_of(call, input_data=None):
+    '''
+    Returns the session a call is for: the "session" of its JSON data, or of
+    its URL params if input_data is None, or config.DEFAULT_SESSION.
+
+    Raises:
+      HTTPError: 400 if helpr.open_session() raises a ValueError, 404 if the
+      call is a GET for a session that has never been changed, or 307 to
+      redirect a call for a session of another shard to that shard.
+    '''
+    if input_data is None:
+        session = call.args.get('session', config.DEFAULT_SESSION)
+    else:
+        session = input_data.get('session', config.DEFAULT_SESSION)
+    if valid_session(session) and shard_of(session) != config.SHARD:
+        # 307 keeps the method and body of the call.
+        host = call.headers.get('host', "127.0.0.1").rsplit(':', 1)[0]
+        port = config.PORT + shard_of(session)
+        raise HTTPError(307, {'Location': f"http://{host}:{port}{call.target}"})
+    try:
+        helpr.open_session(session, create=call.method != 'GET')
+    except ValueError:
+        raise HTTPError(400)
+    except KeyError:
+        raise HTTPError(404)
+    return session
+
+def cached_body(session, key, version):
+    with CACHE_LOCK:
+        cache = CACHE.get(session)
+        if cache is None or cache['version'] != version:
+            return None
+        return cache['bodies'].get(key)
+
+def cache_body(session, key, version, body):
+    with CACHE_LOCK:
+        cache = CACHE.setdefault(session, {'version': None, 'bodies': {}})
+        if cache['version'] is not None and version < cache['version']:
+            return
+        if cache['version'] != version:
+            # the answers at older versions will never be used again.
+            cache['version'] = version
+            cache['bodies'] = {}
+        cache['bodies'][key] = body
+
+def compressed(session, key, version, body):
+    '''
+    Returns body, the answer at version cached under key, compressed with
+    gzip, compressing it only once per version unless key is None.
+    '''
+    if key is not None:
+        cached = cached_body(session, ('gzip', key), version)
+        if cached is not None:
+            return cached
+    # no timestamp, so that the same answer is always compressed the same.
+    body = gzip.compress(body, config.GZIP_LEVEL, mtime=0)
+    if key is not None:
+        cache_body(session, ('gzip', key), version, body)
+    return body
+
+def accepts_gzip(header):
+    '''
+    Returns whether an Accept-Encoding header accepts gzip.
+    '''
+    if header is None:
+        return False
+    accepted = {}
+    for coding in header.split(','):
+        name, *params = coding.split(';')
+        quality = 1.0
+        for param in params:
+            param_name, _, value = param.partition('=')
+            if param_name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    return accepted.get('gzip', accepted.get('*', 0.0)) > 0
+
+def etag_matches(header, etag):
+    '''
+    Returns whether an If-None-Match header names etag.
+    '''
+    if header is None:
+        return False
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag in ('*', f'"{etag}"'):
+            return True
+    return False
+
+def versioned_response(call, session, key, compute):
+    '''
+    Returns the reply to a GET whose answer depends only on the queue of a
+    session: 304 if the call's If-None-Match names its version, otherwise the
+    answer of compute(), cached under key at that version.
+    '''
+    version = helpr.version(session)
+    gzipped = accepts_gzip(call.headers.get('accept-encoding'))
+    # answers that may be compressed are another representation, so they
+    # have ETags of their own.
+    suffix = "-gzip" if gzipped else ""
+    etag = f"{EPOCH}-{version}{suffix}"
+    if etag_matches(call.headers.get('if-none-match'), etag):
+        reply = Reply(status=304)
+    else:
+        body = None
+        if key is not None:
+            body = cached_body(session, key, version)
+        if body is None:
+            version, body = compute()
+            etag = f"{EPOCH}-{version}{suffix}"
+            if key is not None:
+                cache_body(session, key, version, body)
+        reply = Reply(body, headers={'Content-Type': 'application/json'})
+        if gzipped and len(body) >= config.GZIP_MIN_SIZE:
+            reply.body = compressed(session, key, version, body)
+            reply.headers['Content-Encoding'] = 'gzip'
+    reply.headers['ETag'] = f'"{etag}"'
+    # caches must ask again every time, sending the ETag.
+    reply.headers['Cache-Control'] = 'no-cache'
+    reply.headers['Vary'] = 'Accept-Encoding'
+    return reply
+
+@route('/make_request', 'POST')
+def make_request(call):
+    '''
+    A route for helpr.make_request()
+
+    Params: {"zid", "description"}
+
+    Raises: 400 Bad Request if helpr.make_request() raises a KeyError or
+    ValueError.
+
+    Returns: {}
+    '''
+    input_data = call.json()
+    session = session_of(call, input_data)
+    try:
+        helpr.make_request(param(input_data, 'zid'), param(input_data, 'description'), session)
+    except (KeyError,ValueError):
+        raise HTTPError(400)
+    return json_reply({})
+
+@route('/queue', 'GET')
+def queue(call):
+    '''
+    A route for helpr.queue(), or helpr.queue_page() if any of its params are
+    given.
+
+    Params: ("limit", "cursor", "status") all optional
+
+    Raises: 400 Bad Request if limit is not an integer or helpr.queue_page()
+    raises a ValueError.
+
+    Returns: A list in the same format as helpr.queue(), or a page
+    { 'queue': queue, 'cursor': cursor } in the same format as
+    helpr.queue_page()
+    '''
+    session = session_of(call)
+    if not any(name in call.args for name in ('limit', 'cursor', 'status')):
+        return versioned_response(call, session, 'queue', lambda: helpr.encoded_queue(session))
+
+    limit = call.args.get('limit')
+    cursor = call.args.get('cursor')
+    status = call.args.get('status')
+    try:
+        if limit is not None:
+            limit = int(limit)
+    except ValueError:
+        raise HTTPError(400)
+
+    def compute_page():
+        try:
+            version, result = helpr.versioned_queue_page(limit, cursor, status, session)
+        except ValueError:
+            raise HTTPError(400)
+        return version, encode(result)
+
+    # pages are not cached, as clients choose their params.
+    return versioned_response(call, session, None, compute_page)
+
+@route('/queue/stream', 'GET')
+def queue_stream(call):
+    '''
+    A route streaming the changes to helpr.queue() as Server-Sent Events.
+
+    The first event is {"type": "queue", "seq": seq, "queue": queue} where
+    queue is in the same format as helpr.queue(). Every later event is a change
+    event, see helpr.subscribe(), sent as soon as the change is made.
+
+    Returns: A text/event-stream response that stays open.
+    '''
+    session = session_of(call)
+    return Stream(lambda listener: helpr.subscribe(listener, session),
+                  lambda listener: helpr.unsubscribe(listener, session))
+
+@route('/queue/changes', 'GET')
+def queue_changes(call):
+    '''
+    A route for helpr.changes()
+
+    Params: ("since")
+
+    Raises: 400 Bad Request if since is not an integer.
+
+    Returns: { 'seq': n, 'changes': changes } or { 'seq': n, 'resync': true }
+    in the same format as helpr.changes()
+    '''
+    session = session_of(call)
+    try:
+        since = int(call.args.get('since'))
+    except (TypeError,ValueError):
+        raise HTTPError(400)
+    return json_reply(helpr.changes(since, session))
+
+@route('/remaining', 'GET')
+def remaining(call):
+    '''
+    A route for helpr.remaining()
+
+    Params: ("zid")
+
+    Raises: 400 Bad Request if helpr.remaining() raises a KeyError.
+
+    Returns: { 'remaining': n } where n is an integer
+    '''
+    session = session_of(call)
+    zid = call.args.get('zid')
+    def compute():
+        try:
+            version, result = helpr.versioned_remaining(zid, session)
+        except KeyError:
+            raise HTTPError(400)
+        return version, encode({
+            'remaining': result,
+        })
+
+    return versioned_response(call, session, ('remaining', zid), compute)
+
+@route('/remaining/stream', 'GET')
+def remaining_stream(call):
+    '''
+    A route streaming a student's standing in the queue as Server-Sent Events.
+
+    Params: ("zid")
+
+    Raises: 400 Bad Request if zid is missing.
+
+    The first event is { 'status': status, 'remaining': n } in the same format
+    as helpr.subscribe_standing(), and a new one is sent whenever the
+    student's standing changes.
+
+    Returns: A text/event-stream response that stays open.
+    '''
+    session = session_of(call)
+    zid = call.args.get('zid')
+    if zid is None:
+        raise HTTPError(400)
+    return Stream(lambda listener: helpr.subscribe_standing(zid, listener, session),
+                  lambda listener: helpr.unsubscribe_standing(listener, session))
+
+@route('/statistics', 'GET')
+def statistics(call):
+    '''
+    A route for helpr.statistics()
+
+    Returns: A dictionary in the same format as helpr.statistics()
+    '''
+    session = session_of(call)
+    def compute():
+        version, result = helpr.versioned_statistics(session)
+        return version, encode(result)
+
+    return versioned_response(call, session, 'statistics', compute)
+
+def zid_route(function):
+    '''
+    Returns a route for function, one of helpr.help(), helpr.resolve(),
+    helpr.cancel() and helpr.revert(), calling function(zid, session).
+
+    Params: {"zid"}
+
+    Raises: 400 Bad Request if function raises a KeyError.
+
+    Returns: {}
+    '''
+    def zid_call(call):
+        input_data = call.json()
+        session = session_of(call, input_data)
+        try:
+            function(param(input_data, 'zid'), session)
+        except KeyError:
+            raise HTTPError(400)
+        return json_reply({})
+    return zid_call
+
+route('/help', 'POST')(zid_route(helpr.help))
+route('/resolve', 'DELETE')(zid_route(helpr.resolve))
+route('/cancel', 'DELETE')(zid_route(helpr.cancel))
+route('/revert', 'POST')(zid_route(helpr.revert))
+
+@route('/help_next', 'POST')
+def help_next(call):
+    '''
+    A route for helpr.help_next()
+
+    Params: {"tutor", "prioritised"} where prioritised is optional
+
+    Raises: 400 Bad Request if helpr.help_next() raises a ValueError.
+
+    Returns: { 'request': request } where request is in the same format as
+    helpr.help_next(), or null if no request is waiting
+    '''
+    input_data = call.json()
+    session = session_of(call, input_data)
+    prioritised = bool(input_data.get('prioritised', False))
+    try:
+        result = helpr.help_next(param(input_data, 'tutor'), prioritised, session)
+    except ValueError:
+        raise HTTPError(400)
+    return json_reply({
+        'request': result,
+    })
+
+@route('/assign', 'POST')
+def assign(call):
+    '''
+    A route for helpr.assign()
+
+    Params: {"prioritised"} which is optional
+
+    Returns: { 'request': request } where request is in the same format as
+    helpr.assign()
+    '''
+    input_data = call.json(silent=True)
+    session = session_of(call, input_data)
+    prioritised = bool(input_data.get('prioritised', False))
+    return json_reply({
+        'request': helpr.assign(prioritised, session),
+    })
+
+@route('/tutors', 'GET')
+def tutors(call):
+    '''
+    A route for helpr.tutors()
+
+    Returns: A list in the same format as helpr.tutors()
+    '''
+    return json_reply(helpr.tutors(session_of(call)))
+
+@route('/tutors/join', 'POST')
+def join_tutor(call):
+    '''
+    A route for helpr.join_tutor()
+
+    Params: {"tutor", "capacity"} where capacity is optional
+
+    Raises: 400 Bad Request if helpr.join_tutor() raises a ValueError, or
+    capacity is not an integer.
+
+    Returns: {}
+    '''
+    input_data = call.json()
+    session = session_of(call, input_data)
+    capacity = input_data.get('capacity', 1)
+    if not isinstance(capacity, int):
+        raise HTTPError(400)
+    try:
+        helpr.join_tutor(param(input_data, 'tutor'), capacity, session)
+    except ValueError:
+        raise HTTPError(400)
+    return json_reply({})
+
+@route('/tutors/heartbeat', 'POST')
+def tutor_heartbeat(call):
+    '''
+    A route for helpr.tutor_heartbeat()
+
+    Params: {"tutor"}
+
+    Raises: 400 Bad Request if helpr.tutor_heartbeat() raises a KeyError.
+
+    Returns: {}
+    '''
+    input_data = call.json()
+    session = session_of(call, input_data)
+    try:
+        helpr.tutor_heartbeat(param(input_data, 'tutor'), session)
+    except KeyError:
+        raise HTTPError(400)
+    return json_reply({})
+
+@route('/tutors/leave', 'DELETE')
+def leave_tutor(call):
+    '''
+    A route for helpr.leave_tutor()
+
+    Params: {"tutor"}
+
+    Raises: 400 Bad Request if helpr.leave_tutor() raises a KeyError.
+
+    Returns: { 'moved': moved } in the same format as helpr.leave_tutor()
+    '''
+    input_data = call.json()
+    session = session_of(call, input_data)
+    try:
+        moved = helpr.leave_tutor(param(input_data, 'tutor'), session)
+    except KeyError:
+        raise HTTPError(400)
+    return json_reply({
+        'moved': moved,
+    })
+
+@route('/reprioritise', 'POST')
+def reprioritise(call):
+    '''
+    A route for helpr.reprioritise()
+
+    Returns: {}
+    '''
+    helpr.reprioritise(session_of(call, call.json(silent=True)))
+    return json_reply({})
+
+@route('/batch', 'POST')
+def batch(call):
+    '''
+    A route for helpr.batch()
+
+    Params: {"operations"} where operations is a list in the same format as
+    the operations of helpr.batch()
+
+    Raises: 400 Bad Request if helpr.batch() raises a ValueError.
+
+    Returns: { 'results': results } in the same format as helpr.batch(), with
+    status 400 if an operation failed and so none were applied.
+    '''
+    input_data = call.json()
+    session = session_of(call, input_data)
+    try:
+        results = helpr.batch(param(input_data, 'operations'), session)
+    except ValueError:
+        raise HTTPError(400)
+    status = 200
+    if any(result['result'] == 'failed' for result in results):
+        status = 400
+    return json_reply({
+        'results': results,
+    }, status)
+
+@route('/promote', 'POST')
+def promote(call):
+    '''
+    A route for helpr.promote()
+
+    Raises: 409 Conflict if helpr.promote() raises a ValueError.
+
+    Returns: {}
+    '''
+    try:
+        helpr.promote()
+    except ValueError:
+        raise HTTPError(409)
+    return json_reply({})
+
+@route('/end', 'DELETE')
+def end(call):
+    '''
+    A route for helpr.end()
+
+    Returns: {}
+    '''
+    helpr.end(session_of(call, call.json(silent=True)))
+    return json_reply({})
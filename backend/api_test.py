@@ -0,0 +1,160 @@
+'''
+Unit tests for the framework-free routes of the helpr application
+'''
+
+import gzip
+import json
+
+import pytest
+
+import api
+import config
+import helpr
+from admission import Admission
+from api import Call, handle
+from sessions import SessionRegistry, shard_of
+
+@pytest.fixture(name='sessions')
+def fixture_sessions(monkeypatch, tmp_path):
+    """
+    gives helpr a registry of its own, keeping its sessions in tmp_path, so
+    that no session's files are left behind for the next run.
+    """
+    for name, file_name in (("JOURNAL_FILE", "journal.jsonl"), ("SNAPSHOT_FILE", "snapshot.json"),
+                            ("SQLITE_FILE", "queue.sqlite3"), ("BINARY_FILE", "queue.bin")):
+        monkeypatch.setattr(config, name, str(tmp_path / file_name))
+    monkeypatch.setattr(helpr, "SESSIONS", SessionRegistry())
+
+def call(method, target, data=None, headers=None):
+    """
+    answers a request to target with data as its JSON body.
+    """
+    body = json.dumps(data).encode() if data is not None else b""
+    return handle(Call(method, target, headers or {}, body))
+
+def test_routes():
+    """
+    one student makes a request and a tutor helps them.
+    each route answers as server.py does, with CORS headers.
+    """
+    call('DELETE', '/end')
+    assert call('POST', '/make_request', {'zid':'z1234567','description':'help'}).status == 200
+    assert call('POST', '/make_request', {'zid':'z1234567','description':'help'}).status == 400
+    assert call('POST', '/make_request', {'zid':'z7654321'}).status == 400
+    reply = call('GET', '/remaining?zid=z1234567')
+    assert json.loads(reply.body) == {'remaining': 0}
+    assert reply.headers['Access-Control-Allow-Origin'] == '*'
+    assert call('POST', '/help', {'zid':'z1234567'}).status == 200
+    reply = call('GET', '/queue')
+    assert json.loads(reply.body) == [{'zid':'z1234567','description':'help','status':'receiving'}]
+    assert call('GET', '/help').status == 405
+    assert call('GET', '/nowhere').status == 404
+    call('DELETE', '/end')
+
+def test_etag():
+    """
+    the queue is fetched twice with the ETag of the first answer.
+    the second answer is 304 Not Modified until the queue changes.
+    """
+    call('DELETE', '/end')
+    etag = call('GET', '/queue').headers['ETag']
+    assert call('GET', '/queue', headers={'if-none-match': etag}).status == 304
+    call('POST', '/make_request', {'zid':'z1234567','description':'help'})
+    assert call('GET', '/queue', headers={'if-none-match': etag}).status == 200
+    call('DELETE', '/end')
+
+def test_gzip(monkeypatch):
+    """
+    the queue is fetched with and without gzip, once it is big enough to compress.
+    the compressed answer reads the same, with an ETag of its own.
+    """
+    monkeypatch.setattr(config, "GZIP_MIN_SIZE", 100)
+    call('DELETE', '/end')
+    call('POST', '/make_request', {'zid':'z1234567','description':'help'})
+    assert 'Content-Encoding' not in call('GET', '/queue', headers={'accept-encoding': 'gzip'}).headers
+    call('POST', '/make_request', {'zid':'z7654321','description':'help me with my assignment please'})
+    plain = call('GET', '/queue')
+    assert 'Content-Encoding' not in plain.headers
+    compressed = call('GET', '/queue', headers={'accept-encoding': 'deflate, gzip;q=0.5'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(compressed.body) == plain.body
+    assert compressed.headers['ETag'] != plain.headers['ETag']
+    assert call('GET', '/queue', headers={'accept-encoding': 'gzip',
+                                          'if-none-match': compressed.headers['ETag']}).status == 304
+    assert 'Content-Encoding' not in call('GET', '/queue', headers={'accept-encoding': 'gzip;q=0'}).headers
+    call('DELETE', '/end')
+
+def test_admission(monkeypatch):
+    """
+    a student makes requests faster than their rate limit while a tutor helps.
+    the student is turned away with 429 and a Retry-After; the tutor never is.
+    """
+    monkeypatch.setattr(config, "ZID_RATE_LIMITS", {'/make_request': (0.5, 2)})
+    monkeypatch.setattr(api, "ADMISSION", Admission())
+    body = json.dumps({'zid':'z1234567','description':'help'}).encode()
+    make_request = Call('POST', '/make_request', {}, body)
+    assert api.admit(make_request) is None
+    api.finish(make_request)
+    assert api.admit(make_request) is None
+    reply = api.admit(make_request)
+    assert reply.status == 429
+    assert reply.headers['Retry-After'] == '2'
+    assert api.admit(Call('POST', '/make_request', {}, body.replace(b'z1234567', b'z7654321'))) is None
+    for _ in range(5):
+        assert api.admit(Call('POST', '/help', {}, body)) is None
+
+def test_idempotency_key():
+    """
+    a tutor resolves a request and retries with the same key, then reuses the key for another call.
+    the retry is answered as the first call was; the other call is refused with 422.
+    """
+    call('DELETE', '/end')
+    call('POST', '/make_request', {'zid':'z1234567','description':'help'})
+    call('POST', '/help', {'zid':'z1234567'})
+    key = {'idempotency-key': 'resolve-z1234567'}
+    first = call('DELETE', '/resolve', {'zid':'z1234567'}, key)
+    assert first.status == 200
+    assert 'Idempotent-Replayed' not in first.headers
+    retry = call('DELETE', '/resolve', {'zid':'z1234567'}, key)
+    assert retry.status == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert call('DELETE', '/resolve', {'zid':'z1234567'}).status == 400
+    assert call('DELETE', '/cancel', {'zid':'z1234567'}, key).status == 422
+    call('DELETE', '/end')
+
+def test_preflight():
+    """
+    a browser asks whether it may post JSON to /make_request.
+    every method of the route and the headers asked for are allowed.
+    """
+    reply = call('OPTIONS', '/make_request', headers={'access-control-request-headers': 'content-type'})
+    assert reply.status == 200
+    assert reply.headers['Access-Control-Allow-Methods'] == 'POST, OPTIONS'
+    assert reply.headers['Access-Control-Allow-Headers'] == 'content-type'
+
+def test_unknown_session(sessions):
+    """
+    a page polls the queue of a session no request was ever made in.
+    it is answered 404, until a request is made in the session.
+    """
+    session = next(name for name in (f"poll{number}" for number in range(8))
+                   if shard_of(name) == config.SHARD)
+    assert call('GET', f'/queue?session={session}').status == 404
+    assert call('GET', f'/remaining?zid=z1234567&session={session}').status == 404
+    assert call('POST', '/make_request', {'zid':'z1234567','description':'help','session':session}).status == 200
+    reply = call('GET', f'/queue?session={session}')
+    assert json.loads(reply.body) == [{'zid':'z1234567','description':'help','status':'waiting'}]
+    call('DELETE', '/end', {'session':session})
+
+def test_redirect_to_shard(monkeypatch):
+    """
+    with two shards, a request for a session of the other shard is redirected
+    there.
+    """
+    monkeypatch.setattr(config, "SHARDS", 2)
+    names = (f"lab{number}" for number in range(8))
+    other = next(name for name in names if shard_of(name) != config.SHARD)
+    reply = call('GET', f'/queue?session={other}', headers={'host': 'localhost:8080'})
+    assert reply.status == 307
+    assert reply.headers['Location'] == f"http://localhost:{config.PORT + 1}/queue?session={other}"
@@ -0,0 +1,174 @@
+'''
+An asyncio server for the backend of the 'helpr' application, serving the same
+routes as server.py, see api.py, with nothing but the standard library.
+
+Connections are handled on one event loop, so thousands of students can keep
+a page open, polling with keep-alive or following /queue/stream, without a
+thread each. The routes themselves, which wait for the engine's lock and for
+storage to write and fsync, run on a pool of worker threads, so a slow write
+never stalls the other connections.
+
+Run from the backend directory, optionally with the shard to serve, as with
+server.py:
+
+    python3 async_server.py [shard]
+'''
+
+import asyncio
+import sys
+
+import api
+import config
+import helpr
+
+# the largest request head and body accepted, in bytes.
+MAX_HEAD = 64 * 1024
+MAX_BODY = 1024 * 1024
+
+class BadCall(Exception):
+    '''
+    A request that cannot be parsed, answered with status and then closed.
+    '''
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+async def read_call(reader):
+    '''
+    Reads the next request of a connection.
+
+    Raises:
+      BadCall: if the request is malformed or too large.
+
+    Returns:
+      (tuple) : (call, keep_alive), or None if the client closed the
+      connection.
+    '''
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.LimitOverrunError:
+        raise BadCall(431)
+    lines = head.decode('latin-1').split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise BadCall(400)
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    if 'transfer-encoding' in headers:
+        raise BadCall(411)
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise BadCall(400)
+    if not 0 <= length <= MAX_BODY:
+        raise BadCall(413)
+    body = await reader.readexactly(length)
+    connection = headers.get('connection', "").lower()
+    if version == "HTTP/1.1":
+        keep_alive = connection != "close"
+    else:
+        keep_alive = connection == "keep-alive"
+    return api.Call(method, target, headers, body), keep_alive
+
+def encode_head(status, headers):
+    lines = [f"HTTP/1.1 {status} {api.reason(status)}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+def encode_reply(reply, keep_alive):
+    headers = dict(reply.headers)
+    headers['Content-Length'] = len(reply.body)
+    headers['Connection'] = "keep-alive" if keep_alive else "close"
+    return encode_head(reply.status, headers) + reply.body
+
+async def stream(reply, writer):
+    '''
+    Sends the events of a Stream until the client goes away.
+
+    The engine calls the listener on whichever worker thread made the change,
+    so it only hands the event over to the event loop.
+    '''
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def listener(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    first_event = await loop.run_in_executor(None, reply.subscribe, listener)
+    try:
+        # the body has no length, so each event is sent as a chunk of it.
+        headers = dict(reply.headers, Connection="close")
+        headers['Transfer-Encoding'] = "chunked"
+        writer.write(encode_head(reply.status, headers) + api.chunk(api.event_text(first_event)))
+        await writer.drain()
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), config.STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                writer.write(api.chunk(api.KEEPALIVE))
+            else:
+                writer.write(api.chunk(api.event_text(event)))
+            await writer.drain()
+    except asyncio.CancelledError:
+        # the server is stopping, so the body is ended for the client.
+        if not writer.is_closing():
+            writer.write(api.chunk(b""))
+        raise
+    finally:
+        await loop.run_in_executor(None, reply.unsubscribe, listener)
+
+async def serve(reader, writer):
+    '''
+    Answers the requests of one connection in turn until either end closes it.
+    '''
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                request = await read_call(reader)
+            except BadCall as error:
+                writer.write(encode_reply(api.Reply(status=error.status), False))
+                await writer.drain()
+                break
+            if request is None:
+                break
+            call, keep_alive = request
+            # decided on the event loop, so that calls turned away never wait
+            # for a worker thread.
+            reply = api.admit(call)
+            if reply is None:
+                try:
+                    reply = await loop.run_in_executor(None, api.handle, call)
+                except Exception:
+                    reply = api.failure(call)
+                finally:
+                    api.finish(call)
+            if isinstance(reply, api.Stream):
+                await stream(reply, writer)
+                break
+            writer.write(encode_reply(reply, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    # the client went away, perhaps in the middle of a request.
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def main(port):
+    server = await asyncio.start_server(serve, "127.0.0.1", port, limit=MAX_HEAD)
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    # Listen for all requests to localhost at config.PORT plus the shard, or
+    # at config.FOLLOWER_PORT plus the shard when following.
+    asyncio.run(main(helpr.start(sys.argv[1:])))
@@ -0,0 +1,351 @@
+'''
+Benchmarks for the helpr queue engine.
+
+Run from the backend directory:
+
+    python3 benchmark.py durability
+    python3 benchmark.py servers
+    python3 benchmark.py startup
+    python3 benchmark.py columns
+    python3 benchmark.py reads
+    python3 benchmark.py encoding
+
+Each benchmark runs in a fresh temporary directory, so it never touches the
+journal of a running server.
+'''
+
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import api
+import helpr
+from engine import QueueEngine
+from journal import Journal
+from binary_storage import BinaryStorage
+from columns import RequestTable
+from sessions import SessionRegistry
+from sqlite_storage import SqliteStorage
+
+def run_clients(engine, clients, cycles):
+    '''
+    Runs clients threads that each take cycles students through make_request(),
+    help() and resolve(), acknowledging every operation like a server would.
+
+    Returns:
+      (float) : operations per second.
+    '''
+    def client(number):
+        zid = f"z{number:07d}"
+        for _ in range(cycles):
+            for operation, args in (('make_request', (zid, "help me")), ('help', (zid,)), ('resolve', (zid,))):
+                getattr(engine, operation)(*args)
+                engine.commit()
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return clients * cycles * 3 / elapsed
+
+def open_storage(backend, directory, durability):
+    if backend == "json":
+        return Journal(os.path.join(directory, "journal.jsonl"),
+                       os.path.join(directory, "snapshot.json"),
+                       durability)
+    if backend == "binary":
+        return BinaryStorage(os.path.join(directory, "queue.bin"), durability)
+    return SqliteStorage(os.path.join(directory, "queue.sqlite3"), durability)
+
+def benchmark_durability(clients=32, cycles=20):
+    '''
+    Prints the operations per second each storage backend sustains in each
+    durability mode.
+    '''
+    print(f"{clients} clients x {cycles * 3} operations each")
+    for backend in ("json", "sqlite", "binary"):
+        for durability in ("sync", "group-commit", "write-behind"):
+            with tempfile.TemporaryDirectory() as directory:
+                storage = open_storage(backend, directory, durability)
+                engine = QueueEngine(storage)
+                rate = run_clients(engine, clients, cycles)
+                storage.close()
+            print(f"{backend:>6} {durability:>13}: {rate:10.0f} requests/sec")
+
+def start_server(script, directory):
+    '''
+    Starts the server in script with directory as its working directory and
+    waits until it answers.
+
+    Returns:
+      (tuple) : (process, seconds from starting it to its first answer), or
+      (None, None) if it exited first, e.g. because Flask is not installed.
+    '''
+    import config
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, path], cwd=directory,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while process.poll() is None:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", config.PORT)
+            connection.request("GET", "/queue")
+            connection.getresponse().read()
+            connection.close()
+            return process, time.perf_counter() - start
+        except ConnectionError:
+            time.sleep(0.005)
+    return None, None
+
+def resident_memory(process):
+    '''
+    Returns the resident memory of a process and its children in MiB, e.g.
+    Flask's reloader, or None where /proc is not available.
+    '''
+    try:
+        pids = [process.pid] + [int(pid) for pid in open(f"/proc/{process.pid}/task/{process.pid}/children").read().split()]
+        total = 0
+        for pid in pids:
+            with open(f"/proc/{pid}/status") as FILE:
+                for line in FILE:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        return total / 1024
+    except OSError:
+        return None
+
+def run_http_clients(clients, requests):
+    '''
+    Runs clients threads that each send requests over one keep-alive
+    connection to the server at config.PORT, alternating between polling
+    /queue and taking a student through make_request, help and resolve.
+
+    Returns:
+      (float) : requests per second.
+    '''
+    import config
+
+    def client(number):
+        zid = f"z{number:07d}"
+        connection = http.client.HTTPConnection("127.0.0.1", config.PORT)
+        steps = [
+            ("GET", "/queue", None),
+            ("POST", "/make_request", {'zid': zid, 'description': "help me"}),
+            ("GET", "/queue", None),
+            ("POST", "/help", {'zid': zid}),
+            ("GET", "/queue", None),
+            ("DELETE", "/resolve", {'zid': zid}),
+        ]
+        for sent in range(requests):
+            method, path, data = steps[sent % len(steps)]
+            body = json.dumps(data) if data is not None else None
+            connection.request(method, path, body, {'Content-Type': 'application/json'})
+            connection.getresponse().read()
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return clients * requests / (time.perf_counter() - start)
+
+def benchmark_servers(clients=8, requests=600):
+    '''
+    Prints how long each entry point takes from starting to its first answer,
+    its resident memory after answering clients, and the requests per second
+    it sustains. Each is run in turn at config.PORT.
+    '''
+    print(f"{clients} clients x {requests} requests each")
+    for script in ("server.py", "async_server.py", "stdlib_server.py"):
+        with tempfile.TemporaryDirectory() as directory:
+            process, cold_start = start_server(script, directory)
+            if process is None:
+                print(f"{script:>16}: did not start")
+                continue
+            try:
+                rate = run_http_clients(clients, requests)
+                memory = resident_memory(process)
+            finally:
+                process.terminate()
+                process.wait()
+            memory = f"{memory:6.1f} MiB" if memory is not None else "     ?"
+            print(f"{script:>16}: {cold_start * 1000:6.0f} ms cold start, {memory}, {rate:8.0f} requests/sec")
+
+def benchmark_startup(size=10000, repeats=5):
+    '''
+    Prints how long an engine takes to load a saved session of size requests,
+    a third of them being helped, from each storage backend, and how long each
+    backend takes to store a help() and a resolve().
+    '''
+    print(f"{size} requests")
+    for backend in ("json", "sqlite", "binary"):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = QueueEngine(open_storage(backend, directory, "write-behind"))
+            engine.batch([('make_request', (f"z{number:07d}", "help me with my assignment"))
+                          for number in range(size)])
+            engine.batch([('help', (f"z{number:07d}",)) for number in range(0, size, 3)])
+            # a snapshot for the journal to load, as after a restart.
+            engine.storage.compact(engine.snapshot())
+            start = time.perf_counter()
+            for number in range(0, size - 1, 3):
+                engine.help(f"z{number + 1:07d}")
+                engine.resolve(f"z{number + 1:07d}")
+            operation = (time.perf_counter() - start) / len(range(0, size - 1, 3)) / 2
+            engine.storage.close()
+            best = None
+            for _ in range(repeats):
+                start = time.perf_counter()
+                storage = open_storage(backend, directory, "write-behind")
+                QueueEngine(storage)
+                elapsed = time.perf_counter() - start
+                storage.close()
+                best = elapsed if best is None else min(best, elapsed)
+        print(f"{backend:>6}: {best * 1000:7.1f} ms to load, {operation * 1e6:6.1f} us per operation")
+
+def benchmark_columns(size=50000, repeats=5):
+    '''
+    Prints the memory size requests, half of them being helped, take in a
+    RequestTable and as the list of dictionaries it replaced, and how long
+    counting them by status and priority takes in each.
+    '''
+    def build_table():
+        table = RequestTable()
+        for number in range(size):
+            table.add(f"z{number:07d}", "help me with my assignment", number % 4,
+                      'receiving' if number % 2 else 'waiting')
+        return table
+
+    def build_dictionaries():
+        return [{
+            'zid': f"z{number:07d}",
+            'description': "help me with my assignment",
+            'status': 'receiving' if number % 2 else 'waiting',
+            'priority': number % 4,
+        } for number in range(size)]
+
+    def count_table(table):
+        return table.count('waiting'), table.count('receiving'), table.priority_counts()
+
+    def count_dictionaries(requests):
+        statuses = Counter(request['status'] for request in requests)
+        return statuses, Counter(request['priority'] for request in requests)
+
+    print(f"{size} requests")
+    for name, build, count in (("columns", build_table, count_table),
+                               ("dicts", build_dictionaries, count_dictionaries)):
+        tracemalloc.start()
+        requests = build()
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            count(requests)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name:>7}: {memory / 2**20:6.1f} MiB, {best * 1000:6.2f} ms to count")
+
+def benchmark_reads(size=10000, bursts=40, burst=50):
+    '''
+    Prints how long remaining() takes, at the median, 99th percentile and
+    worst, while a tutor resolves burst requests at a time, in one batch, in
+    a queue of size requests, first reading the published versions and then,
+    for comparison, holding the engine for every read.
+    '''
+    print(f"{size} requests, {bursts} bursts of {burst} resolves")
+    for mode in ("versions", "locked"):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = QueueEngine(open_storage("json", directory, "group-commit"))
+            if mode == "locked":
+                # every read falls back to holding the engine.
+                engine.latest = lambda: None
+            engine.batch([('make_request', (f"z{number:07d}", "help me with my assignment"))
+                          for number in range(size)])
+            done = threading.Event()
+
+            def tutor():
+                for start in range(0, bursts * burst, burst):
+                    zids = [f"z{number:07d}" for number in range(start, start + burst)]
+                    engine.batch([('help', (zid,)) for zid in zids] + [('resolve', (zid,)) for zid in zids])
+                    time.sleep(0.001)
+                done.set()
+
+            timings = []
+            thread = threading.Thread(target=tutor)
+            thread.start()
+            number = size - 1
+            while not done.is_set():
+                start = time.perf_counter()
+                engine.remaining(f"z{number:07d}")
+                timings.append(time.perf_counter() - start)
+                time.sleep(0.0005)
+            thread.join()
+            engine.storage.close()
+        timings.sort()
+        median = timings[len(timings) // 2]
+        tail = timings[len(timings) * 99 // 100]
+        print(f"{mode:>9}: {median * 1e6:7.1f} us median, {tail * 1e6:7.1f} us p99, "
+              f"{timings[-1] * 1e6:8.1f} us worst, {len(timings)} reads")
+
+def benchmark_encoding(sizes=(1000, 10000), reads=200):
+    '''
+    Prints the CPU time api.py takes to answer a GET /queue, for queues of
+    each of sizes requests: when the queue has changed since the last GET, so
+    it cannot be answered from the cache, with and without gzip, and when it
+    has not.
+    '''
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            helpr.SESSIONS = SessionRegistry()
+            api.CACHE.clear()
+            engine = helpr.SESSIONS.get("default").engine
+            engine.batch([('make_request', (f"z{number:07d}", "help me with my assignment"))
+                          for number in range(size)])
+            line = []
+            for mode, headers in (("changed", {}), ("gzip", {'accept-encoding': "gzip"}),
+                                  ("unchanged", {})):
+                elapsed = 0
+                for number in range(reads):
+                    if mode != "unchanged":
+                        # a request near the middle of the queue being helped
+                        # and put back.
+                        zid = f"z{size // 2:07d}"
+                        if number % 2 == 0:
+                            engine.help(zid)
+                        else:
+                            engine.revert(zid)
+                    start = time.thread_time()
+                    reply = api.handle(api.Call('GET', "/queue", headers))
+                    elapsed += time.thread_time() - start
+                    assert reply.status == 200
+                line.append(f"{mode} {elapsed / reads * 1000:6.3f} ms")
+            engine.storage.close()
+            os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        print(f"{size:>6} requests: " + ", ".join(line) + f", {len(reply.body) / 1024:.0f} KiB")
+
+BENCHMARKS = {
+    'durability': benchmark_durability,
+    'servers': benchmark_servers,
+    'startup': benchmark_startup,
+    'columns': benchmark_columns,
+    'reads': benchmark_reads,
+    'encoding': benchmark_encoding,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,389 @@
+'''
+A storage backend that keeps the queue in a fixed-layout binary file accessed
+through mmap.
+
+Like the SQLite database, the file always holds the current state of the
+session, but an operation only writes the few bytes it changes in place:
+helping a student flips one status byte, resolving them flips another and adds
+one to their priority, and a new request is one record appended to a table.
+Nothing is parsed or encoded as JSON, so loading a large session is a matter of
+unpacking its tables.
+
+The file is laid out as:
+
+  header: the magic number, the layout version, the seq of the last operation,
+  the next order number, and the count and capacity of each table below.
+
+  zids: one ZID record (name, priority) per student who has made a request,
+  so every zid is stored once and the priority dictionary is this table.
+
+  requests: one REQUEST record (zid id, status, priority, order, description,
+  tutor) per request, in the order they were made. Removed requests keep
+  their record with the status REMOVED until the file is rewritten. The queue
+  is the other requests sorted by order.
+
+  heap: the UTF-8 bytes of the strings the tables point to, by offset and
+  length.
+
+When a table or the heap runs out of room, and when compact() is called, the
+file is rewritten with the live requests only and twice the room needed, to a
+temporary file renamed over the old one.
+'''
+
+import mmap
+import os
+import struct
+import threading
+from operator import itemgetter
+
+import config
+from storage import Storage, empty_snapshot
+
+MAGIC = b"HELPRQ\x00\x01"
+VERSION = 1
+
+HEADER = struct.Struct("<8sI4xqqqqqqq")
+ZID = struct.Struct("<IIq")
+REQUEST = struct.Struct("<IB3xiqIIiI")
+INTEGER = struct.Struct("<q")
+STRING = struct.Struct("<iI")
+
+# offsets of the fields written in place.
+SEQ_OFFSET = 16
+NEXT_ORDER_OFFSET = 24
+ZID_COUNT_OFFSET = 32
+REQUEST_COUNT_OFFSET = 48
+HEAP_USED_OFFSET = 64
+PRIORITY_OFFSET = 8
+STATUS_OFFSET = 4
+ORDER_OFFSET = 12
+TUTOR_OFFSET = 28
+
+REMOVED, WAITING, RECEIVING = 0, 1, 2
+STATUSES = {WAITING: 'waiting', RECEIVING: 'receiving'}
+STATUS_CODES = {'waiting': WAITING, 'receiving': RECEIVING}
+
+# the (offset, length) of no tutor.
+NO_TUTOR = (-1, 0)
+
+# the smallest room made for each table, and for the heap in bytes.
+MINIMUM_ROOM = 256
+MINIMUM_HEAP = 16 * 1024
+
+class DecodedSlices:
+    '''
+    Slices UTF-8 bytes by byte offsets like a str, decoding each slice.
+    '''
+
+    def __init__(self, data):
+        self.data = data
+
+    def __getitem__(self, index):
+        return self.data[index].decode()
+
+class BinaryStorage(Storage):
+    '''
+    Keeps the requests, the priority dictionary and the sequence number of the
+    last operation in a binary file mapped into memory.
+
+    zid_ids maps every zid to the index of its ZID record and request_ids maps
+    the zid of every request in the queue to the index of its REQUEST record,
+    so an operation finds the bytes it changes in O(1).
+
+    The file cannot be shared between processes.
+    '''
+
+    def __init__(self, path=None, durability=None, shared=None):
+        self.path = path or config.BINARY_FILE
+        self.durability = durability or config.DURABILITY
+        if self.durability not in ("sync", "group-commit", "write-behind"):
+            raise ValueError(f"unknown durability mode {self.durability!r}")
+        if config.SHARED_STORAGE if shared is None else shared:
+            raise ValueError("binary storage cannot be shared")
+        self.file = None
+        self.map = None
+        self.zid_ids = {}
+        self.request_ids = {}
+        # the (offset, length) of the tutor names already in the heap.
+        self.tutors = {}
+        self.removed = 0
+        # whether anything was written since the map was last flushed.
+        self.dirty = False
+        self.flush_lock = threading.Lock()
+        if not os.path.exists(self.path):
+            self.write(empty_snapshot(), 0)
+
+    def load(self):
+        if self.map is None:
+            with self.flush_lock:
+                self.open()
+        seq, _, zid_count, _, request_count, _, heap_used = self.header()
+        zids_start, requests_start, heap_start = self.regions()
+        heap = self.map[heap_start:heap_start + heap_used]
+        # the byte offsets of an ASCII heap are also offsets in the decoded
+        # text, so it is decoded all at once.
+        text = heap.decode() if heap.isascii() else DecodedSlices(heap)
+        zids = [(text[name:name + length], priority) for name, length, priority in ZID.iter_unpack(
+            self.map[zids_start:zids_start + zid_count * ZID.size])]
+        priority_dictionary = dict(zids)
+        names = [zid for zid, _ in zids]
+        self.zid_ids = {zid: zid_id for zid_id, zid in enumerate(names)}
+        records = list(REQUEST.iter_unpack(
+            self.map[requests_start:requests_start + request_count * REQUEST.size]))
+        live = [record for record in records if record[1] != REMOVED]
+        self.removed = len(records) - len(live)
+        self.request_ids = {names[record[0]]: request_id
+                            for request_id, record in enumerate(records) if record[1] != REMOVED}
+        # rewritten files and files never reprioritised are in order already.
+        orders = [record[3] for record in live]
+        if any(earlier > later for earlier, later in zip(orders, orders[1:])):
+            live.sort(key=itemgetter(3))
+        queue_list = [{
+            'zid': names[zid_id],
+            'description': text[description:description + description_length],
+            'status': STATUSES[status],
+            'priority': priority,
+        } for zid_id, status, priority, _, description, description_length, _, _ in live]
+        self.tutors = {}
+        for request, record in zip(queue_list, live):
+            tutor, tutor_length = record[6:]
+            if tutor != NO_TUTOR[0]:
+                request['tutor'] = text[tutor:tutor + tutor_length]
+                self.tutors[request['tutor']] = (tutor, tutor_length)
+        snapshot = {
+            'seq': seq,
+            'queue_list': queue_list,
+            'priority_dictionary': priority_dictionary,
+        }
+        return snapshot, []
+
+    def open(self):
+        self.file = open(self.path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, version = HEADER.unpack_from(self.map)[:2]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a helpr queue file")
+
+    def header(self):
+        '''
+        Returns (seq, next_order, zid_count, zid_capacity, request_count,
+        request_capacity, heap_used).
+        '''
+        return HEADER.unpack_from(self.map)[2:]
+
+    def regions(self):
+        '''
+        Returns the offsets of the zids table, the requests table and the heap.
+        '''
+        _, _, _, zid_capacity, _, request_capacity, _ = self.header()
+        requests_start = HEADER.size + zid_capacity * ZID.size
+        return HEADER.size, requests_start, requests_start + request_capacity * REQUEST.size
+
+    def set_integer(self, offset, value):
+        INTEGER.pack_into(self.map, offset, value)
+
+    def append(self, record):
+        self.append_all([record])
+
+    def append_all(self, records):
+        for record in records:
+            self.apply(record)
+        self.dirty = True
+        if self.durability == "sync":
+            self.flush()
+
+    def apply(self, record):
+        '''
+        Applies one operation to the file, writing only the bytes it changes
+        unless the file has to grow.
+        '''
+        if self.map is None:
+            self.load()
+        op = record['op']
+        args = record['args']
+        if op == 'make_request':
+            self.add(*args)
+        elif op == 'help':
+            # args is [zid] or [zid, tutor].
+            tutor = self.tutor_string(args[1]) if len(args) > 1 else NO_TUTOR
+            self.set_status(args[0], RECEIVING, tutor)
+        elif op == 'revert':
+            self.set_status(args[0], WAITING, NO_TUTOR)
+        elif op == 'cancel':
+            self.set_status(args[0], REMOVED, NO_TUTOR)
+        elif op == 'resolve':
+            self.set_status(args[0], REMOVED, NO_TUTOR)
+            priority_start = HEADER.size + self.zid_ids[args[0]] * ZID.size + PRIORITY_OFFSET
+            (priority,) = INTEGER.unpack_from(self.map, priority_start)
+            self.set_integer(priority_start, priority + 1)
+        elif op == 'reprioritise':
+            self.reprioritise()
+        elif op == 'end':
+            # only the seq survives the end of a session.
+            self.write(empty_snapshot(), record['seq'])
+        else:
+            raise ValueError(f"unknown operation {op!r}")
+        self.set_integer(SEQ_OFFSET, record['seq'])
+
+    def add(self, zid, description):
+        description = description.encode()
+        name = zid.encode() if zid not in self.zid_ids else b""
+        _, _, zid_count, zid_capacity, request_count, request_capacity, heap_used = self.header()
+        heap_capacity = len(self.map) - self.regions()[2]
+        if (zid_count == zid_capacity or request_count == request_capacity
+                or heap_used + len(description) + len(name) > heap_capacity):
+            self.grow(len(description) + len(name))
+        _, next_order, zid_count, _, request_count, _, _ = self.header()
+        zids_start, requests_start, _ = self.regions()
+        if zid not in self.zid_ids:
+            ZID.pack_into(self.map, zids_start + zid_count * ZID.size, *self.add_string(name), 0)
+            self.zid_ids[zid] = zid_count
+            self.set_integer(ZID_COUNT_OFFSET, zid_count + 1)
+        zid_id = self.zid_ids[zid]
+        (priority,) = INTEGER.unpack_from(self.map, zids_start + zid_id * ZID.size + PRIORITY_OFFSET)
+        REQUEST.pack_into(self.map, requests_start + request_count * REQUEST.size,
+                          zid_id, WAITING, priority, next_order,
+                          *self.add_string(description), *NO_TUTOR)
+        self.request_ids[zid] = request_count
+        # the record is complete before the header counts it.
+        self.set_integer(NEXT_ORDER_OFFSET, next_order + 1)
+        self.set_integer(REQUEST_COUNT_OFFSET, request_count + 1)
+
+    def add_string(self, string):
+        '''
+        Appends UTF-8 bytes to the heap, which the caller has made room for.
+
+        Returns:
+          (tuple) : their (offset, length) in the heap.
+        '''
+        heap_used = self.header()[6]
+        start = self.regions()[2] + heap_used
+        self.map[start:start + len(string)] = string
+        self.set_integer(HEAP_USED_OFFSET, heap_used + len(string))
+        return heap_used, len(string)
+
+    def tutor_string(self, tutor):
+        if tutor not in self.tutors:
+            string = tutor.encode()
+            heap_capacity = len(self.map) - self.regions()[2]
+            if self.header()[6] + len(string) > heap_capacity:
+                self.grow(len(string))
+            self.tutors[tutor] = self.add_string(string)
+        return self.tutors[tutor]
+
+    def set_status(self, zid, status, tutor):
+        request_start = self.regions()[1] + self.request_ids[zid] * REQUEST.size
+        self.map[request_start + STATUS_OFFSET] = status
+        STRING.pack_into(self.map, request_start + TUTOR_OFFSET, *tutor)
+        if status == REMOVED:
+            del self.request_ids[zid]
+            self.removed += 1
+
+    def reprioritise(self):
+        '''
+        Gives every request a new order number past the current ones, in order
+        of priority and then of their current order.
+        '''
+        next_order = self.header()[1]
+        requests_start = self.regions()[1]
+        ordered = []
+        for request_id in self.request_ids.values():
+            request_start = requests_start + request_id * REQUEST.size
+            priority, order = struct.unpack_from("<iq", self.map, request_start + PRIORITY_OFFSET)
+            ordered.append((priority, order, request_start))
+        ordered.sort()
+        for position, (_, _, request_start) in enumerate(ordered):
+            self.set_integer(request_start + ORDER_OFFSET, next_order + position)
+        self.set_integer(NEXT_ORDER_OFFSET, next_order + len(ordered))
+
+    def grow(self, needed):
+        '''
+        Rewrites the file with room for at least one more zid and request and
+        needed more bytes of heap.
+        '''
+        snapshot, _ = self.load()
+        self.write(snapshot, snapshot['seq'], needed)
+
+    def write(self, snapshot, seq, needed=0):
+        '''
+        Writes snapshot as a new file, with twice the room it needs, and maps
+        it in place of the old one.
+        '''
+        priority_dictionary = snapshot['priority_dictionary']
+        zid_ids = {zid: zid_id for zid_id, zid in enumerate(priority_dictionary)}
+        heap = bytearray()
+        strings = {}
+
+        def add_string(string):
+            if string not in strings:
+                encoded = string.encode()
+                strings[string] = (len(heap), len(encoded))
+                heap.extend(encoded)
+            return strings[string]
+
+        zid_table = b"".join(ZID.pack(*add_string(zid), priority)
+                             for zid, priority in priority_dictionary.items())
+        records = []
+        for order, request in enumerate(snapshot['queue_list']):
+            tutor = request.get('tutor')
+            records.append(REQUEST.pack(
+                zid_ids[request['zid']], STATUS_CODES[request['status']], request['priority'],
+                order, *add_string(request['description']),
+                *(add_string(tutor) if tutor is not None else NO_TUTOR)))
+        zid_capacity = max(2 * len(zid_ids) + 1, MINIMUM_ROOM)
+        request_capacity = max(2 * len(records) + 1, MINIMUM_ROOM)
+        heap_capacity = max(2 * (len(heap) + needed), MINIMUM_HEAP)
+        header = HEADER.pack(MAGIC, VERSION, seq, len(records), len(zid_ids), zid_capacity,
+                             len(records), request_capacity, len(heap))
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "wb") as FILE:
+            FILE.write(header)
+            FILE.write(zid_table)
+            FILE.write(bytes((zid_capacity - len(zid_ids)) * ZID.size))
+            FILE.write(b"".join(records))
+            FILE.write(bytes((request_capacity - len(records)) * REQUEST.size))
+            FILE.write(heap)
+            FILE.truncate(FILE.tell() + heap_capacity - len(heap))
+            FILE.flush()
+            os.fsync(FILE.fileno())
+        # commit() may be flushing the old map.
+        with self.flush_lock:
+            self.close()
+            os.replace(temporary_path, self.path)
+            self.open()
+        self.load()
+
+    def flush(self):
+        self.dirty = False
+        self.map.flush()
+
+    def commit(self):
+        '''
+        Flushes the map in "group-commit" mode, once for every operation
+        written since the last flush. "sync" has flushed already and
+        "write-behind" leaves it to the operating system.
+        '''
+        if self.durability != "group-commit":
+            return
+        with self.flush_lock:
+            if self.dirty and self.map is not None:
+                self.flush()
+
+    def needs_compaction(self):
+        return self.removed >= config.COMPACT_EVERY and self.removed > len(self.request_ids)
+
+    def compact(self, snapshot):
+        '''
+        Rewrites the file with the requests in the snapshot, dropping the
+        removed ones and the strings only they used.
+        '''
+        self.write(snapshot, snapshot['seq'])
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,49 @@
+'''
+Unit tests for the memory-mapped binary storage backend
+'''
+
+import os
+
+import config
+from binary_storage import BinaryStorage, MINIMUM_ROOM
+from engine import QueueEngine
+
+def test_binary_storage_grows(tmp_path):
+    """
+    more students make requests, with longer descriptions, than the file first
+    has room for. the file grows and keeps every request.
+    """
+    path = str(tmp_path / "queue.bin")
+    engine = QueueEngine(BinaryStorage(path))
+    first_size = os.path.getsize(path)
+    for number in range(MINIMUM_ROOM * 2):
+        engine.make_request(f"z{number:07d}", "help me " * 20)
+    engine.help_next("tutor1")
+    engine.storage.close()
+    assert os.path.getsize(path) > first_size
+
+    reloaded = QueueEngine(BinaryStorage(path))
+    assert reloaded.queue() == engine.queue()
+    assert reloaded.requests["z0000000"]['tutor'] == "tutor1"
+    reloaded.storage.close()
+
+def test_binary_storage_compacts(tmp_path, monkeypatch):
+    """
+    students make and cancel many requests.
+    the removed requests are dropped from the file once they outnumber the
+    others by config.COMPACT_EVERY.
+    """
+    monkeypatch.setattr(config, "COMPACT_EVERY", 10)
+    path = str(tmp_path / "queue.bin")
+    engine = QueueEngine(BinaryStorage(path))
+    engine.make_request("z1234567", "help me")
+    for _ in range(10):
+        engine.make_request("z7654321", "help me")
+        engine.cancel("z7654321")
+    assert engine.storage.removed == 0
+    engine.storage.close()
+
+    reloaded = QueueEngine(BinaryStorage(path))
+    assert [request['zid'] for request in reloaded.queue()] == ["z1234567"]
+    assert reloaded.seq == 21
+    reloaded.storage.close()
@@ -0,0 +1,96 @@
+'''
+Pushes each student their place in the queue as it changes.
+
+A student page subscribes once for the zid it shows and is sent a standing,
+see QueueEngine.standing(), whenever that zid's standing changes, instead of
+asking for it again and again. One broadcaster per session works out, after
+the queue changes, which of the subscribed students' standings have changed
+and tells only those students, so idle students cost nothing between changes.
+'''
+
+import threading
+
+class PositionBroadcaster:
+    '''
+    The subscriptions to the standings of the students in one engine's queue.
+
+    subscribers maps each listener to the zid it follows, and sent to the last
+    standing it was sent. The engine only wakes the broadcaster's thread, which
+    then works out the standings of every subscribed zid at once, so a burst of
+    changes is answered with one pass rather than one per change.
+
+    The standings are read from the engine's latest version, see versions.py,
+    without holding the engine, so that tutors' operations never wait for a
+    pass. Only the zids the version cannot tell about, e.g. as they have no
+    request, are looked up in the engine, all at once.
+    '''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.subscribers = {}
+        self.sent = {}
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.thread = None
+
+    def subscribe(self, zid, listener):
+        '''
+        Adds a listener for the standing of zid, starting the broadcaster the
+        first time.
+
+        Returns:
+          (dict) : the standing of zid as it is now. The listener is called
+          with its standing whenever it changes after that.
+        '''
+        with self.engine.reading(), self.lock:
+            if self.thread is None:
+                self.engine.subscribe(self.wake)
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            standing = self.engine.standing(zid)
+            self.subscribers[listener] = zid
+            self.sent[listener] = standing
+            return standing
+
+    def unsubscribe(self, listener):
+        with self.lock:
+            del self.subscribers[listener]
+            del self.sent[listener]
+
+    def wake(self, event):
+        # called by the engine while it is held, so it must not block.
+        self.changed.set()
+
+    def run(self):
+        while True:
+            self.changed.wait()
+            self.changed.clear()
+            self.broadcast()
+
+    def broadcast(self):
+        '''
+        Sends every listener whose zid's standing has changed the new standing.
+        '''
+        with self.lock:
+            subscribers = list(self.subscribers.items())
+        standings = {}
+        current = self.engine.latest()
+        if current is not None:
+            for _, zid in subscribers:
+                if zid not in standings:
+                    standing = current.standing(zid)
+                    if standing is not None:
+                        standings[zid] = standing
+        unknown = {zid for _, zid in subscribers} - standings.keys()
+        if unknown:
+            with self.engine.reading():
+                for zid in unknown:
+                    standings[zid] = self.engine.standing(zid)
+        with self.lock:
+            for listener, zid in subscribers:
+                # the listener may have unsubscribed since.
+                if listener not in self.subscribers:
+                    continue
+                if standings[zid] != self.sent[listener]:
+                    self.sent[listener] = standings[zid]
+                    listener(standings[zid])
@@ -0,0 +1,55 @@
+'''
+Unit tests for the broadcaster pushing students their standing in the queue
+'''
+
+import time
+from queue import SimpleQueue
+
+from broadcaster import PositionBroadcaster
+from engine import QueueEngine
+from storage import MemoryStorage
+
+def test_broadcaster_pushes_changed_standings():
+    """
+    three students follow their standing while the queue changes.
+    each is only sent a standing when theirs changes.
+    """
+    engine = QueueEngine(MemoryStorage())
+    broadcaster = PositionBroadcaster(engine)
+    engine.make_request("z0", "help")
+    engine.make_request("z1", "help")
+    pushed = {zid: SimpleQueue() for zid in ("z0", "z1", "z2")}
+    first = {zid: broadcaster.subscribe(zid, pushed[zid].put) for zid in pushed}
+    assert first == {
+        "z0": {'status': 'waiting', 'remaining': 0},
+        "z1": {'status': 'waiting', 'remaining': 1},
+        "z2": {'status': None, 'remaining': None},
+    }
+    engine.make_request("z2", "help")
+    assert pushed["z2"].get(timeout=5) == {'status': 'waiting', 'remaining': 2}
+    engine.help("z0")
+    assert pushed["z0"].get(timeout=5) == {'status': 'receiving', 'remaining': None}
+    assert pushed["z1"].get(timeout=5) == {'status': 'waiting', 'remaining': 0}
+    assert pushed["z2"].get(timeout=5) == {'status': 'waiting', 'remaining': 1}
+    broadcaster.unsubscribe(pushed["z2"].put)
+    engine.cancel("z1")
+    assert pushed["z1"].get(timeout=5) == {'status': None, 'remaining': None}
+    # the broadcaster has had time to push z0 anything it would.
+    time.sleep(0.05)
+    assert pushed["z0"].empty()
+    assert pushed["z2"].empty()
+
+def test_broadcaster_does_not_hold_engine():
+    """
+    a student's standing changes and the engine is held on, as by a long write.
+    the change is pushed without waiting for the engine.
+    """
+    engine = QueueEngine(MemoryStorage())
+    broadcaster = PositionBroadcaster(engine)
+    engine.make_request("z0", "help")
+    engine.make_request("z1", "help")
+    pushed = SimpleQueue()
+    broadcaster.subscribe("z1", pushed.put)
+    with engine.lock:
+        engine.cancel("z0")
+        assert pushed.get(timeout=5) == {'status': 'waiting', 'remaining': 0}
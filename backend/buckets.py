@@ -0,0 +1,149 @@
+'''
+The per-priority buckets the queue engine keeps its requests in.
+'''
+
+from bisect import bisect_right, insort
+
+from fenwick import FenwickTree
+from slots import SlotIndex
+
+class PriorityBuckets:
+    '''
+    Keeps requests in one FIFO bucket per priority, each a SlotIndex in the
+    order the requests have in the queue, so the prioritised order of the
+    queue, i.e. the queue stably sorted by priority, is the buckets in order
+    of priority without any sorting.
+
+    It is also an ordered index over the prioritised order, with the same
+    methods as SlotIndex: trees counts the requests of each status in each
+    priority, so the requests with a status ahead of a request are the ones in
+    lower priorities, a prefix sum over trees, plus the ones ahead of it in its
+    own bucket, in O(log n) altogether.
+
+    Buckets are kept once made, even when empty, so that their keys, and so
+    their cursors, are never reused. Priorities are integers >= 0.
+    '''
+
+    def __init__(self):
+        self.buckets = {}
+        # the priorities that have a bucket, in order.
+        self.priorities = []
+        self.priority_of = {}
+        self.trees = {
+            'waiting': FenwickTree(),
+            'receiving': FenwickTree(),
+        }
+
+    def bucket(self, priority):
+        if priority not in self.buckets:
+            self.buckets[priority] = SlotIndex()
+            insort(self.priorities, priority)
+        return self.buckets[priority]
+
+    def rebuild(self, requests):
+        '''
+        Puts the given requests, in queue order, into their buckets, in O(n).
+        '''
+        groups = {}
+        for request in requests:
+            groups.setdefault(request['priority'], []).append(request)
+        for priority in groups:
+            self.bucket(priority)
+        self.priority_of = {}
+        size = max(self.priorities, default=0) + 1
+        counts = {status: [0] * max(size, 16) for status in self.trees}
+        for priority, bucket in self.buckets.items():
+            group = groups.get(priority, [])
+            bucket.rebuild(group)
+            for request in group:
+                self.priority_of[request['zid']] = priority
+                counts[request['status']][priority] += 1
+        for status, tree in self.trees.items():
+            tree.build(counts[status])
+
+    def add(self, request):
+        '''
+        Adds a request to the end of the bucket of its priority.
+        '''
+        priority = request['priority']
+        if priority >= len(self.trees['waiting']):
+            for tree in self.trees.values():
+                tree.resize(max(len(tree) * 2, priority + 1))
+        self.bucket(priority).add(request)
+        self.priority_of[request['zid']] = priority
+        self.trees[request['status']].add(priority, 1)
+
+    def remove(self, request):
+        priority = self.priority_of.pop(request['zid'])
+        self.buckets[priority].remove(request)
+        self.trees[request['status']].add(priority, -1)
+
+    def change(self, request, old_status):
+        priority = self.priority_of[request['zid']]
+        self.buckets[priority].change(request, old_status)
+        self.trees[old_status].add(priority, -1)
+        self.trees[request['status']].add(priority, 1)
+
+    def ahead(self, request, status):
+        priority = self.priority_of[request['zid']]
+        return (self.trees[status].prefix_sum(priority)
+                + self.buckets[priority].ahead(request, status))
+
+    def highest(self):
+        '''
+        Returns the highest priority of any request, or -1 if there are none.
+        '''
+        for priority in reversed(self.priorities):
+            if self.buckets[priority].slots:
+                return priority
+        return -1
+
+    def after(self, zid):
+        '''
+        Returns the zid after zid's in prioritised order, or None if it is the
+        last.
+        '''
+        priority = self.priority_of[zid]
+        following = self.buckets[priority].after(zid)
+        if following is not None:
+            return following
+        for later in self.priorities[bisect_right(self.priorities, priority):]:
+            following = next(self.buckets[later].walk(-1), None)
+            if following is not None:
+                return following
+        return None
+
+    def count(self, status):
+        return self.trees[status].total()
+
+    def __iter__(self):
+        for priority in self.priorities:
+            yield from self.buckets[priority]
+
+    def cursor(self, zid):
+        '''
+        Returns a cursor naming a request's priority and its cursor in its
+        bucket, e.g. "2.1041.z1234567".
+        '''
+        priority = self.priority_of[zid]
+        return f"{priority}.{self.buckets[priority].cursor(zid)}"
+
+    def following(self, cursor=None, status=None):
+        '''
+        Yields the zids after cursor in prioritised order, as
+        SlotIndex.following() does.
+
+        Raises:
+          ValueError: if the cursor is malformed or can no longer be followed.
+        '''
+        if cursor is None:
+            for priority in self.priorities:
+                yield from self.buckets[priority].following(None, status)
+            return
+        parts = cursor.split('.', 1)
+        if len(parts) != 2 or int(parts[0]) not in self.buckets:
+            raise ValueError
+        priority = int(parts[0])
+        yield from self.buckets[priority].following(parts[1], status)
+        for later in self.priorities[bisect_right(self.priorities, priority):]:
+            yield from self.buckets[later].following(None, status)
@@ -0,0 +1,39 @@
+'''
+Unit tests for the priority buckets used by the queue engine
+'''
+
+from buckets import PriorityBuckets
+
+def request(zid, priority, status='waiting'):
+    return {'zid': zid, 'priority': priority, 'status': status}
+
+def test_buckets_keep_prioritised_order():
+    """
+    requests of several priorities are added and removed.
+    the buckets visit them stably sorted by priority.
+    """
+    buckets = PriorityBuckets()
+    requests = [request("z0", 2), request("z1", 0), request("z2", 2), request("z3", 1), request("z4", 0)]
+    for entry in requests:
+        buckets.add(entry)
+    assert list(buckets) == ["z1", "z4", "z3", "z0", "z2"]
+    buckets.remove(requests[4])
+    buckets.add(request("z5", 30))
+    assert list(buckets) == ["z1", "z3", "z0", "z2", "z5"]
+    buckets.rebuild(requests[:4])
+    assert list(buckets) == ["z1", "z3", "z0", "z2"]
+
+def test_buckets_count_ahead():
+    """
+    some requests are receiving.
+    ahead() counts the waiting requests in lower priorities and ahead in the same one.
+    """
+    buckets = PriorityBuckets()
+    requests = [request("z0", 1), request("z1", 0), request("z2", 1), request("z3", 0)]
+    for entry in requests:
+        buckets.add(entry)
+    requests[1]['status'] = 'receiving'
+    buckets.change(requests[1], 'waiting')
+    assert [buckets.ahead(entry, 'waiting') for entry in requests] == [1, 0, 2, 0]
+    assert list(buckets.following(buckets.cursor("z3"))) == ["z0", "z2"]
+    assert list(buckets.following(status='receiving')) == ["z1"]
@@ -0,0 +1,225 @@
+'''
+The columnar table the queue engine keeps its requests in.
+'''
+
+from array import array
+from collections import Counter
+from collections.abc import Mapping
+
+REMOVED, WAITING, RECEIVING = 0, 1, 2
+STATUSES = ('removed', 'waiting', 'receiving')
+STATUS_CODES = {'waiting': WAITING, 'receiving': RECEIVING}
+
+# the priority of the rows of removed requests, as priorities are >= 0.
+NO_PRIORITY = -1
+
+class RequestTable(Mapping):
+    '''
+    The requests of a queue by zid, kept as struct-of-arrays rather than a
+    dict per request.
+
+    Every request has a row: zids and descriptions are lists of strings,
+    statuses is a bytearray of status codes and priorities an array of 32-bit
+    integers, so a request costs a few bytes in each column instead of a
+    dictionary of its own. tutors maps the zid of each request given to a
+    tutor to the tutor. rows maps each zid to its row.
+
+    Rows are given out in the order requests are added and removed requests
+    leave a hole, so iterating over the table visits the requests in the order
+    they were added, as iterating over a dict would. The holes are dropped
+    once they are more than half of the rows, which moves the rows of the
+    other requests, so Request objects must not be kept across an add().
+
+    Counting the requests of a status, or of each priority, runs over whole
+    columns in C rather than over the requests in Python.
+    '''
+
+    def __init__(self, requests=()):
+        self.rows = {}
+        self.zids = []
+        self.descriptions = []
+        self.statuses = bytearray()
+        self.priorities = array('i')
+        self.tutors = {}
+        for request in requests:
+            self.add(request['zid'], request['description'], request['priority'], request['status'])
+            if 'tutor' in request:
+                self.tutors[request['zid']] = request['tutor']
+
+    def __getitem__(self, zid):
+        return Request(self, self.rows[zid], zid)
+
+    def get(self, zid, default=None):
+        row = self.rows.get(zid)
+        if row is None:
+            return default
+        return Request(self, row, zid)
+
+    def __contains__(self, zid):
+        return zid in self.rows
+
+    def __iter__(self):
+        for zid in self.zids:
+            if zid is not None:
+                yield zid
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, zid, description, priority, status='waiting'):
+        '''
+        Adds a request after every other request.
+
+        Returns:
+          (Request) : the request.
+        '''
+        if len(self.zids) > 2 * len(self.rows) + 16:
+            self.compact()
+        row = len(self.zids)
+        self.rows[zid] = row
+        self.zids.append(zid)
+        self.descriptions.append(description)
+        self.statuses.append(STATUS_CODES[status])
+        self.priorities.append(priority)
+        return Request(self, row, zid)
+
+    def __delitem__(self, zid):
+        row = self.rows.pop(zid)
+        self.zids[row] = None
+        self.descriptions[row] = None
+        self.statuses[row] = REMOVED
+        self.priorities[row] = NO_PRIORITY
+        self.tutors.pop(zid, None)
+
+    def compact(self):
+        '''
+        Drops the holes, keeping the requests in order, in O(n).
+        '''
+        self.reorder(list(self))
+
+    def reorder(self, zids):
+        '''
+        Puts the requests in the order of zids, which names every one of them
+        once, in O(n).
+        '''
+        rows = [self.rows[zid] for zid in zids]
+        self.zids = [self.zids[row] for row in rows]
+        self.descriptions = [self.descriptions[row] for row in rows]
+        self.statuses = bytearray(self.statuses[row] for row in rows)
+        self.priorities = array('i', [self.priorities[row] for row in rows])
+        self.rows = {zid: row for row, zid in enumerate(self.zids)}
+
+    def views(self, zids=None):
+        '''
+        Returns the requests of zids, or every request, in order, as tutors
+        see them: the dictionaries of their 'zid', 'description' and 'status'.
+        '''
+        if zids is None:
+            return [{
+                'zid': zid,
+                'description': description,
+                'status': STATUSES[status],
+            } for zid, description, status in zip(self.zids, self.descriptions, self.statuses)
+                if zid is not None]
+        rows = self.rows
+        descriptions = self.descriptions
+        statuses = self.statuses
+        return [{
+            'zid': zid,
+            'description': descriptions[rows[zid]],
+            'status': STATUSES[statuses[rows[zid]]],
+        } for zid in zids]
+
+    def records(self, zids=None):
+        '''
+        Returns the requests of zids, or every request, in order, as
+        dictionaries of their own, e.g. for a snapshot.
+        '''
+        if zids is None:
+            zids = self
+        records = []
+        for zid in zids:
+            row = self.rows[zid]
+            record = {
+                'zid': zid,
+                'description': self.descriptions[row],
+                'status': STATUSES[self.statuses[row]],
+                'priority': self.priorities[row],
+            }
+            if zid in self.tutors:
+                record['tutor'] = self.tutors[zid]
+            records.append(record)
+        return records
+
+    def live_priorities(self):
+        '''
+        Returns the priorities of the requests, in order.
+        '''
+        if len(self.zids) == len(self.rows):
+            return self.priorities.tolist()
+        return [priority for priority in self.priorities if priority != NO_PRIORITY]
+
+    def count(self, status):
+        return self.statuses.count(STATUS_CODES[status])
+
+    def priority_counts(self):
+        '''
+        Returns the number of requests of each priority.
+        '''
+        counts = Counter(self.priorities)
+        counts.pop(NO_PRIORITY, None)
+        return dict(sorted(counts.items()))
+
+class Request(Mapping):
+    '''
+    A view of one row of a RequestTable as a request dictionary with the keys
+    'zid', 'description', 'status', 'priority' and, if it was given to a
+    tutor, 'tutor'. 'status' and 'tutor' can be set, and 'tutor' popped.
+    '''
+
+    __slots__ = ('table', 'row', 'zid')
+
+    def __init__(self, table, row, zid):
+        self.table = table
+        self.row = row
+        self.zid = zid
+
+    def __getitem__(self, key):
+        if key == 'zid':
+            return self.zid
+        if key == 'status':
+            return STATUSES[self.table.statuses[self.row]]
+        if key == 'description':
+            return self.table.descriptions[self.row]
+        if key == 'priority':
+            return self.table.priorities[self.row]
+        if key == 'tutor':
+            return self.table.tutors[self.zid]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'status':
+            self.table.statuses[self.row] = STATUS_CODES[value]
+        elif key == 'tutor':
+            self.table.tutors[self.zid] = value
+        else:
+            raise KeyError(key)
+
+    def pop(self, key, default=None):
+        if key != 'tutor':
+            raise KeyError(key)
+        return self.table.tutors.pop(self.zid, default)
+
+    def __iter__(self):
+        yield from ('zid', 'description', 'status', 'priority')
+        if self.zid in self.table.tutors:
+            yield 'tutor'
+
+    def __len__(self):
+        return 5 if self.zid in self.table.tutors else 4
+
+    def copy(self):
+        '''
+        Returns the request as a dictionary of its own.
+        '''
+        return dict(self)
@@ -0,0 +1,57 @@
+'''
+Unit tests for the columnar request table used by the queue engine
+'''
+
+from columns import RequestTable
+
+def test_table_reads_like_dictionaries():
+    """
+    requests are added, changed and removed.
+    the table and its requests read like the dictionaries they replace.
+    """
+    table = RequestTable()
+    table.add("z0", "help", 1)
+    table.add("z1", "more help", 0)
+    table["z0"]['status'] = 'receiving'
+    table["z0"]['tutor'] = "tutor1"
+    assert table["z0"].copy() == {'zid': "z0", 'description': "help", 'status': 'receiving', 'priority': 1, 'tutor': "tutor1"}
+    assert dict(table["z1"]) == {'zid': "z1", 'description': "more help", 'status': 'waiting', 'priority': 0}
+    assert table.get("z2") is None
+    del table["z0"]
+    assert "z0" not in table
+    assert list(table) == ["z1"]
+    assert table.records() == [{'zid': "z1", 'description': "more help", 'status': 'waiting', 'priority': 0}]
+
+def test_table_compacts_and_reorders():
+    """
+    many requests are removed, leaving holes, and the rest reordered.
+    the table keeps the order and the columns only hold live requests.
+    """
+    table = RequestTable()
+    for n in range(100):
+        table.add(f"z{n}", "help", n % 3)
+    for n in range(0, 90):
+        del table[f"z{n}"]
+    table.add("z100", "help", 0)
+    assert len(table.zids) == len(table) == 11
+    assert list(table) == [f"z{n}" for n in range(90, 101)]
+    table.reorder(sorted(table, key=lambda zid: table[zid]['priority']))
+    assert table.live_priorities() == sorted(table.live_priorities())
+    assert table.views(["z100"]) == [{'zid': "z100", 'description': "help", 'status': 'waiting'}]
+    assert table.views() == table.views(list(table))
+
+def test_table_counts_columns():
+    """
+    requests of several statuses and priorities are in the table.
+    count() and priority_counts() skip removed requests.
+    """
+    table = RequestTable([
+        {'zid': "z0", 'description': "help", 'status': 'receiving', 'priority': 2, 'tutor': "tutor1"},
+        {'zid': "z1", 'description': "help", 'status': 'waiting', 'priority': 0},
+        {'zid': "z2", 'description': "help", 'status': 'waiting', 'priority': 2},
+    ])
+    del table["z1"]
+    assert table.count('waiting') == 1
+    assert table.count('receiving') == 1
+    assert table.priority_counts() == {2: 2}
+    assert table.tutors == {"z0": "tutor1"}
@@ -2,4 +2,121 @@
 Configuration for helpr
 '''
 
-PORT = 8080
\ No newline at end of file
+PORT = 8080
+
+# Where the queue is stored: "json" for the operation journal below, "sqlite"
+# for an SQLite database in SQLITE_FILE, or "binary" for a binary file in
+# BINARY_FILE, mapped into memory, which cannot be shared.
+STORAGE = "json"
+SQLITE_FILE = "queue.sqlite3"
+BINARY_FILE = "queue.bin"
+
+# Set SHARED_STORAGE to True when several server processes share the storage
+# above. Each process then locks the storage while it changes the queue, and
+# catches up with the other processes' changes before every operation.
+SHARED_STORAGE = False
+
+# Operations are appended to JOURNAL_FILE and replayed on startup on top of the
+# last snapshot in SNAPSHOT_FILE. Once COMPACT_EVERY operations have been
+# journalled, the state is written to a new snapshot and the journal emptied.
+JOURNAL_FILE = "queue_journal.jsonl"
+SNAPSHOT_FILE = "queue_snapshot.json"
+COMPACT_EVERY = 1000
+
+# How the journal trades durability for throughput: "sync" fsyncs every
+# operation before answering, "group-commit" shares one fsync between the
+# operations of concurrent requests, and "write-behind" answers at once and
+# persists in the background every FLUSH_INTERVAL seconds. With the "sqlite"
+# store, "group-commit" only syncs at SQLite's checkpoints instead, so the
+# last operations answered may be lost if the machine, rather than the
+# server, crashes; see sqlite_storage.py.
+DURABILITY = "sync"
+FLUSH_INTERVAL = 0.05
+
+# Set AUTO_PRIORITISE to True to keep the queue in prioritised order at all
+# times, as if reprioritise() ran after every new request, instead of only
+# when a tutor asks for it.
+AUTO_PRIORITISE = False
+
+# Seconds a tutor may go without a heartbeat before the scheduler decides they
+# have gone and gives the students they were helping to other tutors.
+TUTOR_TIMEOUT = 60
+
+# How many of the latest queue changes are kept for /queue/changes. Clients
+# further behind than this fetch the whole queue again.
+CHANGES_KEPT = 1000
+
+# Seconds between keepalive comments on an idle Server-Sent Events stream.
+STREAM_KEEPALIVE = 15
+
+# One server hosts a queue per help session, e.g. per lab, named by the
+# "session" parameter of every route. Requests without one are for
+# DEFAULT_SESSION, whose queue is kept in the files named above; every other
+# session gets its own files, e.g. "queue_journal.lab1.jsonl", once a route
+# other than a GET is called for it; GETs for a session without files are
+# answered 404. At most MAX_SESSIONS sessions are hosted at once.
+DEFAULT_SESSION = "default"
+MAX_SESSIONS = 64
+
+# Sessions are shared out between SHARDS server processes by a hash of their
+# name. Shard i listens on PORT + i and redirects requests for sessions of
+# other shards there. SHARD is the shard this process serves, set by
+# "python3 server.py <shard>".
+SHARDS = 1
+SHARD = 0
+
+# Every server listens for hot standby followers on REPLICATION_PORT plus its
+# shard, see replication.py. "python3 server.py <shard> --follow" starts a
+# follower of that shard's server instead, listening on FOLLOWER_PORT plus the
+# shard and trying to reach the server again every FOLLOW_RETRY seconds while
+# it cannot. A follower is only promoted if the server does not answer within
+# PROMOTE_TIMEOUT seconds.
+REPLICATION_PORT = 9080
+FOLLOWER_PORT = 8180
+FOLLOW_RETRY = 1
+PROMOTE_TIMEOUT = 1
+
+# The most messages a server keeps waiting to be sent to a follower. A follower
+# further behind than that is disconnected, and catches up from fresh
+# snapshots once it connects again, rather than the server holding every
+# operation it has not taken yet in memory.
+FOLLOWER_BACKLOG = 10000
+
+# Answers of GET /queue, /remaining and /statistics at least GZIP_MIN_SIZE
+# bytes long are compressed with gzip, at GZIP_LEVEL from 1, the fastest, to
+# 9, the smallest, for clients that accept it. Each answer is compressed once
+# per version of the queue, so after every change, and queues compress about
+# as well at 1 as at 6 in half the time. Smaller answers are not worth it.
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 1
+
+# The routes students call are rate limited, see admission.py. Each route in
+# ZID_RATE_LIMITS may be called by each zid, and each in ROUTE_RATE_LIMITS by
+# every zid together, at a rate of calls per second, with bursts of up to
+# burst calls, given as (rate, burst). Calls over a limit are answered 429 Too
+# Many Requests. The limits of at most RATE_LIMITED_ZIDS zids are tracked.
+ZID_RATE_LIMITS = {
+    '/make_request': (2, 30),
+    '/cancel': (2, 30),
+    '/remaining': (5, 30),
+    '/remaining/stream': (1, 10),
+}
+ROUTE_RATE_LIMITS = {
+    '/make_request': (200, 400),
+    '/cancel': (200, 400),
+    '/remaining': (1000, 2000),
+}
+RATE_LIMITED_ZIDS = 10000
+
+# At most READ_CONCURRENCY GET requests, other than event streams, are
+# answered at once. More are answered 503 Service Unavailable with a
+# Retry-After of READ_RETRY_AFTER seconds, rather than left waiting in front
+# of the tutors' operations.
+READ_CONCURRENCY = 16
+READ_RETRY_AFTER = 1
+
+# A POST or DELETE sent with an Idempotency-Key header is only done once, see
+# idempotency.py. Its answer is kept for IDEMPOTENCY_TTL seconds, for at most
+# IDEMPOTENCY_KEYS keys at once, and retries with the key get it again.
+IDEMPOTENCY_TTL = 600
+IDEMPOTENCY_KEYS = 10000
@@ -0,0 +1,26 @@
+'''
+Unit tests for encoding JSON
+'''
+
+import json
+
+import pytest
+
+import encoding
+
+@pytest.mark.parametrize('fast', [False, True])
+def test_encode(monkeypatch, fast):
+    """
+    values are encoded with orjson, if it is installed, and with json.
+    both encode them the same, as compact UTF-8 JSON json can read back.
+    """
+    if not fast:
+        monkeypatch.setattr(encoding, "orjson", None)
+    elif encoding.orjson is None:
+        pytest.skip("orjson is not installed")
+    value = {'queue': [{'zid': 'z1234567', 'description': 'help with "ü"\n', 'status': 'waiting'}],
+             'priorities': {0: 2, 1: 1}, 'cursor': None}
+    assert encoding.encode(value) == (b'{"queue":[{"zid":"z1234567","description":"help with \\"\xc3\xbc\\"\\n",'
+                                      b'"status":"waiting"}],"priorities":{"0":2,"1":1},"cursor":null}')
+    # a lone surrogate, as a JSON body can hold.
+    assert json.loads(encoding.encode({'description': "\ud800"})) == {'description': "\ud800"}
@@ -0,0 +1,754 @@
+'''
+The in-memory queue engine behind the helpr application.
+
+The engine keeps the queue and the priority dictionary resident in memory, so
+an operation no longer has to re-read both JSON files from disk. Requests are
+indexed by zid, so finding a request or changing its status is O(1), and the
+waiting requests are counted in Fenwick trees, so a student's position in the
+queue is found in O(log n). Operations are persisted by handing them to a
+storage backend, see storage.py.
+'''
+
+import threading
+from collections import deque
+from itertools import islice
+from contextlib import contextmanager
+
+import config
+from buckets import PriorityBuckets
+from columns import RequestTable
+from encoding import encode
+from slots import SlotIndex
+from storage import open_storage
+from versions import QueueVersion
+
+class QueueEngine:
+    '''
+    Holds the complete state of one help session in memory.
+
+    requests is a RequestTable of the requests indexed by (string) zid, which
+    reads like a dictionary of request dictionaries but keeps them in columns.
+    It remembers insertion order, so iterating over requests visits them in
+    queue order, and removing a request does not shift the others.
+
+    index is a SlotIndex over the queue, so remaining() is a single prefix sum
+    and a page of the queue is read without visiting the requests before it.
+    buckets also keeps the requests in a FIFO bucket per priority, so
+    reprioritise() only has to join the buckets up instead of sorting.
+    prioritised tells whether the queue is already in prioritised order, in
+    which case reprioritise() has nothing to do at all.
+
+    If auto_prioritise is set, the queue is always in prioritised order: a new
+    request joins the end of its priority's bucket rather than the end of the
+    queue, and buckets is the index the queue is read through. requests then
+    stays in the order the requests were made, so index is not kept.
+
+    The state is loaded from storage once, when the engine is created. After
+    that every operation that changes it is appended to storage, and seq counts
+    the operations made so far.
+
+    After every operation, the queue is also published as current, an
+    immutable QueueVersion, see versions.py, so that queue(), remaining() and
+    version() read it without waiting for the lock, unless other processes
+    share the storage.
+
+    Every operation holds lock, so the engine can be shared by the threads of a
+    server. Operations that change the queue also hold the storage's lock and
+    first replay what other processes sharing the storage have done, so no
+    process ever applies an operation to a stale queue.
+
+    listeners are called with a change event, see event(), after every change
+    to the queue, in the order the changes were made. Each event carries the
+    seq of its operation, and the last config.CHANGES_KEPT events are kept in
+    history so that clients can ask for just the changes they missed.
+
+    followers are called with the operations themselves, see follow(), so
+    that hot standby copies of the engine in other processes can apply them.
+    '''
+
+    def __init__(self, storage=None, auto_prioritise=None):
+        self.requests = RequestTable()
+        self.priority_dictionary = {}
+        if auto_prioritise is None:
+            auto_prioritise = config.AUTO_PRIORITISE
+        self.auto_prioritise = auto_prioritise
+        self.index = SlotIndex()
+        self.buckets = PriorityBuckets()
+        self.prioritised = True
+        # the index the queue is read through, and every index that is kept.
+        if self.auto_prioritise:
+            self.order = self.buckets
+            self.indexes = [self.buckets]
+        else:
+            self.order = self.index
+            self.indexes = [self.index, self.buckets]
+        self.seq = 0
+        self.storage = storage or open_storage()
+        self.lock = threading.RLock()
+        self.listeners = []
+        self.history = deque(maxlen=config.CHANGES_KEPT)
+        self.followers = []
+        # the key of each zid's request in the queue versions, see release().
+        self.keys = {}
+        self.next_key = 0
+        self.draft = self.current = QueueVersion(0, self.keys)
+        with self.lock:
+            self.load()
+
+    def load(self):
+        '''
+        Replaces the in-memory state with the stored snapshot and replays the
+        operations made after it.
+        '''
+        snapshot, records = self.storage.load()
+        self.restore(snapshot)
+        if records:
+            # the versions are made once, after the records, not for each one.
+            self.draft = None
+            for record in records:
+                getattr(self, 'apply_' + record['op'])(*record['args'])
+                self.seq = record['seq']
+            self.rekey()
+            self.release()
+
+    def restore(self, snapshot):
+        self.requests = RequestTable(snapshot['queue_list'])
+        self.priority_dictionary = snapshot['priority_dictionary']
+        self.seq = snapshot['seq']
+        self.renumber()
+        self.release()
+
+    def replay(self, records):
+        '''
+        Applies operations other processes have stored, telling listeners.
+        '''
+        for record in records:
+            getattr(self, 'apply_' + record['op'])(*record['args'])
+            self.seq = record['seq']
+            self.release()
+            self.publish(self.event(record['op'], *record['args']))
+        if records:
+            self.tell_followers({'records': records})
+
+    def catch_up(self):
+        '''
+        Replays the operations other processes sharing storage have made since
+        this engine last looked, or loads storage again if they are gone.
+        '''
+        records = self.storage.changes(self.seq)
+        if records is None:
+            self.reload()
+        else:
+            self.replay(records)
+
+    def reload(self):
+        '''
+        Loads storage again, telling listeners and followers to start again
+        from what was loaded.
+        '''
+        self.load()
+        # the events since the last one in history are unknown.
+        self.history.clear()
+        self.publish({'type': 'reset'})
+        self.tell_followers({'snapshot': self.snapshot()})
+
+    def snapshot(self):
+        return {
+            'seq': self.seq,
+            'queue_list': self.requests.records(self.ordered_zids()),
+            'priority_dictionary': self.priority_dictionary,
+        }
+
+    @contextmanager
+    def reading(self):
+        '''
+        Holds the engine for an operation that only reads the queue.
+        '''
+        with self.lock:
+            self.catch_up()
+            yield
+
+    @contextmanager
+    def writing(self):
+        '''
+        Holds the engine, and storage, for operations that change the queue.
+
+        If storing an operation raises, the queue is loaded from storage again
+        once storage is released, so that it is never left holding, or
+        publishing, an operation that was not stored.
+        '''
+        with self.lock:
+            seq = None
+            try:
+                with self.storage.locked():
+                    self.catch_up()
+                    seq = self.seq
+                    yield
+            except BaseException:
+                # seq only moves on once operations are applied and being
+                # stored; operations that raise themselves leave it as it was.
+                if seq is not None and self.seq != seq:
+                    self.reload()
+                raise
+
+    def perform(self, op, *args):
+        '''
+        Applies an operation to the queue with the engine's "apply_<op>" method
+        and stores it.
+
+        Raises:
+          KeyError, ValueError: as the operation does; nothing is stored then.
+        '''
+        with self.writing():
+            self.execute(op, *args)
+
+    def execute(self, op, *args):
+        '''
+        Applies, stores and publishes an operation. The caller holds writing().
+        '''
+        getattr(self, 'apply_' + op)(*args)
+        self.record(op, *args)
+        self.release()
+        self.publish(self.event(op, *args))
+
+    def batch(self, operations):
+        '''
+        Applies a list of (op, args) operations in order as one: if one of them
+        raises, the queue is restored as it was and none of them are stored.
+        Otherwise they are stored together, with one write to storage.
+
+        Raises:
+          KeyError, ValueError: as the failed operation does, with the index of
+          that operation in operations as the error's index.
+        '''
+        # an empty batch changes nothing, so nothing is stored or sent.
+        if not operations:
+            return
+        with self.writing():
+            # the requests are copied, as operations change them in place.
+            saved = {
+                'seq': self.seq,
+                'queue_list': self.requests.records(),
+                'priority_dictionary': dict(self.priority_dictionary),
+            }
+            events = []
+            for index, (op, args) in enumerate(operations):
+                try:
+                    getattr(self, 'apply_' + op)(*args)
+                except (KeyError, ValueError) as error:
+                    self.restore(saved)
+                    error.index = index
+                    raise
+                event = self.event(op, *args)
+                event['seq'] = self.seq + index + 1
+                events.append(event)
+            self.record_all(operations)
+            self.release()
+            for event in events:
+                self.publish(event)
+
+    def subscribe(self, listener):
+        '''
+        Adds a listener and returns a "queue" event holding queue() as it is at
+        that moment, so the listener's events start exactly where it ends.
+        '''
+        with self.reading():
+            self.listeners.append(listener)
+            return {
+                'type': 'queue',
+                'seq': self.seq,
+                'queue': self.queue(),
+            }
+
+    def unsubscribe(self, listener):
+        with self.lock:
+            self.listeners.remove(listener)
+
+    def publish(self, event):
+        '''
+        Stamps event with the current seq, unless it has one, keeps it in
+        history and calls every listener with it. Listeners are called while
+        the engine is held, so they must not block.
+        '''
+        event.setdefault('seq', self.seq)
+        if event['type'] != 'reset':
+            self.history.append(event)
+        for listener in self.listeners:
+            listener(event)
+
+    def follow(self, follower):
+        '''
+        Adds a follower, called with a {'snapshot': snapshot} message holding
+        the state as it is at that moment, then with {'records': records} for
+        the operations stored or replayed after it, in order, and with a new
+        snapshot whenever storage is loaded again. Followers are called while
+        the engine is held, so they must not block.
+        '''
+        with self.reading():
+            self.followers.append(follower)
+            follower({'snapshot': self.snapshot()})
+
+    def unfollow(self, follower):
+        with self.lock:
+            self.followers.remove(follower)
+
+    def tell_followers(self, message):
+        for follower in self.followers:
+            follower(message)
+
+    def take_over(self, storage):
+        '''
+        Moves the engine onto storage, replacing what storage holds with the
+        engine's state, e.g. when a follower becomes the primary.
+        '''
+        with self.lock:
+            storage.load()
+            storage.replace(self.snapshot())
+            self.storage.close()
+            self.storage = storage
+
+    def changes(self, since):
+        '''
+        Returns the change events after seq since, or tells the caller to fetch
+        the whole queue again if they are no longer in history.
+
+        Returns:
+          (dict) : {'seq': seq, 'changes': events} with the events after since
+          in order, or {'seq': seq, 'resync': True} if some of them are gone.
+          seq is the current seq in both cases.
+        '''
+        with self.reading():
+            # history holds every event after oldest_seq.
+            oldest_seq = self.history[0]['seq'] - 1 if self.history else self.seq
+            if since < oldest_seq or since > self.seq:
+                return {'seq': self.seq, 'resync': True}
+            changes = []
+            for event in reversed(self.history):
+                if event['seq'] <= since:
+                    break
+                changes.append(event)
+            changes.reverse()
+            return {'seq': self.seq, 'changes': changes}
+
+    def release(self):
+        '''
+        Publishes the queue as it is now as current, the version read without
+        holding the engine. Operations change draft, a version of their own,
+        alongside the queue, and are released once they are stored, so readers
+        never see an operation before it is stored, nor half of a batch. While
+        load() replays records, draft is None and left alone.
+        '''
+        self.current = self.draft.at(self.seq)
+
+    def latest(self):
+        '''
+        Returns current, the latest version of the queue, or None if reads
+        must hold the engine, as other processes share its storage and it has
+        to catch up with them first.
+        '''
+        if self.storage.shared:
+            return None
+        return self.current
+
+    def version(self):
+        current = self.latest()
+        if current is not None:
+            return current.seq
+        with self.reading():
+            return self.seq
+
+    def versioned(self, function, *args):
+        '''
+        Calls one of the engine's reading methods and returns its result along
+        with the seq of the queue it was read from.
+        '''
+        with self.reading():
+            return self.seq, function(*args)
+
+    def event(self, op, *args):
+        '''
+        Returns the change event describing an operation that has just been
+        applied to the queue. Events are dictionaries with a 'type' of:
+
+          "added": a request was added to the queue; 'request' is the request
+          in the form returned by queue(), and 'before' is the zid of the
+          request it was added in front of, or None if it is at the end.
+
+          "status": the request of 'zid' now has the status 'status'. If it
+          was given to a tutor by help_next(), 'tutor' is the tutor.
+
+          "removed": the request of 'zid' was resolved or cancelled.
+
+          "reordered": the queue was reordered; 'order' lists every zid in
+          the queue in its new order.
+
+          "cleared": the queue was emptied by end().
+
+          "reset": the queue was loaded again from storage, so anything
+          derived from earlier events must be fetched again.
+
+        publish() adds the 'seq' of the change to the event.
+        '''
+        if op == 'make_request':
+            return {
+                'type': 'added',
+                'request': self.view(self.requests[args[0]]),
+                # only auto_prioritise puts a request anywhere but the end.
+                'before': self.buckets.after(args[0]) if self.auto_prioritise else None,
+            }
+        if op == 'help':
+            event = {'type': 'status', 'zid': args[0], 'status': 'receiving'}
+            if len(args) > 1:
+                event['tutor'] = args[1]
+            return event
+        if op == 'revert':
+            return {'type': 'status', 'zid': args[0], 'status': 'waiting'}
+        if op in ('resolve', 'cancel'):
+            return {'type': 'removed', 'zid': args[0]}
+        if op == 'reprioritise':
+            return {'type': 'reordered', 'order': list(self.ordered_zids() or self.requests)}
+        return {'type': 'cleared'}
+
+    def renumber(self):
+        '''
+        Rebuilds every index from requests, in O(n).
+        '''
+        for index in self.indexes:
+            index.rebuild(self.requests.values())
+        priorities = self.requests.live_priorities()
+        self.prioritised = all(a <= b for a, b in zip(priorities, priorities[1:]))
+        self.rekey()
+
+    def rekey(self):
+        '''
+        Gives the requests new keys, in queue order, and makes draft again
+        from them, in O(n). The keys are counted up from 0, after the priority
+        if auto_prioritise is set, so that a new request's key puts it where
+        the queue has it.
+        '''
+        records = self.requests.records(self.ordered_zids())
+        if self.auto_prioritise:
+            keys = [(record['priority'], number) for number, record in enumerate(records)]
+        else:
+            keys = range(len(records))
+        # versions already released keep the keys they were made with.
+        self.keys = {record['zid']: key for key, record in zip(keys, records)}
+        self.next_key = len(records)
+        self.draft = QueueVersion.build(self.seq, self.keys, [
+            (key, record['zid'], record['description'], record['status'])
+            for key, record in zip(keys, records)
+        ])
+
+    def new_key(self, request):
+        if self.auto_prioritise:
+            key = (request['priority'], self.next_key)
+        else:
+            key = self.next_key
+        self.next_key += 1
+        self.keys[request['zid']] = key
+        return key
+
+    def ordered(self):
+        '''
+        Returns an iterator over the requests in queue order.
+        '''
+        zids = self.ordered_zids()
+        if zids is None:
+            return self.requests.values()
+        return (self.requests[zid] for zid in zids)
+
+    def ordered_zids(self):
+        '''
+        Returns an iterator over the zids in queue order, or None if requests
+        is already in queue order, so that RequestTable reads its columns in
+        order instead of looking every zid up.
+        '''
+        if self.auto_prioritise:
+            return iter(self.buckets)
+        return None
+
+    def record(self, op, *args):
+        '''
+        Stores an operation that has just been applied, compacting storage into
+        a snapshot once enough operations have piled up. The session is empty
+        after end(), so storage is always compacted then.
+        '''
+        self.record_all([(op, args)])
+
+    def record_all(self, operations):
+        '''
+        Stores a list of (op, args) operations that have just been applied, in
+        one write to storage.
+        '''
+        if not operations:
+            return
+        records = []
+        for op, args in operations:
+            self.seq += 1
+            records.append({
+                'seq': self.seq,
+                'op': op,
+                'args': list(args),
+            })
+        self.storage.append_all(records)
+        self.tell_followers({'records': records})
+        ended = any(op == 'end' for op, args in operations)
+        if ended or self.storage.needs_compaction():
+            self.storage.compact(self.snapshot())
+
+    def commit(self):
+        '''
+        Blocks until the operations applied so far are durable, as far as the
+        durability mode promises. Callers acknowledge an operation only after
+        this returns, without holding the engine, so that concurrent requests
+        can share a sync to disk.
+        '''
+        self.storage.commit()
+
+    def find(self, zid, status):
+        '''
+        Returns the request made by zid if it has the given status.
+
+        Raises:
+          KeyError: if zid has no request in the queue with the given status.
+        '''
+        request = self.requests.get(zid)
+        if request is None or request['status'] != status:
+            raise KeyError
+        return request
+
+    def queue(self):
+        return self.versioned_queue()[1]
+
+    def versioned_queue(self):
+        '''
+        Returns (seq, queue()), read from the latest version without holding
+        the engine where it can be.
+        '''
+        current = self.latest()
+        if current is not None:
+            return current.seq, current.queue()
+        with self.reading():
+            # creating queue for tutor to view.
+            return self.seq, self.requests.views(self.ordered_zids())
+
+    def encoded_queue(self):
+        '''
+        Returns (seq, queue) where queue is queue() encoded as JSON, joined
+        from the encodings the latest version keeps where it can be, so only
+        the requests that changed since are encoded again.
+        '''
+        current = self.latest()
+        if current is not None:
+            return current.seq, current.encoded_queue()
+        seq, queue = self.versioned_queue()
+        return seq, encode(queue)
+
+    def page(self, limit=None, cursor=None, status=None):
+        '''
+        Returns one page of queue(), optionally only the requests with a status.
+
+        A cursor names the last request of the previous page, see
+        SlotIndex.cursor(). It stays valid while requests are made and
+        removed, and carries on after its request if the queue is reordered.
+
+        Raises:
+          ValueError: if limit is not positive, status is not "waiting" or
+          "receiving", or cursor is malformed or can no longer be followed.
+
+        Returns:
+          (dict) : {'queue': queue, 'cursor': cursor} where queue is a list of
+          up to limit requests in the same form as queue(), and cursor is the
+          cursor of the page after it, or None if it is the last page.
+        '''
+        if limit is not None and limit < 1:
+            raise ValueError
+        if status not in (None, 'waiting', 'receiving'):
+            raise ValueError
+        with self.reading():
+            zids = self.order.following(cursor, status)
+            if limit is not None:
+                # one more than fits, to tell whether there is another page.
+                zids = islice(zids, limit + 1)
+            result = []
+            next_cursor = None
+            for zid in zids:
+                if len(result) == limit:
+                    next_cursor = self.order.cursor(result[-1]['zid'])
+                    break
+                result.append(self.view(self.requests[zid]))
+            return {'queue': result, 'cursor': next_cursor}
+
+    def view(self, request):
+        '''
+        Returns a request as tutors see it, without its priority.
+        '''
+        return {
+            'zid': request['zid'],
+            'description': request['description'],
+            'status': request['status'],
+        }
+
+    def remaining(self, zid):
+        return self.versioned_remaining(zid)[1]
+
+    def versioned_remaining(self, zid):
+        '''
+        Returns (seq, remaining(zid)), read from the latest version without
+        holding the engine where it can be. Only when the version cannot tell,
+        e.g. as zid has no waiting request, is the engine held to make sure.
+
+        Raises:
+          KeyError: if zid has no request in the queue that is waiting.
+        '''
+        current = self.latest()
+        if current is not None:
+            remaining = current.remaining(zid)
+            if remaining is not None:
+                return current.seq, remaining
+        with self.reading():
+            request = self.find(zid, 'waiting')
+            # counting the waiting requests ahead of this student's.
+            return self.seq, self.order.ahead(request, 'waiting')
+
+    def standing(self, zid):
+        '''
+        Returns where the request of zid stands, as students see it: {'status':
+        status, 'remaining': remaining} where status is None if zid has no
+        request, and remaining is as in remaining() while it is waiting, and
+        None otherwise.
+        '''
+        with self.reading():
+            request = self.requests.get(zid)
+            if request is None:
+                return {'status': None, 'remaining': None}
+            if request['status'] != 'waiting':
+                return {'status': request['status'], 'remaining': None}
+            return {'status': 'waiting', 'remaining': self.order.ahead(request, 'waiting')}
+
+    def statistics(self):
+        '''
+        Returns how many requests are waiting and receiving help, and how many
+        requests there are of each priority, counted over the columns of
+        requests rather than request by request.
+        '''
+        with self.reading():
+            return {
+                'waiting': self.requests.count('waiting'),
+                'receiving': self.requests.count('receiving'),
+                'priorities': self.requests.priority_counts(),
+            }
+
+    def make_request(self, zid, description):
+        self.perform('make_request', zid, description)
+
+    def help(self, zid):
+        self.perform('help', zid)
+
+    def help_next(self, tutor, prioritised=False):
+        '''
+        Helps the first waiting request in the queue, or in prioritised order,
+        assigning it to tutor, all while holding the engine so that concurrent
+        tutors are never given the same request. It is stored as a "help"
+        operation naming the request and the tutor.
+
+        Raises:
+          ValueError: if tutor is the empty string.
+
+        Returns:
+          (dict) : the request in the form returned by queue(), with its
+          'tutor', or None if no request is waiting.
+        '''
+        if tutor == "":
+            raise ValueError
+        with self.writing():
+            index = self.buckets if prioritised else self.order
+            zid = next(index.following(None, 'waiting'), None)
+            if zid is None:
+                return None
+            self.execute('help', zid, tutor)
+            return dict(self.view(self.requests[zid]), tutor=tutor)
+
+    def resolve(self, zid):
+        self.perform('resolve', zid)
+
+    def cancel(self, zid):
+        self.perform('cancel', zid)
+
+    def revert(self, zid):
+        self.perform('revert', zid)
+
+    def reprioritise(self):
+        self.perform('reprioritise')
+
+    def end(self):
+        self.perform('end')
+
+    def apply_make_request(self, zid, description):
+        # raising errors.
+        if description == "":
+            raise ValueError
+        if zid in self.requests:
+            raise KeyError
+        # appending new request.
+        if zid not in self.priority_dictionary:
+            self.priority_dictionary[zid] = 0
+        request = self.requests.add(zid, description, self.priority_dictionary[zid])
+        if self.prioritised and request['priority'] < self.buckets.highest():
+            self.prioritised = False
+        for index in self.indexes:
+            index.add(request)
+        if self.draft is not None:
+            self.draft = self.draft.insert((self.new_key(request), zid, description, 'waiting'))
+
+    def apply_help(self, zid, tutor=None):
+        request = self.find(zid, 'waiting')
+        request['status'] = 'receiving'
+        if tutor is not None:
+            request['tutor'] = tutor
+        for index in self.indexes:
+            index.change(request, 'waiting')
+        if self.draft is not None:
+            self.draft = self.draft.change(self.keys[zid], 'receiving')
+
+    def apply_resolve(self, zid):
+        request = self.find(zid, 'receiving')
+        for index in self.indexes:
+            index.remove(request)
+        del self.requests[zid]
+        if self.draft is not None:
+            self.draft = self.draft.remove(self.keys.pop(zid))
+        # lower priority of zid.
+        self.priority_dictionary[zid] += 1
+
+    def apply_cancel(self, zid):
+        request = self.find(zid, 'waiting')
+        for index in self.indexes:
+            index.remove(request)
+        del self.requests[zid]
+        if self.draft is not None:
+            self.draft = self.draft.remove(self.keys.pop(zid))
+
+    def apply_revert(self, zid):
+        request = self.find(zid, 'receiving')
+        request['status'] = 'waiting'
+        request.pop('tutor', None)
+        for index in self.indexes:
+            index.change(request, 'receiving')
+        if self.draft is not None:
+            self.draft = self.draft.change(self.keys[zid], 'waiting')
+
+    def apply_reprioritise(self):
+        if self.auto_prioritise or self.prioritised:
+            # the queue is already in prioritised order.
+            return
+        # the buckets, in order, are the queue stably sorted by priority.
+        self.requests.reorder(self.buckets)
+        self.index.rebuild(self.requests.values())
+        self.prioritised = True
+        self.rekey()
+
+    def apply_end(self):
+        self.requests = RequestTable()
+        self.priority_dictionary = {}
+        self.renumber()
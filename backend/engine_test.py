@@ -0,0 +1,335 @@
+'''
+Unit tests for the in-memory queue engine behind the helpr application
+'''
+
+import pytest
+
+from engine import QueueEngine
+from journal import Journal
+
+def test_engine_state_survives_reload():
+    """
+    one engine makes changes.
+    a fresh engine loaded from disk sees the same queue and priorities.
+    """
+    engine = QueueEngine()
+    engine.end()
+    engine.make_request("z1234567","help me")
+    engine.help("z1234567")
+    engine.resolve("z1234567")
+    engine.make_request("z1234567","big problem")
+    engine.make_request("z7654321","help me")
+    engine.help("z7654321")
+
+    reloaded = QueueEngine()
+    assert reloaded.queue() == engine.queue()
+    assert reloaded.priority_dictionary == {"z1234567": 1, "z7654321": 0}
+    engine.end()
+
+def test_engine_rolls_back_unstored_operation(tmp_path, monkeypatch):
+    """
+    storage fails to append a new request.
+    the engine and its latest version are left as storage holds them, and the next request is stored.
+    """
+    engine = QueueEngine(Journal(str(tmp_path / "q.jsonl"), str(tmp_path / "q.json")))
+    engine.make_request("z1234567","help me")
+
+    def fail(records):
+        raise OSError
+
+    monkeypatch.setattr(engine.storage, "append_all", fail)
+    with pytest.raises(OSError):
+        engine.make_request("z7654321","help me")
+    monkeypatch.undo()
+    assert engine.seq == 1
+    assert [entry['zid'] for entry in engine.queue()] == ["z1234567"]
+    assert engine.latest().queue() == engine.queue()
+    engine.make_request("z5258270","help me")
+    reloaded = QueueEngine(Journal(str(tmp_path / "q.jsonl"), str(tmp_path / "q.json")))
+    assert [entry['zid'] for entry in reloaded.queue()] == ["z1234567", "z5258270"]
+
+def test_engine_find_checks_status():
+    """
+    find() only returns a request with the expected status.
+    """
+    engine = QueueEngine()
+    engine.end()
+    engine.make_request("z1234567","help me")
+    assert engine.find("z1234567","waiting")['description'] == "help me"
+    with pytest.raises(KeyError):
+        engine.find("z1234567","receiving")
+    with pytest.raises(KeyError):
+        engine.find("z7654321","waiting")
+    engine.end()
+
+def test_engine_remaining_matches_queue_order():
+    """
+    many students come and go.
+    remaining() always counts the waiting requests ahead in queue().
+    """
+    engine = QueueEngine()
+    engine.end()
+    zids = [f"z{number:07d}" for number in range(40)]
+    for step in range(400):
+        zid = zids[(step * 7) % len(zids)]
+        request = engine.requests.get(zid)
+        if request is None:
+            engine.make_request(zid,"help me")
+        elif request['status'] == 'waiting':
+            if step % 3:
+                engine.help(zid)
+            else:
+                engine.cancel(zid)
+        elif step % 5:
+            engine.resolve(zid)
+        else:
+            engine.revert(zid)
+        if step % 97 == 0:
+            engine.reprioritise()
+        ahead = 0
+        for entry in engine.queue():
+            if entry['status'] != 'waiting':
+                continue
+            assert engine.remaining(entry['zid']) == ahead
+            ahead += 1
+    engine.end()
+
+def test_engine_pages_match_queue():
+    """
+    many students come and go.
+    reading queue() page by page, with or without a status, matches queue().
+    """
+    engine = QueueEngine()
+    engine.end()
+    zids = [f"z{number:07d}" for number in range(40)]
+    for step in range(400):
+        zid = zids[(step * 7) % len(zids)]
+        request = engine.requests.get(zid)
+        if request is None:
+            engine.make_request(zid,"help me")
+        elif request['status'] == 'waiting':
+            if step % 3:
+                engine.help(zid)
+            else:
+                engine.cancel(zid)
+        elif step % 5:
+            engine.resolve(zid)
+        else:
+            engine.revert(zid)
+        if step % 97 == 0:
+            engine.reprioritise()
+        if step % 10:
+            continue
+        for status in (None, 'waiting', 'receiving'):
+            expected = [entry for entry in engine.queue() if status in (None, entry['status'])]
+            pages = []
+            cursor = None
+            while True:
+                page = engine.page(3, cursor, status)
+                pages.extend(page['queue'])
+                cursor = page['cursor']
+                if cursor is None:
+                    break
+            assert pages == expected
+            assert engine.page(status=status) == {'queue': expected, 'cursor': None}
+    engine.end()
+
+def test_engine_cursor_survives_removal():
+    """
+    the request a cursor names is cancelled, and enough requests come and go that the slots are renumbered.
+    the next page starts at the first request after it still in the queue.
+    """
+    engine = QueueEngine()
+    engine.end()
+    for number in range(16):
+        engine.make_request(f"z{number:07d}","help me")
+    page = engine.page(1)
+    for number in range(12):
+        engine.cancel(f"z{number:07d}")
+    for number in range(16, 26):
+        engine.make_request(f"z{number:07d}","help me")
+    assert [entry['zid'] for entry in engine.page(5, page['cursor'])['queue']] == [
+        f"z{number:07d}" for number in range(12, 17)]
+    engine.end()
+
+def test_engine_cursor_survives_changes():
+    """
+    requests are made and removed between reading two pages.
+    the second page carries on after the first, even once the slots are renumbered.
+    """
+    engine = QueueEngine()
+    engine.end()
+    engine.make_request("z0000009","help me")
+    engine.help("z0000009")
+    engine.resolve("z0000009")
+    engine.make_request("z0000009","help me")
+    for number in range(6):
+        engine.make_request(f"z{number:07d}","help me")
+    page = engine.page(2)
+    assert [entry['zid'] for entry in page['queue']] == ["z0000009", "z0000000"]
+    engine.cancel("z0000009")
+    engine.cancel("z0000001")
+    engine.make_request("z0000006","help me")
+    assert [entry['zid'] for entry in engine.page(2, page['cursor'])['queue']] == ["z0000002", "z0000003"]
+    engine.make_request("z0000009","help me")
+    engine.reprioritise()
+    assert [entry['zid'] for entry in engine.page(2, page['cursor'])['queue']] == ["z0000002", "z0000003"]
+    engine.cancel("z0000000")
+    with pytest.raises(ValueError):
+        engine.page(2, page['cursor'])
+    with pytest.raises(ValueError):
+        engine.page(2, "not a cursor")
+    with pytest.raises(ValueError):
+        engine.page(0)
+    with pytest.raises(ValueError):
+        engine.page(2, status='resolved')
+    engine.end()
+
+def churn(engines, steps):
+    """
+    makes the same students come and go on every engine, yielding after
+    every step.
+    """
+    zids = [f"z{number:07d}" for number in range(40)]
+    for step in range(steps):
+        zid = zids[(step * 7) % len(zids)]
+        request = engines[0].requests.get(zid)
+        status = request['status'] if request else None
+        for engine in engines:
+            if status is None:
+                engine.make_request(zid,"help me")
+            elif status == 'waiting':
+                if step % 3:
+                    engine.help(zid)
+                else:
+                    engine.cancel(zid)
+            elif step % 5:
+                engine.resolve(zid)
+            else:
+                engine.revert(zid)
+        yield step
+
+def test_engine_reprioritise_is_stable_sort():
+    """
+    many students come and go, and the queue is reprioritised now and then.
+    reprioritise() always leaves the queue stably sorted by priority.
+    """
+    engine = QueueEngine()
+    engine.end()
+    for step in churn([engine], 400):
+        if step % 13:
+            continue
+        expected = sorted(engine.requests.values(), key=lambda request: request['priority'])
+        expected = [engine.view(request) for request in expected]
+        engine.reprioritise()
+        assert engine.queue() == expected
+    engine.end()
+
+def test_engine_auto_prioritise(tmp_path):
+    """
+    the same students come and go on an engine and an auto-prioritised engine.
+    the auto-prioritised queue is always the other queue stably sorted by
+    priority, and remaining() and pages follow it.
+    """
+    engine = QueueEngine(Journal(str(tmp_path / "a.jsonl"), str(tmp_path / "a.json")))
+    auto = QueueEngine(Journal(str(tmp_path / "b.jsonl"), str(tmp_path / "b.json")), auto_prioritise=True)
+    for step in churn([engine, auto], 400):
+        expected = sorted(engine.requests.values(), key=lambda request: request['priority'])
+        expected = [engine.view(request) for request in expected]
+        assert auto.queue() == expected
+        ahead = 0
+        for entry in expected:
+            if entry['status'] == 'waiting':
+                assert auto.remaining(entry['zid']) == ahead
+                ahead += 1
+        if step % 10 == 0:
+            for status in (None, 'waiting', 'receiving'):
+                pages = []
+                cursor = None
+                while True:
+                    page = auto.page(3, cursor, status)
+                    pages.extend(page['queue'])
+                    cursor = page['cursor']
+                    if cursor is None:
+                        break
+                assert pages == [entry for entry in expected if status in (None, entry['status'])]
+    auto.storage.close()
+    reloaded = QueueEngine(Journal(str(tmp_path / "b.jsonl"), str(tmp_path / "b.json")), auto_prioritise=True)
+    assert reloaded.queue() == auto.queue()
+    reloaded.storage.close()
+    engine.storage.close()
+
+def test_engine_auto_prioritise_events():
+    """
+    a student with a lower priority joins an auto-prioritised queue.
+    the added event places them in front of the first student with a higher one.
+    """
+    engine = QueueEngine(auto_prioritise=True)
+    engine.end()
+    engine.make_request("z1234567","help me")
+    engine.help("z1234567")
+    engine.resolve("z1234567")
+    engine.make_request("z1234567","help me")
+    events = []
+    engine.subscribe(events.append)
+    engine.make_request("z7654321","help me")
+    assert events[0]['before'] == "z1234567"
+    assert [entry['zid'] for entry in engine.queue()] == ["z7654321", "z1234567"]
+    engine.unsubscribe(events.append)
+    engine.end()
+
+def test_engine_publishes_change_events():
+    """
+    a listener is told about every change after it subscribed, in order.
+    """
+    engine = QueueEngine()
+    engine.end()
+    engine.make_request("z1234567","help me")
+    events = []
+    assert engine.subscribe(events.append) == {
+        'type': 'queue',
+        'seq': engine.seq,
+        'queue': [{'zid':'z1234567','description':'help me','status':'waiting'}],
+    }
+    seq = engine.seq
+    engine.make_request("z7654321","help me")
+    engine.help("z1234567")
+    with pytest.raises(KeyError):
+        engine.help("z1234567")
+    engine.resolve("z1234567")
+    engine.reprioritise()
+    engine.end()
+    engine.unsubscribe(events.append)
+    engine.make_request("z1234567","help me")
+    assert events == [
+        {'type': 'added', 'seq': seq + 1, 'request': {'zid':'z7654321','description':'help me','status':'waiting'}, 'before': None},
+        {'type': 'status', 'seq': seq + 2, 'zid': 'z1234567', 'status': 'receiving'},
+        {'type': 'removed', 'seq': seq + 3, 'zid': 'z1234567'},
+        {'type': 'reordered', 'seq': seq + 4, 'order': ['z7654321']},
+        {'type': 'cleared', 'seq': seq + 5},
+    ]
+    engine.end()
+
+def test_engine_changes_since(monkeypatch):
+    """
+    changes() returns the events after a seq while they are kept.
+    older seqs, and seqs from the future, must resync.
+    """
+    monkeypatch.setattr("config.CHANGES_KEPT", 3)
+    engine = QueueEngine()
+    engine.end()
+    seq = engine.seq
+    assert engine.changes(seq) == {'seq': seq, 'changes': []}
+    engine.make_request("z1234567","help me")
+    engine.make_request("z7654321","help me")
+    assert engine.changes(seq) == {'seq': seq + 2, 'changes': [
+        {'type': 'added', 'seq': seq + 1, 'request': {'zid':'z1234567','description':'help me','status':'waiting'}, 'before': None},
+        {'type': 'added', 'seq': seq + 2, 'request': {'zid':'z7654321','description':'help me','status':'waiting'}, 'before': None},
+    ]}
+    engine.help("z1234567")
+    engine.revert("z1234567")
+    assert engine.changes(seq + 3)['changes'] == [{'type': 'status', 'seq': seq + 4, 'zid': 'z1234567', 'status': 'waiting'}]
+    assert engine.changes(seq + 1)['changes'][0]['seq'] == seq + 2
+    assert engine.changes(seq) == {'seq': seq + 4, 'resync': True}
+    assert engine.changes(seq + 5) == {'seq': seq + 4, 'resync': True}
+    engine.end()
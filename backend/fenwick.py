@@ -0,0 +1,98 @@
+'''
+A Fenwick (binary indexed) tree used by the queue engine to count requests.
+'''
+
+class FenwickTree:
+    '''
+    Keeps an integer count for each slot 0..size-1 and answers "how much is
+    counted before this slot" in O(log n). Changing the count of one slot is
+    also O(log n).
+
+    The engine gives every request a slot in queue order and counts a slot as 1
+    while its request is waiting, so the prefix sum before a student's slot is
+    the number of waiting requests ahead of them.
+    '''
+
+    def __init__(self, size=0):
+        # tree[i] holds the sum of the slots (i - lowbit(i), i], 1-indexed.
+        self.tree = [0] * (size + 1)
+
+    def __len__(self):
+        return len(self.tree) - 1
+
+    def values(self):
+        '''
+        Returns the count of every slot as a list, in O(n).
+        '''
+        values = self.tree[1:]
+        size = len(values)
+        for i in range(size, 0, -1):
+            parent = i + (i & -i)
+            if parent <= size:
+                values[parent - 1] -= values[i - 1]
+        return values
+
+    def build(self, values):
+        '''
+        Replaces the counts of all slots with the given list, in O(n).
+        '''
+        size = len(values)
+        self.tree = [0] + list(values)
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                self.tree[parent] += self.tree[i]
+
+    def resize(self, size):
+        '''
+        Grows or shrinks the tree to hold size slots, keeping existing counts.
+        '''
+        values = self.values()
+        if size > len(values):
+            values.extend([0] * (size - len(values)))
+        else:
+            del values[size:]
+        self.build(values)
+
+    def add(self, slot, delta):
+        i = slot + 1
+        size = len(self.tree)
+        while i < size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, slot):
+        '''
+        Returns the sum of the counts of slots 0..slot-1.
+        '''
+        total = 0
+        i = slot
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def total(self):
+        return self.prefix_sum(len(self))
+
+    def find(self, k):
+        '''
+        Returns the slot holding the k-th counted item (counting from 0), i.e.
+        the smallest slot s with prefix_sum(s + 1) > k.
+
+        Raises:
+          IndexError: if fewer than k + 1 items are counted.
+        '''
+        if k < 0 or k >= self.total():
+            raise IndexError
+        position = 0
+        step = 1
+        while step * 2 < len(self.tree):
+            step *= 2
+        while step > 0:
+            following = position + step
+            if following < len(self.tree) and self.tree[following] <= k:
+                position = following
+                k -= self.tree[following]
+            step //= 2
+        return position
@@ -0,0 +1,34 @@
+'''
+Unit tests for the Fenwick tree used by the queue engine
+'''
+
+import pytest
+
+from fenwick import FenwickTree
+
+def test_prefix_sum_and_find():
+    """
+    counts set on a few slots are summed and found.
+    """
+    tree = FenwickTree(8)
+    for slot in (1, 2, 5):
+        tree.add(slot, 1)
+    assert [tree.prefix_sum(slot) for slot in range(9)] == [0, 0, 1, 2, 2, 2, 3, 3, 3]
+    assert tree.total() == 3
+    assert [tree.find(k) for k in range(3)] == [1, 2, 5]
+    with pytest.raises(IndexError):
+        tree.find(3)
+
+def test_build_values_and_resize():
+    """
+    build() and values() are inverses, and resize() keeps the counts.
+    """
+    tree = FenwickTree()
+    tree.build([1, 0, 1, 1, 0])
+    assert tree.values() == [1, 0, 1, 1, 0]
+    tree.resize(11)
+    tree.add(10, 1)
+    assert tree.values() == [1, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1]
+    assert tree.prefix_sum(10) == 3
+    tree.resize(3)
+    assert tree.values() == [1, 0, 1]
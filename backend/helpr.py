@@ -1,53 +1,27 @@
 '''
 The core functions of the helpr application.
+
+Every function also takes the session it is for, e.g. one lab of a course, as
+its last param. Each session has a queue of its own, so the requests of one
+session are never seen by another. Without a session, the functions act on
+config.DEFAULT_SESSION. A session that is not a valid session id, belongs to
+another shard or would be one more than config.MAX_SESSIONS raises ValueError,
+see sessions.py.
 '''
 
-import json
+import config
+from replication import Follower, serve_followers
+from sessions import SessionRegistry
 
-# Put the global variables that hold the complete state of the application here.
+# The sessions hold the complete state of the application in memory, each
+# with a queue engine and a scheduler sharing its requests out between tutors.
+SESSIONS = SessionRegistry()
 
-# queue is a list of dictionaries in the form:
-# {
-#     'zid': zid,
-#     'description': description,
-#     'status': status,
-#     'priority': priority,
-# }
-def load_queue_list():
-    try:
-        with open("queue_list.json","r") as FILE:
-            queue_list = json.load(FILE)
-            return queue_list
-    # "queue_list.json" does not exist.
-    except IOError:
-        queue_list = []
-        save_queue_list(queue_list)
-        return queue_list
-
-def save_queue_list(queue_list):
-    with open("queue_list.json","w+") as FILE:
-        json.dump(queue_list,FILE)
-        pass
-
-# dictionary of (int) priorities indexed by (string) zid.
-# zid with lowest priority value has received the least help.
-def load_priority_dictionary():
-    try:
-        with open("priority_dictionary.json","r") as FILE:
-            priority_dictionary = json.load(FILE)
-            return priority_dictionary
-    # "priority_dictionary.json" does not exist.
-    except IOError:
-        priority_dictionary = {}
-        save_priority_dictionary(priority_dictionary)
-        return priority_dictionary
-
-def save_priority_dictionary(priority_dictionary):
-    with open("priority_dictionary.json","w+") as FILE:
-        json.dump(priority_dictionary,FILE)
-        pass
-
-def make_request(zid, description):
+# The Follower copying SESSIONS from the primary, if this server was started
+# as a hot standby, see replication.py.
+FOLLOWER = None
+
+def make_request(zid, description, session=config.DEFAULT_SESSION):
     '''
     Used by students to make a request. The request is put in the queue with a
     "waiting" status.
@@ -64,29 +38,11 @@ def make_request(zid, description):
       KeyError: if there is already a request from this particular student in
       the queue.
     '''
-    queue_list = load_queue_list()
-    priority_dictionary = load_priority_dictionary()
-    # raising errors.
-    if description == "":
-        raise ValueError
-    for request in queue_list:
-        if request['zid'] == zid:
-            raise KeyError
-    # appending new request.
-    if zid not in priority_dictionary:
-        priority_dictionary[zid] = 0
-    new_request = {
-        'zid': zid,
-        'description': description,
-        'status': 'waiting',
-        'priority': priority_dictionary[zid],
-    }
-    queue_list.append(new_request)
-    save_queue_list(queue_list)
-    save_priority_dictionary(priority_dictionary)
-    pass
-
-def queue():
+    engine = SESSIONS.get(session).engine
+    engine.make_request(zid, description)
+    engine.commit()
+
+def queue(session=config.DEFAULT_SESSION):
     '''
     Used by tutors to view all the students in the queue in order.
 
@@ -96,19 +52,37 @@ def queue():
       the description of their problem, and the status of their request (either
       "waiting" or "receiving").
     '''
-    queue_list = load_queue_list()
-    # creating queue for tutor to view.
-    result = []
-    for request in queue_list:
-        new_dict = {
-            'zid': request['zid'],
-            'description': request['description'],
-            'status': request['status'],
-        }
-        result.append(new_dict)
-    return result
+    engine = SESSIONS.get(session).engine
+    return engine.queue()
+
+def queue_page(limit=None, cursor=None, status=None, session=config.DEFAULT_SESSION):
+    '''
+    Used by tutors to view one page of a large queue at a time, optionally only
+    the requests with one status.
+
+    Params:
+      limit (int): The most requests to return, or None for all of them.
+
+      cursor (str): The cursor returned with the previous page, or None for
+      the first page. Cursors stay valid while requests are made and removed.
 
-def remaining(zid):
+      status (str): "waiting" or "receiving" to return only the requests with
+      that status, or None for every request.
+
+    Raises:
+      ValueError: if limit is not positive, status is not "waiting" or
+      "receiving", or the cursor is malformed or can no longer be followed
+      because the queue was reordered and its request has left the queue.
+
+    Returns:
+      (dict) : {'queue': queue, 'cursor': cursor} where queue is a list of
+      requests in the same format as queue(), in queue order, and cursor is
+      the cursor of the next page, or None if there are no more requests.
+    '''
+    engine = SESSIONS.get(session).engine
+    return engine.page(limit, cursor, status)
+
+def remaining(zid, session=config.DEFAULT_SESSION):
     '''
     Used by students to see how many requests there are ahead of theirs in the
     queue that also have a "waiting" status.
@@ -123,28 +97,23 @@ def remaining(zid):
     Returns:
       (int) : The position as a number >= 0
     '''
-    queue_list = load_queue_list()
-    # raising errors.
-    is_waiting_in_queue = False
-    for request in queue_list:
-        if request['zid'] == zid and request['status'] == 'waiting':
-            is_waiting_in_queue = True
-            break
-    if not is_waiting_in_queue:
-        raise KeyError
-    # finding position of student in queue (out of the students waiting).
-    position = 0
-    for request in queue_list:
-        # ignore students that are not waiting.
-        if request['status'] != 'waiting':
-            continue
-        # the request is in waiting status.
-        if request['zid'] == zid:
-            break
-        position += 1
-    return position
-
-def help(zid):
+    engine = SESSIONS.get(session).engine
+    return engine.remaining(zid)
+
+def statistics(session=config.DEFAULT_SESSION):
+    '''
+    Used by tutors to see how busy the queue is at a glance.
+
+    Returns:
+      (dict) : { 'waiting', 'receiving', 'priorities' } where waiting and
+      receiving are the numbers of requests with each status, and priorities
+      maps each priority, as a number >= 0, to the number of requests in the
+      queue with it, lowest first.
+    '''
+    engine = SESSIONS.get(session).engine
+    return engine.statistics()
+
+def help(zid, session=config.DEFAULT_SESSION):
     '''
     Used by tutors to indicate that a student is getting help with their
     request. It sets the status of the request to "receiving".
@@ -156,24 +125,36 @@ def help(zid):
       KeyError: if the given student does not have a request with a "waiting"
       status.
     '''
-    queue_list = load_queue_list()
-    # raising errors.
-    is_waiting_in_queue = False
-    for request in queue_list:
-        if request['zid'] == zid and request['status'] == 'waiting':
-            is_waiting_in_queue = True
-            break
-    if not is_waiting_in_queue:
-        raise KeyError
-    # setting status of request to be receiving.
-    for request in queue_list:
-        if request['zid'] == zid:
-            request['status'] = 'receiving'
-            break
-    save_queue_list(queue_list)
-    pass
-
-def resolve(zid):
+    engine = SESSIONS.get(session).engine
+    engine.help(zid)
+    engine.commit()
+
+def help_next(tutor, prioritised=False, session=config.DEFAULT_SESSION):
+    '''
+    Used by tutors to start helping the next student without looking through
+    the queue first. The first request in the queue with a "waiting" status is
+    given the status "receiving" and assigned to the tutor. Each request is
+    only ever given to one tutor, however many ask at once.
+
+    Params:
+      tutor (str): The name of the tutor asking.
+
+      prioritised (bool): Take the first waiting request in the order
+      reprioritise() would put the queue in, instead of the queue's own order.
+
+    Raises:
+      ValueError: if tutor is the empty string.
+
+    Returns:
+      (dict) : The request, with the keys { 'zid', 'description', 'status',
+      'tutor' }, or None if there is no request with a "waiting" status.
+    '''
+    engine = SESSIONS.get(session).engine
+    request = engine.help_next(tutor, prioritised)
+    engine.commit()
+    return request
+
+def resolve(zid, session=config.DEFAULT_SESSION):
     '''
     Used by tutors to remove a request from the queue when it has been resolved.
 
@@ -184,28 +165,11 @@ def resolve(zid):
       KeyError: if the given student does not have a request in the queue with a
       "receiving" status.
     '''
-    queue_list = load_queue_list()
-    priority_dictionary = load_priority_dictionary()
-    # raising errors.
-    is_receiving_in_queue = False
-    for request in queue_list:
-        if request['zid'] == zid and request['status'] == 'receiving':
-            is_receiving_in_queue = True
-            break
-    if not is_receiving_in_queue:
-        raise KeyError
-    # resolving request.
-    for request in queue_list:
-        if request['zid'] == zid and request['status'] == 'receiving':
-            queue_list.remove(request)
-            # lower priority of zid.
-            priority_dictionary[zid] += 1
-            break
-    save_queue_list(queue_list)
-    save_priority_dictionary(priority_dictionary)
-    pass 
-
-def cancel(zid):
+    engine = SESSIONS.get(session).engine
+    engine.resolve(zid)
+    engine.commit()
+
+def cancel(zid, session=config.DEFAULT_SESSION):
     '''
     Used by students to remove their request from the queue in the event they
     solved the problem themselves before a tutor was a available to help them.
@@ -220,24 +184,11 @@ def cancel(zid):
       KeyError: If the student does not have a request in the queue with a
       "waiting" status.
     '''
-    queue_list = load_queue_list()
-    # raising errors.
-    is_waiting_in_queue = False
-    for request in queue_list:
-        if request['zid'] == zid and request['status'] == 'waiting':
-            is_waiting_in_queue = True
-            break
-    if not is_waiting_in_queue:
-        raise KeyError
-    # cancelling request.
-    for request in queue_list:
-        if request['zid'] == zid and request['status'] == 'waiting':
-            queue_list.remove(request)
-            break
-    save_queue_list(queue_list)
-    pass 
-
-def revert(zid):
+    engine = SESSIONS.get(session).engine
+    engine.cancel(zid)
+    engine.commit()
+
+def revert(zid, session=config.DEFAULT_SESSION):
     '''
     Used by tutors in the event they cannot continuing helping the student. This
     function sets the status of student's request back to "waiting" so that
@@ -250,24 +201,11 @@ def revert(zid):
       KeyError: If the student does not have a request in the queue with a
       "receiving" status.
     '''
-    queue_list = load_queue_list()
-    # raising errors.
-    is_receiving_in_queue = False
-    for request in queue_list:
-        if request['zid'] == zid and request['status'] == 'receiving':
-            is_receiving_in_queue = True
-            break
-    if not is_receiving_in_queue:
-        raise KeyError
-    # reverting request.
-    for request in queue_list:
-        if request['zid'] == zid and request['status'] == 'receiving':
-            request['status'] = 'waiting'
-            break
-    save_queue_list(queue_list)
-    pass 
-
-def reprioritise():
+    engine = SESSIONS.get(session).engine
+    engine.revert(zid)
+    engine.commit()
+
+def reprioritise(session=config.DEFAULT_SESSION):
     '''
     Used by tutors toward the end of the help session to prioritize the students
     who have received the least help so far.
@@ -277,22 +215,392 @@ def reprioritise():
     ordering is otherwise preserved; i.e. if a student has made the same number
     of requests as another student, but was ahead of them in the queue, after
     reprioritise() is called, they should still be ahead of them in the queue.
-    '''
-    def return_priority(request):
-        return request['priority']
 
-    queue_list = load_queue_list()
-    queue_list.sort(key=return_priority)
-    save_queue_list(queue_list)
-    pass
+    If config.AUTO_PRIORITISE is set, the queue is always in this order, so
+    reprioritise() changes nothing.
+    '''
+    engine = SESSIONS.get(session).engine
+    engine.reprioritise()
+    engine.commit()
 
-def end():
+def end(session=config.DEFAULT_SESSION):
     '''
     Used by tutors at the end of the help session. All requests are removed from
     the queue and any records of previously resolved requests are wiped.
     '''
-    queue_list = []
-    priority_dictionary = {}
-    save_queue_list(queue_list)
-    save_priority_dictionary(priority_dictionary)
-    pass
+    engine = SESSIONS.get(session).engine
+    engine.end()
+    engine.commit()
+
+def join_tutor(tutor, capacity=1, session=config.DEFAULT_SESSION):
+    '''
+    Used by tutors to start taking students from the scheduler, or to change
+    how many they can help at once. Tutors must then call tutor_heartbeat()
+    at least every config.TUTOR_TIMEOUT seconds, or they are taken to have
+    left.
+
+    Params:
+      tutor (str): The name of the tutor.
+
+      capacity (int): How many students the tutor can help at once.
+
+    Raises:
+      ValueError: if tutor is the empty string or capacity is less than 1.
+    '''
+    current = SESSIONS.get(session)
+    current.scheduler.join(tutor, capacity)
+    current.engine.commit()
+
+def tutor_heartbeat(tutor, session=config.DEFAULT_SESSION):
+    '''
+    Used by tutors to tell the scheduler they are still there.
+
+    Params:
+      tutor (str): The name of the tutor.
+
+    Raises:
+      KeyError: if the tutor has not joined, or has been taken to have left.
+    '''
+    current = SESSIONS.get(session)
+    current.scheduler.heartbeat(tutor)
+    current.engine.commit()
+
+def leave_tutor(tutor, session=config.DEFAULT_SESSION):
+    '''
+    Used by tutors to stop taking students. The students they are helping are
+    given to the least-loaded of the other tutors, or if they are all full,
+    given the status "waiting" again.
+
+    Params:
+      tutor (str): The name of the tutor.
+
+    Raises:
+      KeyError: if the tutor has not joined, or has been taken to have left.
+
+    Returns:
+      (dict) : The ZID of each student the tutor was helping, mapped to the
+      tutor they were given to, or None if they are waiting again.
+    '''
+    current = SESSIONS.get(session)
+    moved = current.scheduler.leave(tutor)
+    current.engine.commit()
+    return moved
+
+def assign(prioritised=False, session=config.DEFAULT_SESSION):
+    '''
+    Used to give the next student to whichever tutor has the fewest students
+    and room for another, rather than letting tutors pick.
+
+    Params:
+      prioritised (bool): As in help_next().
+
+    Returns:
+      (dict) : The request in the same format as help_next(), or None if no
+      request is waiting or every tutor is full.
+    '''
+    current = SESSIONS.get(session)
+    request = current.scheduler.assign(prioritised)
+    current.engine.commit()
+    return request
+
+def tutors(session=config.DEFAULT_SESSION):
+    '''
+    Used to see the tutors who have joined and how they are getting on.
+
+    Returns:
+      (list of dict) : A dictionary for each tutor, by name, with the keys
+      { 'tutor', 'capacity', 'helping', 'helped', 'mean_service_time' }.
+      helping is a list of the ZIDs of the students they are helping, helped
+      is how many students they have resolved, and mean_service_time is the
+      mean number of seconds from help to resolve, or None if they have not
+      resolved any.
+    '''
+    scheduler = SESSIONS.get(session).scheduler
+    return scheduler.view()
+
+# the operations batch() takes, and the params of each.
+BATCH_OPERATIONS = {
+    'make_request': ('zid', 'description'),
+    'help': ('zid',),
+    'resolve': ('zid',),
+    'cancel': ('zid',),
+    'revert': ('zid',),
+    'reprioritise': (),
+}
+
+def batch(operations, session=config.DEFAULT_SESSION):
+    '''
+    Used by tutors and admin scripts to make several changes to the queue in
+    one go, e.g. help and then resolve one student, or revert every student
+    a tutor was helping. The operations are applied in order and atomically:
+    if one of them fails, none of them are applied.
+
+    Params:
+      operations (list of dict): Each dictionary has an 'op', one of
+      "make_request", "help", "resolve", "cancel", "revert" or "reprioritise",
+      and the params of that function, e.g. {'op': 'help', 'zid': zid}.
+
+    Raises:
+      ValueError: if an operation has an unknown 'op' or is missing one of its
+      params. Nothing is applied then.
+
+    Returns:
+      (list of dict) : A dictionary for each operation, in order, with the keys
+      { 'op', 'result' }. 'result' is "applied" if every operation was applied.
+      Otherwise it is "failed" for the operation that failed, which also has
+      an 'error' of "KeyError" or "ValueError" as its function would raise,
+      and "skipped" for the others.
+    '''
+    engine = SESSIONS.get(session).engine
+    steps = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in BATCH_OPERATIONS:
+            raise ValueError
+        params = BATCH_OPERATIONS[operation['op']]
+        if any(param not in operation for param in params):
+            raise ValueError
+        steps.append((operation['op'], tuple(operation[param] for param in params)))
+    try:
+        engine.batch(steps)
+    except (KeyError, ValueError) as error:
+        results = [{'op': op, 'result': 'skipped'} for op, args in steps]
+        results[error.index] = {
+            'op': steps[error.index][0],
+            'result': 'failed',
+            'error': type(error).__name__,
+        }
+        return results
+    engine.commit()
+    return [{'op': op, 'result': 'applied'} for op, args in steps]
+
+def changes(since, session=config.DEFAULT_SESSION):
+    '''
+    Used by clients to catch up with the changes to the queue since they last
+    looked, instead of fetching the whole queue again.
+
+    Every change to the queue gets the next number of a sequence that never
+    goes backwards, so the current seq is also a cheap way to tell that
+    nothing has changed.
+
+    Params:
+      since (int): The seq of the last change the client has seen.
+
+    Returns:
+      (dict) : {'seq': seq, 'changes': changes} where seq is the current seq
+      and changes is a list of the change events after since, in order. See
+      subscribe() for the events. If the changes after since are no longer
+      kept, it is {'seq': seq, 'resync': True} instead, and the client should
+      fetch the whole queue.
+    '''
+    engine = SESSIONS.get(session).engine
+    return engine.changes(since)
+
+def version(session=config.DEFAULT_SESSION):
+    '''
+    Used by the server to tell cheaply whether the queue has changed since an
+    answer was computed.
+
+    Returns:
+      (int) : The seq of the last change to the queue, as in changes().
+    '''
+    engine = SESSIONS.get(session).engine
+    return engine.version()
+
+def versioned_queue(session=config.DEFAULT_SESSION):
+    '''
+    Used by the server to cache the answer of queue().
+
+    Returns:
+      (tuple) : (version, queue) where queue is in the same format as queue()
+      and version is the version() it was read at.
+    '''
+    engine = SESSIONS.get(session).engine
+    return engine.versioned_queue()
+
+def encoded_queue(session=config.DEFAULT_SESSION):
+    '''
+    Used by the server to answer /queue without encoding the whole queue for
+    every change.
+
+    Returns:
+      (tuple) : (version, queue) where queue is queue() encoded as JSON, in
+      bytes, and version is the version() it was read at.
+    '''
+    engine = SESSIONS.get(session).engine
+    return engine.encoded_queue()
+
+def versioned_queue_page(limit=None, cursor=None, status=None, session=config.DEFAULT_SESSION):
+    '''
+    Used by the server to tag the pages of queue_page() with their version.
+
+    Raises:
+      ValueError: as queue_page() does.
+
+    Returns:
+      (tuple) : (version, page) where page is as in queue_page() and version
+      is the version() it was read at.
+    '''
+    engine = SESSIONS.get(session).engine
+    return engine.versioned(engine.page, limit, cursor, status)
+
+def versioned_remaining(zid, session=config.DEFAULT_SESSION):
+    '''
+    Used by the server to cache the answers of remaining().
+
+    Params:
+      zid (str): The ZID of the student with the request.
+
+    Raises:
+      KeyError: if the student does not have a request in the queue with a
+      "waiting" status.
+
+    Returns:
+      (tuple) : (version, remaining) where remaining is as in remaining() and
+      version is the version() it was read at.
+    '''
+    engine = SESSIONS.get(session).engine
+    return engine.versioned_remaining(zid)
+
+def versioned_statistics(session=config.DEFAULT_SESSION):
+    '''
+    Used by the server to cache the answers of statistics().
+
+    Returns:
+      (tuple) : (version, statistics) where statistics is as in statistics()
+      and version is the version() it was read at.
+    '''
+    engine = SESSIONS.get(session).engine
+    return engine.versioned(engine.statistics)
+
+def subscribe(listener, session=config.DEFAULT_SESSION):
+    '''
+    Used by the server to be told about every change to the queue as it
+    happens, e.g. to push the changes to tutors.
+
+    Params:
+      listener (function): Called with a change event (dict) after every
+      change to the queue. See QueueEngine.event() for the events. It is
+      called while the queue is locked, so it must return quickly.
+
+    Returns:
+      (dict) : {'type': 'queue', 'seq': seq, 'queue': queue} where queue is in
+      the same format as queue(), as it was when the listener was added, and
+      seq is its version as in changes(). The listener is called for every
+      change after it and for none before it.
+    '''
+    engine = SESSIONS.get(session).engine
+    return engine.subscribe(listener)
+
+def unsubscribe(listener, session=config.DEFAULT_SESSION):
+    '''
+    Stops telling a listener passed to subscribe() about changes.
+
+    Params:
+      listener (function): The listener passed to subscribe().
+
+    Raises:
+      ValueError: if the listener is not subscribed.
+    '''
+    engine = SESSIONS.get(session).engine
+    engine.unsubscribe(listener)
+
+def subscribe_standing(zid, listener, session=config.DEFAULT_SESSION):
+    '''
+    Used by the server to push a student where their request stands whenever
+    it changes, rather than the student asking with remaining() again and
+    again.
+
+    Params:
+      zid (str): The ZID of the student.
+      listener (function): Called with the student's standing (dict), in the
+      same format as the result, whenever it changes. It is called from the
+      session's broadcaster thread, so it must return quickly.
+
+    Returns:
+      (dict) : {'status': status, 'remaining': remaining} where status is the
+      status of the student's request, or None if they have none, and
+      remaining is as in remaining() while the request is "waiting", and None
+      otherwise.
+    '''
+    broadcaster = SESSIONS.get(session).broadcaster
+    return broadcaster.subscribe(zid, listener)
+
+def unsubscribe_standing(listener, session=config.DEFAULT_SESSION):
+    '''
+    Stops pushing a listener passed to subscribe_standing() the standing of
+    its student.
+
+    Params:
+      listener (function): The listener passed to subscribe_standing().
+
+    Raises:
+      KeyError: if the listener is not subscribed.
+    '''
+    broadcaster = SESSIONS.get(session).broadcaster
+    broadcaster.unsubscribe(listener)
+
+def open_session(session, create=True):
+    '''
+    Used by the server to check a session before reading anything else of a
+    request, opening it if it is not open yet.
+
+    Params:
+      session (str): The name of the session.
+
+      create (bool): Whether to create the session if it has never been
+      changed. Reads pass False, so that they cannot create sessions.
+      config.DEFAULT_SESSION is always created.
+
+    Raises:
+      ValueError: if the session is not a valid session id, belongs to
+      another shard, or config.MAX_SESSIONS sessions are already open.
+
+      KeyError: if create is False and the session has never been changed.
+    '''
+    SESSIONS.get(session, create or session == config.DEFAULT_SESSION)
+
+def start(args):
+    '''
+    Used by the servers to start as their command line asks, "[shard]
+    [--follow]": as the primary of the shard, listening for followers, or as
+    a follower of that primary, see replication.py.
+
+    Params:
+      args (list of str): The command line arguments.
+
+    Returns:
+      (int) : The port to serve HTTP on.
+    '''
+    global FOLLOWER
+    follow = '--follow' in args
+    args = [arg for arg in args if arg != '--follow']
+    if args:
+        config.SHARD = int(args[0])
+    if follow:
+        FOLLOWER = Follower(SESSIONS, config.REPLICATION_PORT + config.SHARD)
+        FOLLOWER.start()
+        return config.FOLLOWER_PORT + config.SHARD
+    serve_followers(SESSIONS, config.REPLICATION_PORT + config.SHARD)
+    return config.PORT + config.SHARD
+
+def following():
+    '''
+    Used by the server to tell whether it is a follower, which only serves
+    replication.FOLLOWER_ROUTES.
+    '''
+    return FOLLOWER is not None and not FOLLOWER.promoted
+
+def promote():
+    '''
+    Used by tutors to make a follower the primary once the primary has gone.
+    Its sessions are stored from then on, replacing what the primary stored,
+    and it listens for followers of its own.
+
+    Raises:
+      ValueError: if this server is not a follower, or the primary can still
+      be reached.
+    '''
+    if not following():
+        raise ValueError
+    FOLLOWER.promote()
+    serve_followers(SESSIONS, config.REPLICATION_PORT + config.SHARD)
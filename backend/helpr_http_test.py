@@ -5,6 +5,7 @@ HTTP API integration tests for the end-to-end functionality of the helpr applica
 import config
 import requests
 import json
+import uuid
 
 BASE_URL=f"http://127.0.0.1:{config.PORT}"
 
@@ -228,3 +229,232 @@ def test_four_student_make_multiple_requests_reprioritise_revert():
     response = requests.get(f"{BASE_URL}/remaining",params={'zid':'z7654321'})
     assert response.status_code == 200
     assert json.loads(response.text) == {'remaining':2}
+
+def test_queue_stream():
+    """
+    a tutor opens the queue stream, then one student makes a request.
+    the stream sends the queue and then the change.
+    """
+    requests.delete(f"{BASE_URL}/end")
+    requests.post(f"{BASE_URL}/make_request", json={'zid':'z1234567','description':'help'})
+    with requests.get(f"{BASE_URL}/queue/stream", stream=True, timeout=5) as response:
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('text/event-stream')
+        lines = (line for line in response.iter_lines(decode_unicode=True) if line.startswith('data: '))
+        first_event = json.loads(next(lines)[len('data: '):])
+        seq = first_event['seq']
+        assert first_event == {
+            'type': 'queue',
+            'seq': seq,
+            'queue': [{'zid':'z1234567','description':'help','status':'waiting'}],
+        }
+        requests.post(f"{BASE_URL}/help", json={'zid':'z1234567'})
+        assert json.loads(next(lines)[len('data: '):]) == {'type':'status','seq':seq + 1,'zid':'z1234567','status':'receiving'}
+
+def test_remaining_stream():
+    """
+    a student opens their stream, then the student ahead of them is helped.
+    the stream sends their standing and then only the change to it.
+    """
+    requests.delete(f"{BASE_URL}/end")
+    requests.post(f"{BASE_URL}/make_request", json={'zid':'z1234567','description':'help'})
+    requests.post(f"{BASE_URL}/make_request", json={'zid':'z7654321','description':'help'})
+    with requests.get(f"{BASE_URL}/remaining/stream", params={'zid':'z7654321'}, stream=True, timeout=5) as response:
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('text/event-stream')
+        lines = (line for line in response.iter_lines(decode_unicode=True) if line.startswith('data: '))
+        assert json.loads(next(lines)[len('data: '):]) == {'status':'waiting','remaining':1}
+        requests.post(f"{BASE_URL}/make_request", json={'zid':'z5555555','description':'help'})
+        requests.post(f"{BASE_URL}/help", json={'zid':'z1234567'})
+        assert json.loads(next(lines)[len('data: '):]) == {'status':'waiting','remaining':0}
+        requests.post(f"{BASE_URL}/help", json={'zid':'z7654321'})
+        assert json.loads(next(lines)[len('data: '):]) == {'status':'receiving','remaining':None}
+    assert requests.get(f"{BASE_URL}/remaining/stream").status_code == 400
+    requests.delete(f"{BASE_URL}/end")
+
+def test_queue_changes():
+    """
+    one student makes a request and is helped.
+    '/queue/changes' gives the help since the request, and nothing since the help.
+    """
+    requests.delete(f"{BASE_URL}/end")
+    requests.post(f"{BASE_URL}/make_request", json={'zid':'z1234567','description':'help'})
+    seq = json.loads(requests.get(f"{BASE_URL}/queue/changes", params={'since':0}).text)['seq']
+    requests.post(f"{BASE_URL}/help", json={'zid':'z1234567'})
+    response = requests.get(f"{BASE_URL}/queue/changes", params={'since':seq})
+    assert response.status_code == 200
+    assert json.loads(response.text) == {'seq': seq + 1, 'changes': [
+        {'type':'status','seq':seq + 1,'zid':'z1234567','status':'receiving'},
+    ]}
+    response = requests.get(f"{BASE_URL}/queue/changes", params={'since':seq + 1})
+    assert json.loads(response.text) == {'seq': seq + 1, 'changes': []}
+    response = requests.get(f"{BASE_URL}/queue/changes", params={'since':'latest'})
+    assert response.status_code == 400
+
+def test_queue_etag():
+    """
+    '/queue' answers a GET with the ETag it was given with 304 until the queue
+    changes.
+    """
+    requests.delete(f"{BASE_URL}/end")
+    requests.post(f"{BASE_URL}/make_request", json={'zid':'z1234567','description':'help'})
+    response = requests.get(f"{BASE_URL}/queue")
+    etag = response.headers['ETag']
+    response = requests.get(f"{BASE_URL}/queue", headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    requests.post(f"{BASE_URL}/help", json={'zid':'z1234567'})
+    response = requests.get(f"{BASE_URL}/queue", headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert json.loads(response.text) == [{'zid':'z1234567','description':'help','status':'receiving'}]
+    requests.delete(f"{BASE_URL}/end")
+
+def test_remaining_etag():
+    """
+    '/remaining' answers a GET with the ETag it was given with 304 until the
+    queue changes.
+    """
+    requests.delete(f"{BASE_URL}/end")
+    requests.post(f"{BASE_URL}/make_request", json={'zid':'z1234567','description':'help'})
+    requests.post(f"{BASE_URL}/make_request", json={'zid':'z7654321','description':'help'})
+    response = requests.get(f"{BASE_URL}/remaining", params={'zid':'z7654321'})
+    etag = response.headers['ETag']
+    assert json.loads(response.text) == {'remaining': 1}
+    response = requests.get(f"{BASE_URL}/remaining", params={'zid':'z7654321'}, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    requests.post(f"{BASE_URL}/help", json={'zid':'z1234567'})
+    response = requests.get(f"{BASE_URL}/remaining", params={'zid':'z7654321'}, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert json.loads(response.text) == {'remaining': 0}
+    requests.delete(f"{BASE_URL}/end")
+
+def test_statistics():
+    """
+    two students make requests and one of them is helped.
+    '/statistics' counts them by status and priority.
+    """
+    requests.delete(f"{BASE_URL}/end")
+    requests.post(f"{BASE_URL}/make_request", json={'zid':'z1234567','description':'help'})
+    requests.post(f"{BASE_URL}/make_request", json={'zid':'z7654321','description':'help'})
+    requests.post(f"{BASE_URL}/help", json={'zid':'z1234567'})
+    response = requests.get(f"{BASE_URL}/statistics")
+    assert json.loads(response.text) == {'waiting': 1, 'receiving': 1, 'priorities': {'0': 2}}
+    requests.delete(f"{BASE_URL}/end")
+
+def test_batch():
+    """
+    a tutor helps and resolves one student in a batch, then sends a batch
+    where one operation fails.
+    """
+    requests.delete(f"{BASE_URL}/end")
+    requests.post(f"{BASE_URL}/make_request", json={'zid':'z1234567','description':'help'})
+    response = requests.post(f"{BASE_URL}/batch", json={'operations':[
+        {'op':'help','zid':'z1234567'},
+        {'op':'resolve','zid':'z1234567'},
+    ]})
+    assert response.status_code == 200
+    assert json.loads(response.text) == {'results': [
+        {'op':'help','result':'applied'},
+        {'op':'resolve','result':'applied'},
+    ]}
+    response = requests.post(f"{BASE_URL}/batch", json={'operations':[
+        {'op':'make_request','zid':'z1234567','description':'help'},
+        {'op':'cancel','zid':'z7654321'},
+    ]})
+    assert response.status_code == 400
+    assert json.loads(response.text)['results'][1] == {'op':'cancel','result':'failed','error':'KeyError'}
+    assert json.loads(requests.get(f"{BASE_URL}/queue").text) == []
+    response = requests.post(f"{BASE_URL}/batch", json={'operations':[{'op':'end'}]})
+    assert response.status_code == 400
+
+def test_queue_paged():
+    """
+    three students make requests and the first is helped.
+    '/queue' pages the waiting requests, and rejects a bad limit or status.
+    """
+    requests.delete(f"{BASE_URL}/end")
+    for zid in ('z1234567', 'z7654321', 'z5258270'):
+        requests.post(f"{BASE_URL}/make_request", json={'zid':zid,'description':'help'})
+    requests.post(f"{BASE_URL}/help", json={'zid':'z1234567'})
+    page = json.loads(requests.get(f"{BASE_URL}/queue", params={'limit':1,'status':'waiting'}).text)
+    assert page['queue'] == [{'zid':'z7654321','description':'help','status':'waiting'}]
+    page = json.loads(requests.get(f"{BASE_URL}/queue", params={'limit':1,'status':'waiting','cursor':page['cursor']}).text)
+    assert page == {'queue': [{'zid':'z5258270','description':'help','status':'waiting'}], 'cursor': None}
+    assert requests.get(f"{BASE_URL}/queue", params={'limit':'all'}).status_code == 400
+    assert requests.get(f"{BASE_URL}/queue", params={'status':'resolved'}).status_code == 400
+    requests.delete(f"{BASE_URL}/end")
+
+def test_help_next():
+    """
+    one student makes a request and two tutors ask for the next one.
+    the first tutor is given the student, the second nothing.
+    """
+    requests.delete(f"{BASE_URL}/end")
+    requests.post(f"{BASE_URL}/make_request", json={'zid':'z1234567','description':'help'})
+    response = requests.post(f"{BASE_URL}/help_next", json={'tutor':'tutor1'})
+    assert response.status_code == 200
+    assert json.loads(response.text) == {'request': {'zid':'z1234567','description':'help','status':'receiving','tutor':'tutor1'}}
+    response = requests.post(f"{BASE_URL}/help_next", json={'tutor':'tutor2'})
+    assert json.loads(response.text) == {'request': None}
+    response = requests.post(f"{BASE_URL}/help_next", json={'tutor':''})
+    assert response.status_code == 400
+    requests.delete(f"{BASE_URL}/end")
+
+def test_tutors():
+    """
+    two tutors join and students are assigned to them, then one leaves.
+    the student of the tutor who left goes to the other tutor.
+    """
+    requests.delete(f"{BASE_URL}/end")
+    requests.post(f"{BASE_URL}/tutors/join", json={'tutor':'tutor1'})
+    requests.post(f"{BASE_URL}/tutors/join", json={'tutor':'tutor2','capacity':2})
+    for zid in ('z1234567', 'z7654321'):
+        requests.post(f"{BASE_URL}/make_request", json={'zid':zid,'description':'help'})
+    first = json.loads(requests.post(f"{BASE_URL}/assign", json={}).text)['request']
+    assert first == {'zid':'z1234567','description':'help','status':'receiving','tutor':'tutor1'}
+    second = json.loads(requests.post(f"{BASE_URL}/assign", json={}).text)['request']
+    assert second['tutor'] == 'tutor2'
+    response = requests.delete(f"{BASE_URL}/tutors/leave", json={'tutor':'tutor1'})
+    assert json.loads(response.text) == {'moved': {'z1234567': 'tutor2'}}
+    tutors = json.loads(requests.get(f"{BASE_URL}/tutors").text)
+    assert [(tutor['tutor'], tutor['helping']) for tutor in tutors] == [('tutor2', ['z7654321', 'z1234567'])]
+    assert requests.post(f"{BASE_URL}/tutors/heartbeat", json={'tutor':'tutor1'}).status_code == 400
+    requests.delete(f"{BASE_URL}/tutors/leave", json={'tutor':'tutor2'})
+    requests.delete(f"{BASE_URL}/end")
+
+def test_sessions():
+    """
+    the same student makes a request in two sessions.
+    each session's '/queue' only has its own requests.
+    """
+    requests.delete(f"{BASE_URL}/end")
+    requests.delete(f"{BASE_URL}/end", json={'session':'lab2'})
+    requests.post(f"{BASE_URL}/make_request", json={'zid':'z1234567','description':'help'})
+    response = requests.post(f"{BASE_URL}/make_request", json={'zid':'z1234567','description':'help','session':'lab2'})
+    assert response.status_code == 200
+    requests.post(f"{BASE_URL}/help", json={'zid':'z1234567','session':'lab2'})
+    response = requests.get(f"{BASE_URL}/queue", params={'session':'lab2'})
+    assert json.loads(response.text) == [{'zid':'z1234567','description':'help','status':'receiving'}]
+    response = requests.get(f"{BASE_URL}/queue")
+    assert json.loads(response.text) == [{'zid':'z1234567','description':'help','status':'waiting'}]
+    response = requests.get(f"{BASE_URL}/queue", params={'session':'../lab2'})
+    assert response.status_code == 400
+    requests.delete(f"{BASE_URL}/end", json={'session':'lab2'})
+    requests.delete(f"{BASE_URL}/end")
+
+def test_idempotency_key():
+    """
+    a student's request is retried with its Idempotency-Key.
+    the retry is answered as the first was, and the queue holds the request once.
+    """
+    requests.delete(f"{BASE_URL}/end")
+    headers = {'Idempotency-Key': str(uuid.uuid4())}
+    for _ in range(2):
+        response = requests.post(f"{BASE_URL}/make_request", json={'zid':'z1234567','description':'help'},
+                                 headers=headers)
+        assert response.status_code == 200
+    assert response.headers['Idempotent-Replayed'] == 'true'
+    response = requests.get(f"{BASE_URL}/queue")
+    assert json.loads(response.text) == [{'zid':'z1234567','description':'help','status':'waiting'}]
+    requests.delete(f"{BASE_URL}/end")
@@ -0,0 +1,128 @@
+'''
+Stress tests for concurrent use of the helpr application by many clients
+'''
+
+import multiprocessing
+import threading
+
+import pytest
+
+from helpr import make_request, queue, remaining, help, help_next, resolve, end
+from engine import QueueEngine
+from journal import Journal
+from sqlite_storage import SqliteStorage
+
+CLIENTS = 64
+
+def run_concurrently(client, count):
+    """
+    runs client(number) for each number in range(count) on its own thread.
+    all threads start together, and any exception is raised again.
+    """
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def run(number):
+        barrier.wait()
+        try:
+            client(number)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=run, args=(number,)) for number in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+def test_concurrent_make_request_loses_no_updates():
+    """
+    64 students make a request at the same time.
+    every request is in the queue, each in its own position.
+    """
+    end()
+    run_concurrently(lambda number: make_request(f"z{number:07d}","help me"), CLIENTS)
+    assert len(queue()) == CLIENTS
+    positions = sorted(remaining(f"z{number:07d}") for number in range(CLIENTS))
+    assert positions == list(range(CLIENTS))
+    end()
+    assert not queue()
+
+def test_concurrent_help_and_resolve():
+    """
+    64 students are each helped and resolved by their own tutor at once,
+    while another 64 students join the queue.
+    """
+    end()
+    for number in range(CLIENTS):
+        make_request(f"z{number:07d}","help me")
+
+    def client(number):
+        if number < CLIENTS:
+            help(f"z{number:07d}")
+            resolve(f"z{number:07d}")
+        else:
+            make_request(f"z{number:07d}","help me")
+
+    run_concurrently(client, CLIENTS * 2)
+    assert len(queue()) == CLIENTS
+    assert all(request['status'] == 'waiting' for request in queue())
+    end()
+
+def test_concurrent_help_next_gives_each_request_once():
+    """
+    64 tutors ask for the next student at once, with 48 students waiting.
+    every student is given to exactly one tutor, and the rest get None.
+    """
+    end()
+    for number in range(48):
+        make_request(f"z{number:07d}","help me")
+    given = []
+    run_concurrently(lambda number: given.append(help_next(f"tutor{number}")), CLIENTS)
+    zids = [request['zid'] for request in given if request is not None]
+    assert sorted(zids) == [f"z{number:07d}" for number in range(48)]
+    assert given.count(None) == CLIENTS - 48
+    assert all(request['status'] == 'receiving' for request in queue())
+    end()
+
+def open_shared_storage(backend, directory):
+    if backend == "json":
+        return Journal(f"{directory}/journal.jsonl", f"{directory}/snapshot.json", shared=True)
+    return SqliteStorage(f"{directory}/queue.sqlite3", shared=True)
+
+def worker(backend, directory, number, count):
+    """
+    one server process making, helping and resolving count requests.
+    """
+    engine = QueueEngine(open_shared_storage(backend, directory))
+    for index in range(count):
+        zid = f"z{number}{index:06d}"
+        engine.make_request(zid,"help me")
+        if index % 2:
+            engine.help(zid)
+            engine.resolve(zid)
+    engine.storage.close()
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_processes_sharing_storage_lose_no_updates(tmp_path, backend):
+    """
+    4 processes share one storage and each makes 16 requests.
+    every process's changes end up in the shared queue.
+    """
+    processes = 4
+    count = 16
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=worker, args=(backend, str(tmp_path), number, count))
+               for number in range(processes)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+        assert process.exitcode == 0
+
+    engine = QueueEngine(open_shared_storage(backend, str(tmp_path)))
+    assert len(engine.queue()) == processes * count // 2
+    assert sum(engine.priority_dictionary.values()) == processes * count // 2
+    assert engine.seq == processes * count * 2
+    engine.storage.close()
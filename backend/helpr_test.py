@@ -4,7 +4,10 @@ Python API unit tests for the core functionality of the helpr application
 
 import pytest
 
-from helpr import make_request, queue, remaining, help, resolve, cancel, revert, reprioritise, end
+import config
+import helpr
+from sessions import SessionRegistry
+from helpr import make_request, queue, queue_page, remaining, help, help_next, resolve, cancel, revert, reprioritise, end, changes, version, versioned_queue, versioned_remaining, batch, statistics
 
 #################################################
 # pytest fixtures.                              #
@@ -59,6 +62,17 @@ def fixture_student1_badproblem1():
     """
     return "z1234567",""
 
+@pytest.fixture(name='sessions')
+def fixture_sessions(monkeypatch, tmp_path):
+    """
+    gives helpr a registry of its own, keeping its sessions in tmp_path, so
+    that no session's files are left behind for the next run.
+    """
+    for name, file_name in (("JOURNAL_FILE", "journal.jsonl"), ("SNAPSHOT_FILE", "snapshot.json"),
+                            ("SQLITE_FILE", "queue.sqlite3"), ("BINARY_FILE", "queue.bin")):
+        monkeypatch.setattr(config, name, str(tmp_path / file_name))
+    monkeypatch.setattr(helpr, "SESSIONS", SessionRegistry())
+
 #################################################
 # tests make_request(), queue() and end().      #
 #################################################
@@ -143,6 +157,42 @@ def test_one_student_make_one_invalid_request(student1_badproblem1):
     end()
     assert not queue()
 
+#################################################
+# tests queue_page().                           #
+#################################################
+
+def test_queue_page_empty():
+    """
+    no requests in the queue.
+    an empty page with no cursor.
+    """
+    end()
+    assert queue_page(10) == {'queue': [], 'cursor': None}
+    end()
+
+def test_queue_page_waiting(student1_problem1, student2_problem2):
+    """
+    three students make requests and the first is helped.
+    the waiting requests are paged one at a time.
+    """
+    end()
+    student1,problem1 = student1_problem1
+    student2,problem2 = student2_problem2
+    student3,problem3 = "z5258270","big problem"
+    make_request(student1,problem1)
+    make_request(student2,problem2)
+    make_request(student3,problem3)
+    help(student1)
+    page = queue_page(1, status="waiting")
+    assert page['queue'] == [{'zid':student2,'description':problem2,'status':'waiting'}]
+    page = queue_page(1, page['cursor'], "waiting")
+    assert page == {'queue': [{'zid':student3,'description':problem3,'status':'waiting'}], 'cursor': None}
+    assert queue_page(status="receiving") == {'queue': [{'zid':student1,'description':problem1,'status':'receiving'}], 'cursor': None}
+    with pytest.raises(ValueError):
+        queue_page(1, status="resolved")
+    end()
+    assert not queue()
+
 #################################################
 # tests remaining() and help().                 #
 #################################################
@@ -414,3 +464,218 @@ def test_reprioritise_one_student_two_request_other_student_one_request(student1
 
     end()
     assert not queue()
+
+#################################################
+# tests changes().                              #
+#################################################
+
+def test_changes_nothing_changed(student1_problem1):
+    """
+    nothing changes after a seq.
+    no changes are returned, with the same seq.
+    """
+    end()
+    student1,problem1 = student1_problem1
+    make_request(student1,problem1)
+    seq = changes(0)['seq']
+    assert changes(seq) == {'seq': seq, 'changes': []}
+    end()
+    assert not queue()
+
+def test_changes_help_and_resolve(student1_problem1):
+    """
+    one request is made, helped and resolved.
+    the changes since the request was made are the help and the resolve.
+    """
+    end()
+    student1,problem1 = student1_problem1
+    make_request(student1,problem1)
+    seq = changes(0)['seq']
+    help(student1)
+    resolve(student1)
+    result = changes(seq)
+    assert result['seq'] == seq + 2
+    assert [change['type'] for change in result['changes']] == ['status', 'removed']
+    end()
+    assert not queue()
+
+#################################################
+# tests version().                              #
+#################################################
+
+def test_version_changes_with_queue(student1_problem1):
+    """
+    the version stays the same while the queue does, and changes with it.
+    versioned_queue() and versioned_remaining() give the current version.
+    """
+    end()
+    student1,problem1 = student1_problem1
+    before = version()
+    assert version() == before
+    make_request(student1,problem1)
+    after = version()
+    assert after != before
+    assert versioned_queue() == (after, queue())
+    assert versioned_remaining(student1) == (after, 0)
+    with pytest.raises(KeyError):
+        versioned_remaining("z0000000")
+    end()
+    assert not queue()
+
+#################################################
+# tests batch().                                #
+#################################################
+
+def test_batch_help_and_resolve(student1_problem1, student2_problem2):
+    """
+    one student is helped and resolved, and another makes a request, in one batch.
+    every operation is applied.
+    """
+    end()
+    student1,problem1 = student1_problem1
+    student2,problem2 = student2_problem2
+    make_request(student1,problem1)
+    assert batch([
+        {'op': 'help', 'zid': student1},
+        {'op': 'resolve', 'zid': student1},
+        {'op': 'make_request', 'zid': student2, 'description': problem2},
+    ]) == [
+        {'op': 'help', 'result': 'applied'},
+        {'op': 'resolve', 'result': 'applied'},
+        {'op': 'make_request', 'result': 'applied'},
+    ]
+    assert queue() == [{'zid':student2,'description':problem2,'status':'waiting'}]
+    end()
+    assert not queue()
+
+def test_batch_failure_applies_nothing(student1_problem1, student2_problem2):
+    """
+    the second operation of a batch fails.
+    none of the operations are applied.
+    """
+    end()
+    student1,problem1 = student1_problem1
+    student2,problem2 = student2_problem2
+    make_request(student1,problem1)
+    seq = version()
+    assert batch([
+        {'op': 'help', 'zid': student1},
+        {'op': 'make_request', 'zid': student2, 'description': ""},
+        {'op': 'resolve', 'zid': student1},
+    ]) == [
+        {'op': 'help', 'result': 'skipped'},
+        {'op': 'make_request', 'result': 'failed', 'error': 'ValueError'},
+        {'op': 'resolve', 'result': 'skipped'},
+    ]
+    assert queue() == [{'zid':student1,'description':problem1,'status':'waiting'}]
+    assert remaining(student1) == 0
+    assert version() == seq
+    end()
+    assert not queue()
+
+def test_batch_malformed(student1_problem1):
+    """
+    a batch has an unknown operation, or one missing its params.
+    ValueError raised, nothing applied.
+    """
+    end()
+    student1,problem1 = student1_problem1
+    with pytest.raises(ValueError):
+        batch([{'op': 'make_request', 'zid': student1, 'description': problem1}, {'op': 'end'}])
+    with pytest.raises(ValueError):
+        batch([{'op': 'make_request', 'zid': student1}])
+    assert not queue()
+    end()
+
+#################################################
+# tests help_next().                            #
+#################################################
+
+def test_help_next_no_requests():
+    """
+    no requests made.
+    help_next() returns None.
+    """
+    end()
+    assert help_next("tutor1") is None
+    end()
+    assert not queue()
+
+def test_help_next_in_order(student1_problem1, student2_problem2):
+    """
+    two requests made, and two tutors ask for the next one.
+    each tutor gets the next waiting request in order.
+    """
+    end()
+    student1,problem1 = student1_problem1
+    student2,problem2 = student2_problem2
+    make_request(student1,problem1)
+    make_request(student2,problem2)
+    assert help_next("tutor1") == {'zid':student1,'description':problem1,'status':'receiving','tutor':'tutor1'}
+    assert help_next("tutor2") == {'zid':student2,'description':problem2,'status':'receiving','tutor':'tutor2'}
+    assert help_next("tutor3") is None
+    with pytest.raises(ValueError):
+        help_next("")
+    end()
+    assert not queue()
+
+def test_help_next_prioritised(student1_problem1, student2_problem2):
+    """
+    the first student in the queue has been helped before.
+    help_next() in prioritised order gives the tutor the second student.
+    """
+    end()
+    student1,problem1 = student1_problem1
+    student2,problem2 = student2_problem2
+    make_request(student1,problem1)
+    help(student1)
+    resolve(student1)
+    make_request(student1,problem1)
+    make_request(student2,problem2)
+    assert help_next("tutor1", prioritised=True)['zid'] == student2
+    assert help_next("tutor1", prioritised=True)['zid'] == student1
+    end()
+    assert not queue()
+
+def test_statistics(student1_problem1, student2_problem2):
+    """
+    one student has been helped before and the other is receiving help.
+    statistics() counts the requests of each status and priority.
+    """
+    end()
+    student1,problem1 = student1_problem1
+    student2,problem2 = student2_problem2
+    assert statistics() == {'waiting': 0, 'receiving': 0, 'priorities': {}}
+    make_request(student1,problem1)
+    help(student1)
+    resolve(student1)
+    make_request(student1,problem1)
+    make_request(student2,problem2)
+    help(student2)
+    assert statistics() == {'waiting': 1, 'receiving': 1, 'priorities': {0: 1, 1: 1}}
+    end()
+    assert statistics()['priorities'] == {}
+
+def test_sessions_are_independent(sessions, student1_problem1, student2_problem2):
+    """
+    the same student makes a request in two sessions.
+    each session has its own queue, and ending one leaves the other.
+    """
+    end()
+    end("lab2")
+    student1,problem1 = student1_problem1
+    student2,problem2 = student2_problem2
+    make_request(student1,problem1)
+    make_request(student2,problem2,"lab2")
+    make_request(student1,problem1,"lab2")
+    assert remaining(student1) == 0
+    assert remaining(student1,"lab2") == 1
+    help(student2,"lab2")
+    assert queue() == [{'zid':student1,'description':problem1,'status':'waiting'}]
+    end("lab2")
+    assert not queue("lab2")
+    assert len(queue()) == 1
+    with pytest.raises(ValueError):
+        queue("../lab2")
+    end()
+    assert not queue()
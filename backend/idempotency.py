@@ -0,0 +1,107 @@
+'''
+Idempotency keys for the routes that change the queue, so that clients can
+retry them safely.
+
+A client that times out waiting for a POST or DELETE cannot tell whether it
+was done: done again, /make_request is turned away as a duplicate and
+/resolve as resolving a request that is gone. Instead, the client sends an
+Idempotency-Key header, a string of its choosing, unique to the operation,
+e.g. a UUID, and the same key with every retry of it. The first call with a
+key is answered as usual and its answer kept, and every retry gets that
+answer again without the operation being done again. A retry that comes while
+the first call is still being answered waits for its answer.
+'''
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+class Entry:
+    '''
+    The answer to the first call with a key, or, until done is set, the
+    promise of it. result is None if the call raised instead of answering.
+    '''
+
+    __slots__ = ('fingerprint', 'created', 'result', 'done')
+
+    def __init__(self, fingerprint, created):
+        self.fingerprint = fingerprint
+        self.created = created
+        self.result = None
+        self.done = threading.Event()
+
+class IdempotencyCache:
+    '''
+    The answers to the calls made with each key, for ttl seconds after the
+    first, and for at most capacity keys, the oldest being dropped first.
+
+    A key is only ever used for one call, identified by its fingerprint, see
+    fingerprint(). Reusing it for another is a mistake of the client's, as
+    the answer it would get is not the answer to that call.
+    '''
+
+    def __init__(self, capacity, ttl):
+        self.capacity = capacity
+        self.ttl = ttl
+        # the entries of each key, oldest first.
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def run(self, key, fingerprint, function, now=None):
+        '''
+        Calls function() for the first call with key and keeps its result.
+
+        Raises:
+          ValueError: if key was given for a call with another fingerprint.
+
+        Returns:
+          (tuple) : (result, replayed) where result is what function()
+          returned, now or for the first call with key, and replayed is
+          whether it was for the first call. If function() raises, so does
+          this, and the next call with key calls it again.
+        '''
+        while True:
+            with self.lock:
+                if now is None:
+                    now = time.monotonic()
+                self.expire(now)
+                entry = self.entries.get(key)
+                first = entry is None
+                if first:
+                    entry = Entry(fingerprint, now)
+                    self.entries[key] = entry
+                    if len(self.entries) > self.capacity:
+                        self.entries.popitem(last=False)
+            if entry.fingerprint != fingerprint:
+                raise ValueError
+            if first:
+                try:
+                    entry.result = function()
+                except BaseException:
+                    with self.lock:
+                        if self.entries.get(key) is entry:
+                            del self.entries[key]
+                    raise
+                finally:
+                    entry.done.set()
+                return entry.result, False
+            entry.done.wait()
+            if entry.result is not None:
+                return entry.result, True
+            # the first call raised, so this one is made afresh.
+            now = None
+
+    def expire(self, now):
+        while self.entries:
+            entry = next(iter(self.entries.values()))
+            if now - entry.created < self.ttl:
+                return
+            self.entries.popitem(last=False)
+
+def fingerprint(method, path, body):
+    '''
+    Returns what identifies a call for an IdempotencyCache: a digest of its
+    method, path and body.
+    '''
+    return hashlib.sha256(b"%s %s\n%s" % (method.encode(), path.encode(), body)).digest()
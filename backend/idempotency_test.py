@@ -0,0 +1,65 @@
+'''
+Unit tests for idempotency keys
+'''
+
+import threading
+
+import pytest
+
+from idempotency import IdempotencyCache, fingerprint
+
+def test_retries_are_answered_once():
+    """
+    a call is retried with its key, and another call is made with the same key.
+    the retry gets the first answer without calling again; the other call is refused.
+    """
+    cache = IdempotencyCache(10, 60)
+    calls = []
+    call = fingerprint('DELETE', '/resolve', b'{"zid": "z1234567"}')
+    assert cache.run("key", call, lambda: calls.append(1) or len(calls)) == (1, False)
+    assert cache.run("key", call, lambda: calls.append(1) or len(calls)) == (1, True)
+    assert calls == [1]
+    with pytest.raises(ValueError):
+        cache.run("key", fingerprint('DELETE', '/cancel', b'{"zid": "z1234567"}'), lambda: 2)
+
+def test_keys_expire():
+    """
+    keys are used until there are more than the cache keeps, and after they expire.
+    the oldest answers and the expired answers are forgotten.
+    """
+    cache = IdempotencyCache(2, 60)
+    for number, key in enumerate(("a", "b", "c")):
+        cache.run(key, b"", lambda: number, now=0)
+    assert list(cache.entries) == ["b", "c"]
+    assert cache.run("b", b"", lambda: None, now=59) == (1, True)
+    assert cache.run("b", b"", lambda: 3, now=60) == (3, False)
+    assert list(cache.entries) == ["b"]
+
+def test_concurrent_retry_waits():
+    """
+    a retry comes while the first call is still being answered, and the first call fails.
+    the retry waits for it, then is answered afresh.
+    """
+    cache = IdempotencyCache(10, 60)
+    started = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def first():
+        started.set()
+        release.wait()
+        raise RuntimeError
+
+    def run_first():
+        with pytest.raises(RuntimeError):
+            cache.run("key", b"", first)
+
+    thread = threading.Thread(target=run_first)
+    thread.start()
+    started.wait()
+    retry = threading.Thread(target=lambda: results.append(cache.run("key", b"", lambda: "answer")))
+    retry.start()
+    release.set()
+    thread.join()
+    retry.join()
+    assert results == [("answer", False)]
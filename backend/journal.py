@@ -0,0 +1,331 @@
+'''
+The append-only operation journal that persists the queue engine in JSON files.
+
+Instead of rewriting the whole queue after every operation, each operation is
+appended to the journal as one line of JSON:
+
+    {"seq": 12, "op": "help", "args": ["z1234567"]}
+
+On startup the latest snapshot is loaded and the operations journalled after it
+are replayed in order. Every so often the journal is compacted: the current
+state is written to a new snapshot and the journal is emptied.
+
+Records are written to the file as soon as they are appended, so other
+processes sharing the journal see them at once. How soon they are fsynced to
+the disk depends on config.DURABILITY:
+
+  "sync": every append is fsynced before it returns.
+
+  "group-commit": a flusher thread fsyncs everything written so far with one
+  fsync per round. commit() blocks until the caller's records are on disk, so
+  requests are only acknowledged once they are durable, but concurrent requests
+  share an fsync.
+
+  "write-behind": like "group-commit", but commit() does not wait and the
+  flusher only runs every config.FLUSH_INTERVAL seconds. A crash of the machine
+  can lose the operations acknowledged in the last interval.
+'''
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+# fcntl is not available on Windows, where the journal cannot be shared.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import config
+import encoding
+from storage import Storage, empty_snapshot
+
+class Journal(Storage):
+    '''
+    An append-only journal of operations plus the snapshot it is replayed on.
+
+    The snapshot is a single JSON file in the form described by Storage. Records
+    with a seq no greater than the snapshot's are skipped on replay, so a crash
+    between writing a snapshot and emptying the journal is harmless.
+
+    When shared, appends are serialised between processes by an exclusive lock
+    on a separate lock file, and changes() reads whatever other processes have
+    appended since this one last looked.
+    '''
+
+    def __init__(self, path=None, snapshot_path=None, durability=None, shared=None, legacy=True):
+        self.path = path or config.JOURNAL_FILE
+        self.snapshot_path = snapshot_path or config.SNAPSHOT_FILE
+        # whether a queue saved by an older helpr is carried over.
+        self.legacy = legacy
+        self.durability = durability or config.DURABILITY
+        if self.durability not in ("sync", "group-commit", "write-behind"):
+            raise ValueError(f"unknown durability mode {self.durability!r}")
+        self.shared = config.SHARED_STORAGE if shared is None else shared
+        if self.shared and fcntl is None:
+            raise ValueError("a shared journal needs fcntl file locking")
+        self.file = None
+        self.lock_file = None
+        # how many times locked() is entered, as load() may run inside it.
+        self.lock_depth = 0
+        # number of records in the journal since the last compaction.
+        self.length = 0
+        # number of bytes of the journal this process has read or written.
+        self.offset = 0
+        # identifies the snapshot file this process last loaded or wrote.
+        self.snapshot_id = None
+        # number of records appended and number known to be on disk.
+        self.appended = 0
+        self.durable = 0
+        # guards appended and durable, shared with the flusher thread. The
+        # engine's lock already serialises appends and compactions.
+        self.condition = threading.Condition()
+        self.flusher = None
+        self.closing = False
+
+    def load(self):
+        '''
+        Reads the snapshot and the records journalled after it.
+
+        A torn record at the end of the journal, left by a crash in the middle
+        of an append, is cut off so that later appends start on a fresh line.
+
+        Returns:
+          (tuple) : (snapshot, records) where snapshot is a dictionary in the
+          snapshot's form and records is a list of record dictionaries.
+        '''
+        with self.locked():
+            snapshot = self.load_snapshot()
+            records = []
+            valid_length = 0
+            try:
+                with open(self.path, "rb") as FILE:
+                    for line in FILE:
+                        record = decode(line)
+                        if record is None:
+                            break
+                        valid_length += len(line)
+                        if record['seq'] > snapshot['seq']:
+                            records.append(record)
+            # the journal does not exist yet.
+            except FileNotFoundError:
+                pass
+            self.open()
+            if self.file.tell() != valid_length:
+                self.file.truncate(valid_length)
+            self.offset = valid_length
+            self.length = len(records)
+            return snapshot, records
+
+    def load_snapshot(self):
+        self.snapshot_id = self.identify_snapshot()
+        try:
+            with open(self.snapshot_path, "rb") as FILE:
+                return json.load(FILE)
+        # no snapshot yet, so carry over a queue saved by an older helpr.
+        except FileNotFoundError:
+            return load_legacy_snapshot() if self.legacy else empty_snapshot()
+
+    def identify_snapshot(self):
+        try:
+            status = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return None
+        return status.st_ino, status.st_mtime_ns
+
+    def open(self):
+        if self.file is None:
+            self.file = open(self.path, "ab")
+
+    @contextmanager
+    def locked(self):
+        '''
+        Holds the lock that serialises appends between processes sharing the
+        journal. Does nothing if the journal is not shared.
+        '''
+        if not self.shared:
+            yield
+            return
+        if self.lock_file is None:
+            self.lock_file = open(self.path + ".lock", "ab")
+        if self.lock_depth == 0:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        self.lock_depth += 1
+        try:
+            yield
+        finally:
+            self.lock_depth -= 1
+            if self.lock_depth == 0:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def changes(self, seq):
+        '''
+        Returns the records other processes have appended since this process
+        last read or wrote the journal, or None if another process compacted
+        it and the snapshot must be loaded again.
+        '''
+        if not self.shared:
+            return []
+        if self.identify_snapshot() != self.snapshot_id:
+            return None
+        if os.stat(self.path).st_size == self.offset:
+            return []
+        records = []
+        with open(self.path, "rb") as FILE:
+            FILE.seek(self.offset)
+            for line in FILE:
+                record = decode(line)
+                # a record still being written will be read next time.
+                if record is None:
+                    break
+                if record['seq'] != seq + len(records) + 1:
+                    return None
+                records.append(record)
+                self.offset += len(line)
+        self.length += len(records)
+        return records
+
+    def append(self, record):
+        '''
+        Appends one record to the journal. Only in "sync" mode is the record
+        guaranteed to be on disk when this returns; see commit().
+        '''
+        self.append_all([record])
+
+    def append_all(self, records):
+        '''
+        Appends records to the journal with a single write, and in "sync" mode
+        a single fsync.
+        '''
+        self.open()
+        data = b"".join(encode(record) for record in records)
+        self.file.write(data)
+        self.file.flush()
+        if self.durability == "sync":
+            os.fsync(self.file.fileno())
+        self.offset += len(data)
+        self.length += len(records)
+        if self.durability != "sync":
+            with self.condition:
+                self.appended += len(records)
+                self.start_flusher()
+                self.condition.notify_all()
+
+    def commit(self):
+        '''
+        Blocks until every record appended so far is as durable as the
+        durability mode promises to acknowledge.
+        '''
+        if self.durability != "group-commit":
+            return
+        with self.condition:
+            target = self.appended
+            while self.durable < target:
+                self.condition.wait()
+
+    def start_flusher(self):
+        if self.flusher is None:
+            self.closing = False
+            self.flusher = threading.Thread(target=self.run_flusher, daemon=True)
+            self.flusher.start()
+
+    def run_flusher(self):
+        while True:
+            with self.condition:
+                if self.durability == "write-behind" and not self.closing:
+                    self.condition.wait(config.FLUSH_INTERVAL)
+                while self.durable == self.appended and not self.closing:
+                    self.condition.wait()
+                if self.closing and self.durable == self.appended:
+                    return
+            self.flush()
+
+    def flush(self):
+        '''
+        Fsyncs every record written so far with one fsync. Records appended
+        while the fsync is running are left for the next round.
+        '''
+        with self.condition:
+            target = self.appended
+            if target == self.durable:
+                return
+        os.fsync(self.file.fileno())
+        with self.condition:
+            self.durable = max(self.durable, target)
+            self.condition.notify_all()
+
+    def needs_compaction(self):
+        return self.length >= config.COMPACT_EVERY
+
+    def compact(self, snapshot):
+        '''
+        Writes snapshot as the new snapshot and empties the journal.
+
+        The snapshot is written to a temporary file and renamed over the old
+        one, so a crash leaves either the old or the new snapshot intact.
+        '''
+        temporary_path = self.snapshot_path + ".tmp"
+        with open(temporary_path, "wb") as FILE:
+            # encoded whole rather than by json.dump(), which writes it in
+            # thousands of small pieces, while the engine is held.
+            FILE.write(encoding.encode(snapshot))
+            FILE.flush()
+            os.fsync(FILE.fileno())
+        os.replace(temporary_path, self.snapshot_path)
+        self.snapshot_id = self.identify_snapshot()
+        self.open()
+        self.file.truncate(0)
+        # the snapshot includes every record written so far.
+        with self.condition:
+            self.durable = self.appended
+            self.condition.notify_all()
+        self.offset = 0
+        self.length = 0
+
+    def close(self):
+        '''
+        Syncs any records not yet on disk, stops the flusher and closes the file.
+        '''
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        if self.flusher is not None:
+            self.flusher.join()
+            self.flusher = None
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+def encode(record):
+    return encoding.encode(record) + b"\n"
+
+def decode(line):
+    '''
+    Returns the record on a line of the journal, or None if the line is torn.
+    '''
+    if not line.endswith(b"\n"):
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+def load_legacy_snapshot():
+    '''
+    Returns a snapshot of the queue_list.json and priority_dictionary.json files
+    that helpr kept before the journal, or an empty snapshot if there are none.
+    '''
+    snapshot = empty_snapshot()
+    try:
+        with open("queue_list.json","r") as FILE:
+            snapshot['queue_list'] = json.load(FILE)
+        with open("priority_dictionary.json","r") as FILE:
+            snapshot['priority_dictionary'] = json.load(FILE)
+    except FileNotFoundError:
+        pass
+    return snapshot
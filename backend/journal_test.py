@@ -0,0 +1,100 @@
+'''
+Unit tests for the operation journal that persists the queue engine
+'''
+
+import threading
+
+import pytest
+
+from engine import QueueEngine
+from journal import Journal
+
+def make_engine(tmp_path):
+    return QueueEngine(Journal(str(tmp_path / "journal.jsonl"), str(tmp_path / "snapshot.json")))
+
+def test_journal_replays_operations(tmp_path):
+    """
+    operations are replayed in order by a fresh engine.
+    """
+    engine = make_engine(tmp_path)
+    engine.make_request("z1234567","help me")
+    engine.make_request("z7654321","help me")
+    engine.help("z1234567")
+    engine.resolve("z1234567")
+    engine.make_request("z1234567","big problem")
+    engine.reprioritise()
+    engine.storage.close()
+
+    replayed = make_engine(tmp_path)
+    assert replayed.queue() == engine.queue()
+    assert replayed.priority_dictionary == engine.priority_dictionary
+    assert replayed.seq == engine.seq == 6
+    assert replayed.remaining("z1234567") == 1
+
+def test_journal_drops_torn_record(tmp_path):
+    """
+    a crash in the middle of an append leaves half a record behind.
+    the half record is ignored and cut off before the next append.
+    """
+    engine = make_engine(tmp_path)
+    engine.make_request("z1234567","help me")
+    engine.storage.close()
+    with open(tmp_path / "journal.jsonl", "ab") as FILE:
+        FILE.write(b'{"seq": 2, "op": "help", "ar')
+
+    recovered = make_engine(tmp_path)
+    assert recovered.queue() == [{'zid':'z1234567','description':'help me','status':'waiting'}]
+    recovered.help("z1234567")
+    recovered.storage.close()
+    assert make_engine(tmp_path).queue()[0]['status'] == 'receiving'
+
+def test_journal_compaction_skips_included_records(tmp_path, monkeypatch):
+    """
+    the journal is compacted into a snapshot after COMPACT_EVERY operations.
+    records already in the snapshot are skipped if the journal was not emptied.
+    """
+    monkeypatch.setattr("config.COMPACT_EVERY", 3)
+    engine = make_engine(tmp_path)
+    engine.make_request("z1234567","help me")
+    engine.help("z1234567")
+    journal_before = (tmp_path / "journal.jsonl").read_bytes()
+    engine.resolve("z1234567")
+    assert (tmp_path / "journal.jsonl").read_bytes() == b""
+    engine.storage.close()
+    # pretend the crash happened before the journal was emptied.
+    (tmp_path / "journal.jsonl").write_bytes(journal_before)
+
+    recovered = make_engine(tmp_path)
+    assert not recovered.queue()
+    assert recovered.priority_dictionary == {"z1234567": 1}
+    assert recovered.seq == 3
+
+@pytest.mark.parametrize("durability", ["sync", "group-commit", "write-behind"])
+def test_journal_durability_modes(tmp_path, durability):
+    """
+    records appended from several threads are all on disk after close().
+    in "group-commit" mode they are already on disk when commit() returns.
+    """
+    journal = Journal(str(tmp_path / "journal.jsonl"), str(tmp_path / "snapshot.json"), durability)
+    journal.load()
+    lock = threading.Lock()
+    seqs = iter(range(1, 201))
+
+    def append_some():
+        for _ in range(20):
+            with lock:
+                journal.append({'seq': next(seqs), 'op': 'reprioritise', 'args': []})
+                appended = journal.appended
+            journal.commit()
+            if durability == "group-commit":
+                assert journal.durable >= appended
+
+    threads = [threading.Thread(target=append_some) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    journal.close()
+
+    _, records = Journal(str(tmp_path / "journal.jsonl"), str(tmp_path / "snapshot.json")).load()
+    assert [record['seq'] for record in records] == list(range(1, 201))
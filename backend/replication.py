@@ -0,0 +1,215 @@
+'''
+Hot standby servers for the helpr application.
+
+A primary listens on config.REPLICATION_PORT plus its shard for followers.
+Each follower is sent a snapshot of every session the primary has open, and
+of every session it opens later, then every operation stored in them, one
+JSON message per line:
+
+    {"session": session, "snapshot": snapshot}
+    {"session": session, "records": [{"seq": seq, "op": op, "args": args}]}
+
+A follower applies them to engines of its own, kept in memory, so its queues
+are never more than one message behind the primary's, and serves the routes
+that only read them, see FOLLOWER_ROUTES, taking those reads off the primary.
+
+If the primary goes away, the follower keeps serving reads and tries to reach
+it again every config.FOLLOW_RETRY seconds, starting from fresh snapshots. A
+follower that is not connected can be promoted instead: its sessions move
+onto storage of their own, which replaces whatever the primary last stored,
+and it starts listening for followers of its own, as the new primary.
+'''
+
+import json
+import socket
+import threading
+import time
+from queue import Empty, Full, Queue
+
+import config
+import encoding
+
+# the routes a follower serves. every other route is answered 503 until the
+# follower is promoted.
+FOLLOWER_ROUTES = ('/queue', '/queue/stream', '/queue/changes', '/remaining', '/remaining/stream',
+                   '/statistics', '/promote')
+
+def encode(message):
+    return encoding.encode(message) + b"\n"
+
+class FollowerLink:
+    '''
+    The connection from a primary to one of its followers, and the messages
+    waiting to be sent on it.
+
+    The engines call send() while they are held, so it only encodes the
+    message and leaves it for run() to write, in order. At most
+    config.FOLLOWER_BACKLOG messages are left waiting: a follower that falls
+    further behind is disconnected, see drop().
+    '''
+
+    def __init__(self, sessions, connection):
+        self.sessions = sessions
+        self.connection = connection
+        self.messages = Queue(config.FOLLOWER_BACKLOG)
+        # the engines followed, each with its sender.
+        self.followed = []
+
+    def watch(self, session):
+        def send(message):
+            try:
+                self.messages.put_nowait(encode(dict(message, session=session.name)))
+            except Full:
+                self.drop()
+
+        session.engine.follow(send)
+        self.followed.append((session.engine, send))
+
+    def drop(self):
+        '''
+        Disconnects the follower without waiting, so that run() stops and the
+        follower starts again from fresh snapshots. The messages it missed
+        are never sent.
+        '''
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        # the follower is already gone.
+        except OSError:
+            pass
+
+    def run(self):
+        self.sessions.watch(self.watch)
+        try:
+            while True:
+                try:
+                    line = self.messages.get(timeout=config.STREAM_KEEPALIVE)
+                except Empty:
+                    # an empty line, so that a follower that went away is noticed.
+                    line = b"\n"
+                self.connection.sendall(line)
+        # the follower went away.
+        except OSError:
+            pass
+        finally:
+            self.sessions.unwatch(self.watch)
+            for engine, send in self.followed:
+                engine.unfollow(send)
+            self.connection.close()
+
+def serve_followers(sessions, port):
+    '''
+    Listens for followers of the sessions of a SessionRegistry at port on
+    localhost, serving each on a thread of its own.
+
+    Returns:
+      (socket) : the listening socket, which stops listening once shut down.
+      Closing it alone does not, while a thread is waiting in accept().
+    '''
+    listener = socket.create_server(("127.0.0.1", port))
+
+    def accept():
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            link = FollowerLink(sessions, connection)
+            threading.Thread(target=link.run, daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener
+
+class Follower:
+    '''
+    Follows the primary listening at port on localhost, copying its sessions
+    into a SessionRegistry until promote() is called.
+
+    connection is the connection to the primary, or None while it cannot be
+    reached.
+    '''
+
+    def __init__(self, sessions, port):
+        self.sessions = sessions
+        self.port = port
+        self.connection = None
+        self.promoted = False
+        self.lock = threading.Lock()
+        self.sessions.following = True
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            try:
+                connection = socket.create_connection(("127.0.0.1", self.port))
+            except OSError:
+                connection = None
+            with self.lock:
+                if self.promoted:
+                    if connection is not None:
+                        connection.close()
+                    return
+                self.connection = connection
+            if connection is not None:
+                try:
+                    for line in connection.makefile('rb'):
+                        if line.strip():
+                            self.apply(json.loads(line))
+                # the primary went away, or a message was missed or could not
+                # be applied, so the sessions are fetched again from fresh
+                # snapshots.
+                except Exception:
+                    pass
+                with self.lock:
+                    self.connection = None
+                connection.close()
+            time.sleep(config.FOLLOW_RETRY)
+
+    def apply(self, message):
+        '''
+        Applies one message from the primary.
+
+        Raises:
+          ValueError: if the message's records do not carry on from the last
+          operation applied to its session.
+        '''
+        engine = self.sessions.get(message['session']).engine
+        with engine.lock:
+            if 'snapshot' in message:
+                engine.restore(message['snapshot'])
+                # the events before the snapshot are unknown.
+                engine.history.clear()
+                engine.publish({'type': 'reset'})
+                return
+            records = message['records']
+            if not records:
+                return
+            if records[0]['seq'] != engine.seq + 1:
+                raise ValueError
+            engine.replay(records)
+
+    def promote(self):
+        '''
+        Stops following and moves the sessions onto storage of their own.
+
+        Raises:
+          ValueError: if the primary can still be reached, as two primaries
+          would overwrite each other's storage. Between attempts to reach it
+          the follower is not connected, so the primary is asked directly.
+        '''
+        if self.primary_answers():
+            raise ValueError
+        with self.lock:
+            if self.connection is not None:
+                raise ValueError
+            self.promoted = True
+        self.sessions.promote()
+
+    def primary_answers(self):
+        try:
+            connection = socket.create_connection(("127.0.0.1", self.port), config.PROMOTE_TIMEOUT)
+        except OSError:
+            return False
+        connection.close()
+        return True
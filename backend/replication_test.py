@@ -0,0 +1,161 @@
+'''
+Unit tests for hot standby followers of a server
+'''
+
+import socket
+import time
+
+import pytest
+
+import config
+from replication import Follower, FollowerLink, serve_followers
+from sessions import SessionRegistry
+
+@pytest.fixture(name='primary')
+def fixture_primary(monkeypatch, tmp_path):
+    """
+    returns an empty registry keeping its sessions in tmp_path, with the
+    socket listening for its followers.
+    """
+    monkeypatch.setattr(config, "JOURNAL_FILE", str(tmp_path / "journal.jsonl"))
+    monkeypatch.setattr(config, "SNAPSHOT_FILE", str(tmp_path / "snapshot.json"))
+    monkeypatch.setattr(config, "FOLLOW_RETRY", 0.05)
+    registry = SessionRegistry()
+    listener = serve_followers(registry, 0)
+    yield registry, listener
+    if listener.fileno() != -1:
+        listener.shutdown(socket.SHUT_RDWR)
+        listener.close()
+
+def wait_until(condition):
+    """
+    waits up to 5 seconds for condition() to hold.
+    """
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_follower_copies_sessions(primary):
+    """
+    a session is open before the follower connects and another after.
+    the follower copies both, and every operation made on them.
+    """
+    registry, listener = primary
+    lab1 = registry.get("lab1").engine
+    lab1.make_request("z1234567", "help me")
+    follower_registry = SessionRegistry()
+    follower = Follower(follower_registry, listener.getsockname()[1])
+    follower.start()
+    wait_until(lambda: follower_registry.get("lab1").engine.seq == lab1.seq)
+    lab2 = registry.get("lab2").engine
+    lab2.make_request("z7654321", "help me too")
+    lab1.batch([('make_request', ("z7654321", "more help")), ('help', ("z1234567",))])
+    lab1.resolve("z1234567")
+    wait_until(lambda: follower_registry.get("lab1").engine.seq == lab1.seq)
+    wait_until(lambda: follower_registry.get("lab2").engine.seq == lab2.seq)
+    assert follower_registry.get("lab1").engine.queue() == lab1.queue()
+    assert follower_registry.get("lab2").engine.queue() == lab2.queue()
+    assert follower_registry.get("lab1").engine.priority_dictionary == {"z1234567": 1, "z7654321": 0}
+
+def test_empty_batch(primary):
+    """
+    the primary is sent an empty batch, then another request.
+    the follower is sent nothing for the batch and keeps copying the queue.
+    """
+    registry, listener = primary
+    engine = registry.get("lab1").engine
+    engine.make_request("z1234567", "help me")
+    follower_registry = SessionRegistry()
+    follower = Follower(follower_registry, listener.getsockname()[1])
+    follower.start()
+    wait_until(lambda: follower_registry.get("lab1").engine.seq == engine.seq)
+    seq = engine.seq
+    engine.batch([])
+    assert engine.seq == seq
+    engine.make_request("z7654321", "help me too")
+    wait_until(lambda: follower_registry.get("lab1").engine.seq == engine.seq)
+    assert follower_registry.get("lab1").engine.queue() == engine.queue()
+    # a follower applying an empty list of records changes nothing.
+    follower.apply({'session': "lab1", 'records': []})
+
+def test_follower_reconnects(primary):
+    """
+    the follower loses its connection while the queue changes.
+    it connects again and catches up from a fresh snapshot.
+    """
+    registry, listener = primary
+    engine = registry.get("lab1").engine
+    follower_registry = SessionRegistry()
+    follower = Follower(follower_registry, listener.getsockname()[1])
+    follower.start()
+    wait_until(lambda: follower.connection is not None)
+    with pytest.raises(ValueError):
+        follower.promote()
+    follower.connection.shutdown(socket.SHUT_RDWR)
+    engine.make_request("z1234567", "help me")
+    wait_until(lambda: follower_registry.get("lab1").engine.seq == engine.seq)
+    assert follower_registry.get("lab1").engine.queue() == engine.queue()
+
+def test_promote_refused_while_primary_answers(primary, monkeypatch):
+    """
+    the follower's connection drops while the primary is still running.
+    promoting it is refused before it connects again, and it keeps following.
+    """
+    registry, listener = primary
+    monkeypatch.setattr(config, "FOLLOW_RETRY", 5)
+    registry.get("lab1").engine.make_request("z1234567", "help me")
+    follower_registry = SessionRegistry()
+    follower = Follower(follower_registry, listener.getsockname()[1])
+    follower.start()
+    wait_until(lambda: follower_registry.get("lab1").engine.seq == 1)
+    follower.connection.shutdown(socket.SHUT_RDWR)
+    wait_until(lambda: follower.connection is None)
+    with pytest.raises(ValueError):
+        follower.promote()
+    assert follower_registry.following
+
+def test_promote(primary, tmp_path):
+    """
+    the primary goes away and the follower is promoted.
+    the follower's sessions are stored and it takes new operations.
+    """
+    registry, listener = primary
+    registry.get("lab1").engine.make_request("z1234567", "help me")
+    follower_registry = SessionRegistry()
+    follower = Follower(follower_registry, listener.getsockname()[1])
+    follower.start()
+    wait_until(lambda: follower_registry.get("lab1").engine.seq == 1)
+    listener.shutdown(socket.SHUT_RDWR)
+    listener.close()
+    follower.connection.shutdown(socket.SHUT_RDWR)
+    wait_until(lambda: follower.connection is None)
+    follower.promote()
+    assert not follower_registry.following
+    engine = follower_registry.get("lab1").engine
+    engine.make_request("z7654321", "help me too")
+    reopened = SessionRegistry().get("lab1").engine
+    assert [request['zid'] for request in reopened.queue()] == ["z1234567", "z7654321"]
+    assert reopened.seq == 2
+
+def test_stalled_follower_dropped(monkeypatch, tmp_path):
+    """
+    a follower stops reading while the queue keeps changing.
+    once more messages wait than config.FOLLOWER_BACKLOG, it is disconnected and the queue carries on.
+    """
+    monkeypatch.setattr(config, "JOURNAL_FILE", str(tmp_path / "journal.jsonl"))
+    monkeypatch.setattr(config, "SNAPSHOT_FILE", str(tmp_path / "snapshot.json"))
+    monkeypatch.setattr(config, "FOLLOWER_BACKLOG", 5)
+    registry = SessionRegistry()
+    engine = registry.get("lab1").engine
+    primary_end, follower_end = socket.socketpair()
+    # the link is never run, so nothing it is sent is written.
+    link = FollowerLink(registry, primary_end)
+    link.watch(registry.get("lab1"))
+    for number in range(10):
+        engine.make_request(f"z{number}", "help me")
+    assert link.messages.qsize() == 5
+    assert follower_end.recv(1) == b""
+    assert engine.seq == 10
+    follower_end.close()
+    primary_end.close()
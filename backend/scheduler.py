@@ -0,0 +1,322 @@
+'''
+The scheduler that shares the students in the queue out between tutors.
+
+Tutors join with how many students they can help at once and keep in touch by
+calling heartbeat(). The scheduler gives the next waiting request to the
+least-loaded tutor with room to spare, and when a tutor leaves, or is not heard
+from for config.TUTOR_TIMEOUT seconds, the students they were helping are given
+to other tutors, or put back in the queue if there are none.
+
+It also keeps how long each tutor takes to help a student, from help() to
+resolve(), so that tutors and the people running the session can see it.
+'''
+
+import heapq
+import itertools
+import threading
+import time
+
+import config
+
+class Tutor:
+    '''
+    A tutor who has joined, the requests they are helping and how long they
+    have taken to help students so far.
+
+    version changes whenever the tutor's load or deadline does, so that the
+    entries the scheduler left in its heaps before are known to be stale.
+    '''
+
+    def __init__(self, name, capacity, deadline):
+        self.name = name
+        self.capacity = capacity
+        self.deadline = deadline
+        self.version = 0
+        self.helped = 0
+        self.service_time = 0.0
+
+    def view(self, helping):
+        return {
+            'tutor': self.name,
+            'capacity': self.capacity,
+            'helping': helping,
+            'helped': self.helped,
+            'mean_service_time': self.service_time / self.helped if self.helped else None,
+        }
+
+class Scheduler:
+    '''
+    Tracks the tutors of one engine and which requests each of them is helping.
+
+    The scheduler follows the engine's change events, so it knows who is
+    helping whom however the requests were helped, and holds the engine's lock
+    for everything it does, so it never sees the queue half changed.
+
+    holding maps the zid of every "receiving" request with a tutor to that
+    tutor, and helping maps every tutor to the zids they hold, whether or not
+    they have joined, e.g. after a restart. loads is a heap of
+    (load, order, name, version) entries, so the least-loaded tutor is found in
+    O(log T); deadlines is a heap of (deadline, name, version) entries, so
+    tutors not heard from are found in O(log T) each too. Entries whose version
+    is no longer their tutor's are skipped.
+
+    Tutors are timed out by a thread of the scheduler's own, started once the
+    first tutor is known, which sleeps until the earliest deadline, so their
+    students are given to someone else even if no tutor calls the scheduler.
+    While standby is set, e.g. on a follower, whose queue only changes as its
+    primary's does, the thread is not started, see resume().
+    '''
+
+    def __init__(self, engine, clock=time.monotonic, standby=False):
+        self.engine = engine
+        self.clock = clock
+        self.standby = standby
+        self.thread = None
+        # set whenever a deadline is pushed, so the thread sleeps again.
+        self.changed = threading.Event()
+        self.tutors = {}
+        self.holding = {}
+        self.helping = {}
+        self.started = {}
+        self.loads = []
+        self.deadlines = []
+        # breaks ties between equally loaded tutors, first come first served.
+        self.order = itertools.count()
+        with self.engine.lock:
+            self.engine.subscribe(self.listen)
+            self.rebuild()
+
+    def rebuild(self):
+        '''
+        Finds every request being helped by a tutor in the engine's queue.
+        Tutors holding requests who have not joined get until their deadline
+        to join, or their requests are given to someone else.
+        '''
+        self.holding = {}
+        self.helping = {name: [] for name in self.tutors}
+        now = self.clock()
+        for request in self.engine.requests.values():
+            tutor = request.get('tutor')
+            if request['status'] == 'receiving' and tutor is not None:
+                self.hold(request['zid'], tutor, now)
+        for name in self.helping:
+            if name not in self.tutors:
+                self.tutors[name] = Tutor(name, 0, now + config.TUTOR_TIMEOUT)
+        for tutor in self.tutors.values():
+            self.touch(tutor)
+
+    def listen(self, event):
+        '''
+        Keeps holding in step with the queue. Called by the engine, holding
+        its lock, after every change. The engine's state may already be ahead
+        of the event, e.g. in a batch, so only the event is looked at.
+        '''
+        if event['type'] == 'status':
+            zid = event['zid']
+            if event['status'] == 'waiting':
+                self.release(zid)
+                self.started.pop(zid, None)
+            elif 'tutor' in event:
+                self.hold(zid, event['tutor'], self.clock())
+        elif event['type'] == 'removed':
+            zid = event['zid']
+            tutor = self.release(zid)
+            if tutor is not None:
+                # only requests being helped are resolved.
+                tutor.helped += 1
+                tutor.service_time += self.clock() - self.started.pop(zid)
+        elif event['type'] in ('cleared', 'reset'):
+            self.started = {}
+            self.rebuild()
+
+    def hold(self, zid, name, now):
+        self.holding[zid] = name
+        self.helping.setdefault(name, []).append(zid)
+        self.started[zid] = now
+        if name in self.tutors:
+            self.touch(self.tutors[name])
+
+    def release(self, zid):
+        '''
+        Forgets that zid is being helped.
+
+        Returns:
+          (Tutor) : the tutor who was helping zid, if they have joined.
+        '''
+        name = self.holding.pop(zid, None)
+        if name is None:
+            return None
+        self.helping[name].remove(zid)
+        tutor = self.tutors.get(name)
+        if tutor is None:
+            self.started.pop(zid, None)
+            return None
+        self.touch(tutor)
+        return tutor
+
+    def touch(self, tutor):
+        '''
+        Pushes new heap entries for a tutor whose load or deadline changed.
+        '''
+        tutor.version += 1
+        load = len(self.helping.get(tutor.name, []))
+        heapq.heappush(self.loads, (load, next(self.order), tutor.name, tutor.version))
+        heapq.heappush(self.deadlines, (tutor.deadline, tutor.name, tutor.version))
+        self.changed.set()
+        self.start()
+        # drop the stale entries once they outnumber the live ones.
+        if len(self.loads) > 4 * len(self.tutors) + 16:
+            self.loads = [entry for entry in self.loads if self.current(entry[2], entry[3])]
+            heapq.heapify(self.loads)
+            self.deadlines = [entry for entry in self.deadlines if self.current(entry[1], entry[2])]
+            heapq.heapify(self.deadlines)
+
+    def current(self, name, version):
+        tutor = self.tutors.get(name)
+        return tutor is not None and tutor.version == version
+
+    def least_loaded(self):
+        '''
+        Returns the least-loaded tutor with room for another student, or None.
+        Its entry is left on the heap for the next call.
+        '''
+        while self.loads:
+            load, _, name, version = self.loads[0]
+            if self.current(name, version) and load < self.tutors[name].capacity:
+                return self.tutors[name]
+            # a full tutor is pushed again by touch() once they have room.
+            heapq.heappop(self.loads)
+        return None
+
+    def join(self, name, capacity=1):
+        '''
+        Adds a tutor, or changes the capacity of one who has already joined.
+
+        Raises:
+          ValueError: if name is the empty string or capacity is less than 1.
+        '''
+        if name == "" or capacity < 1:
+            raise ValueError
+        with self.engine.lock:
+            self.expire()
+            deadline = self.clock() + config.TUTOR_TIMEOUT
+            tutor = self.tutors.get(name)
+            if tutor is None:
+                tutor = self.tutors[name] = Tutor(name, capacity, deadline)
+            tutor.capacity = capacity
+            tutor.deadline = deadline
+            self.touch(tutor)
+
+    def heartbeat(self, name):
+        '''
+        Tells the scheduler a tutor is still there.
+
+        Raises:
+          KeyError: if the tutor has not joined, or has been timed out.
+        '''
+        with self.engine.lock:
+            self.expire()
+            tutor = self.tutors[name]
+            tutor.deadline = self.clock() + config.TUTOR_TIMEOUT
+            self.touch(tutor)
+
+    def leave(self, name):
+        '''
+        Removes a tutor, giving the students they were helping to the other
+        tutors, or putting them back in the queue.
+
+        Raises:
+          KeyError: if the tutor has not joined, or has been timed out.
+
+        Returns:
+          (dict) : the zid of every student the tutor was helping, mapped to
+          the tutor they were given to, or None if they were put back.
+        '''
+        with self.engine.lock:
+            self.expire()
+            return self.remove(name)
+
+    def remove(self, name):
+        del self.tutors[name]
+        moved = {}
+        for zid in self.helping.pop(name, []):
+            moved[zid] = self.reassign(zid)
+        return moved
+
+    def reassign(self, zid):
+        '''
+        Gives a request whose tutor has gone to the least-loaded tutor, or
+        reverts it if every tutor is full. Both are stored as one batch.
+        '''
+        del self.holding[zid]
+        self.started.pop(zid, None)
+        tutor = self.least_loaded()
+        if tutor is None:
+            self.engine.revert(zid)
+            return None
+        self.engine.batch([('revert', (zid,)), ('help', (zid, tutor.name))])
+        return tutor.name
+
+    def expire(self):
+        '''
+        Removes every tutor not heard from for config.TUTOR_TIMEOUT seconds.
+        '''
+        now = self.clock()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, name, version = heapq.heappop(self.deadlines)
+            if self.current(name, version):
+                self.remove(name)
+
+    def start(self):
+        '''
+        Starts the thread timing tutors out, unless it has been started or
+        the scheduler is standing by. The caller holds the engine.
+        '''
+        if self.thread is None and not self.standby:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def resume(self):
+        '''
+        Stops standing by, timing out the tutors known so far, e.g. once a
+        follower is promoted.
+        '''
+        with self.engine.lock:
+            self.standby = False
+            if self.tutors:
+                self.start()
+
+    def run(self):
+        while True:
+            with self.engine.lock:
+                self.changed.clear()
+                self.expire()
+                deadline = self.deadlines[0][0] if self.deadlines else None
+            # woken early by a new deadline, which may be earlier.
+            self.changed.wait(None if deadline is None else max(deadline - self.clock(), 0))
+
+    def assign(self, prioritised=False):
+        '''
+        Gives the first waiting request, in the queue's order or prioritised
+        order, to the least-loaded tutor with room for another student.
+
+        Returns:
+          (dict) : the request as returned by QueueEngine.help_next(), or None
+          if no request is waiting or every tutor is full.
+        '''
+        with self.engine.lock:
+            self.expire()
+            tutor = self.least_loaded()
+            if tutor is None:
+                return None
+            return self.engine.help_next(tutor.name, prioritised)
+
+    def view(self):
+        '''
+        Returns every tutor who has joined, by name, with the zids they are
+        helping and their service-time statistics.
+        '''
+        with self.engine.lock:
+            self.expire()
+            return [self.tutors[name].view(list(self.helping.get(name, [])))
+                    for name in sorted(self.tutors)]
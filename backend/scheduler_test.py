@@ -0,0 +1,150 @@
+'''
+Unit tests for the scheduler sharing students out between tutors
+'''
+
+import time
+
+import pytest
+
+import config
+from engine import QueueEngine
+from scheduler import Scheduler
+
+class Clock:
+    """
+    a clock the tests move by hand.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture(name='setup')
+def fixture_setup():
+    """
+    returns an empty engine, a scheduler over it and the scheduler's clock.
+    """
+    engine = QueueEngine()
+    engine.end()
+    clock = Clock()
+    scheduler = Scheduler(engine, clock)
+    yield engine, scheduler, clock
+    engine.unsubscribe(scheduler.listen)
+    engine.end()
+
+def test_assign_to_least_loaded(setup):
+    """
+    two tutors, one able to help two students at once, and four students.
+    each student goes to the tutor with the fewest students and room to spare.
+    """
+    engine, scheduler, _ = setup
+    scheduler.join("tutor1", 2)
+    scheduler.join("tutor2")
+    for number in range(4):
+        engine.make_request(f"z{number:07d}","help me")
+    assigned = [scheduler.assign()['tutor'] for _ in range(3)]
+    assert assigned == ["tutor1", "tutor2", "tutor1"]
+    assert scheduler.assign() is None
+    engine.resolve("z0000001")
+    assert scheduler.assign() == {'zid':'z0000003','description':'help me','status':'receiving','tutor':'tutor2'}
+    assert [tutor['helping'] for tutor in scheduler.view()] == [["z0000000", "z0000002"], ["z0000003"]]
+
+def test_leave_reassigns(setup):
+    """
+    a tutor leaves while helping two students and another tutor has room for one.
+    one student goes to the other tutor and the other waits again.
+    """
+    engine, scheduler, _ = setup
+    scheduler.join("tutor1", 2)
+    engine.make_request("z1234567","help me")
+    engine.make_request("z7654321","help me")
+    scheduler.assign()
+    scheduler.assign()
+    scheduler.join("tutor2")
+    assert scheduler.leave("tutor1") == {"z1234567": "tutor2", "z7654321": None}
+    assert engine.requests["z1234567"]['tutor'] == "tutor2"
+    assert engine.requests["z7654321"]['status'] == 'waiting'
+    with pytest.raises(KeyError):
+        scheduler.leave("tutor1")
+
+def test_silent_tutor_times_out(setup):
+    """
+    one of two tutors stops sending heartbeats.
+    after config.TUTOR_TIMEOUT their student goes to the other tutor.
+    """
+    engine, scheduler, clock = setup
+    scheduler.join("tutor1")
+    engine.make_request("z1234567","help me")
+    scheduler.assign()
+    scheduler.join("tutor2")
+    clock.now += config.TUTOR_TIMEOUT / 2
+    scheduler.heartbeat("tutor2")
+    clock.now += config.TUTOR_TIMEOUT / 2
+    assert [tutor['tutor'] for tutor in scheduler.view()] == ["tutor2"]
+    assert engine.requests["z1234567"]['tutor'] == "tutor2"
+    with pytest.raises(KeyError):
+        scheduler.heartbeat("tutor1")
+
+def test_timed_out_without_calls(monkeypatch):
+    """
+    a tutor helping a student stops sending heartbeats, and no one calls the scheduler again.
+    after config.TUTOR_TIMEOUT the student waits again.
+    """
+    monkeypatch.setattr(config, "TUTOR_TIMEOUT", 0.05)
+    engine = QueueEngine()
+    engine.end()
+    scheduler = Scheduler(engine)
+    scheduler.join("tutor1")
+    engine.make_request("z1234567","help me")
+    engine.help_next("tutor1")
+    deadline = time.monotonic() + 5
+    while engine.requests["z1234567"]['status'] != 'waiting':
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert 'tutor' not in engine.requests["z1234567"]
+    engine.unsubscribe(scheduler.listen)
+    engine.end()
+
+def test_service_time(setup):
+    """
+    a tutor helps two students, taking 10 and 20 seconds.
+    their mean service time is 15 seconds.
+    """
+    engine, scheduler, clock = setup
+    scheduler.join("tutor1")
+    for zid, seconds in (("z1234567", 10), ("z7654321", 20)):
+        engine.make_request(zid,"help me")
+        scheduler.assign()
+        clock.now += seconds
+        scheduler.heartbeat("tutor1")
+        engine.resolve(zid)
+    assert scheduler.view() == [{
+        'tutor': "tutor1",
+        'capacity': 1,
+        'helping': [],
+        'helped': 2,
+        'mean_service_time': 15.0,
+    }]
+
+def test_tutors_found_after_restart(setup):
+    """
+    a scheduler starts on a queue where a tutor is already helping a student.
+    the tutor may join again, or is timed out and their student reassigned.
+    """
+    engine, scheduler, clock = setup
+    scheduler.join("tutor1")
+    engine.make_request("z1234567","help me")
+    scheduler.assign()
+    engine.unsubscribe(scheduler.listen)
+
+    restarted = Scheduler(engine, clock)
+    assert restarted.view()[0]['helping'] == ["z1234567"]
+    restarted.join("tutor2")
+    clock.now += config.TUTOR_TIMEOUT / 2
+    restarted.heartbeat("tutor2")
+    clock.now += config.TUTOR_TIMEOUT / 2
+    assert [tutor['tutor'] for tutor in restarted.view()] == ["tutor2"]
+    assert engine.requests["z1234567"]['tutor'] == "tutor2"
+    engine.unsubscribe(restarted.listen)
+    engine.subscribe(scheduler.listen)
@@ -1,171 +1,74 @@
 '''
-A flask server for the backend of the 'helpr' application.
+A flask server for the backend of the 'helpr' application, serving the routes
+of api.py, whose docstring says how they are called and answered.
 
-GET routes are passed arguments as URL parameters. POST and DELETE routes are
-passed arguments as JSON data in the body of the request. All routes return data
-as JSON.
-'''
+Every request is handed to api.handle() as it is, so this server answers the
+same as async_server.py and stdlib_server.py, from the same cache, admission
+control and store of idempotency keys.
 
-from flask import Flask, request
-from flask_cors import CORS
+"python3 server.py <shard>" serves the sessions of a shard, listening on
+config.PORT + shard. "python3 server.py <shard> --follow" starts a hot standby
+of the server of a shard instead, see replication.py, which serves the routes
+that only read the queue until it is promoted with /promote.
+'''
 
-from werkzeug.exceptions import BadRequest
+from flask import Flask, Response, request
 
-from json import dumps
+from queue import Empty, SimpleQueue
+import sys
 
+import api
 import config
 import helpr
 
 APP = Flask(__name__)
-CORS(APP)
-
-@APP.route('/make_request', methods=['POST'])
-def make_request():
-    '''
-    A route for helpr.make_request()
-
-    Params: {"zid", "description"}
-
-    Raises: BadRequest if helpr.make_request() raises a KeyError or ValueError.
-
-    Returns: {}
-    '''
-    input_data = request.get_json()
-    zid = input_data['zid']
-    description = input_data['description']
-    try:
-        helpr.make_request(zid,description)
-    except (KeyError,ValueError):
-        raise BadRequest
-    return dumps({})
-
-@APP.route('/queue', methods=['GET'])
-def queue():
-    '''
-    A route for helpr.queue()
-
-    Returns: A list in the same format as helpr.queue()
-    '''
-    result = helpr.queue()
-    return dumps(result)
-
-@APP.route('/remaining', methods=['GET'])
-def remaining():
-    '''
-    A route for helpr.remaining()
-
-    Params: ("zid")
-
-    Raises: BadRequest if helpr.remaining() raises a KeyError.
-
-    Returns: { 'remaining': n } where n is an integer
-    '''
-    zid = request.args.get('zid')
-    try:
-        result = helpr.remaining(zid)
-    except KeyError:
-        raise BadRequest
-    return dumps({
-        'remaining': result, 
-    })
-
-@APP.route('/help', methods=['POST'])
-def help():
-    '''
-    A route for helpr.help()
-
-    Params: {"zid"}
-
-    Raises: BadRequest if helpr.help() raises a KeyError.
-
-    Returns: {}
-    '''
-    input_data = request.get_json()
-    zid = input_data['zid']
-    try:
-        helpr.help(zid)
-    except KeyError:
-        raise BadRequest    
-    return dumps({})
 
-@APP.route('/resolve', methods=['DELETE'])
-def resolve():
-    '''
-    A route for helpr.resolve()
-
-    Params: {"zid"}
-
-    Raises: BadRequest if helpr.resolve() raises a KeyError.
-
-    Returns: {}
-    '''
-    input_data = request.get_json()
-    zid = input_data['zid']
-    try:
-        helpr.resolve(zid)
-    except KeyError:
-        raise BadRequest
-    return dumps({})
-
-@APP.route('/cancel', methods=['DELETE'])
-def cancel():
-    '''
-    A route for helpr.cancel()
-
-    Params: {"zid"}
-
-    Raises: BadRequest if helpr.cancel() raises a KeyError.
-
-    Returns: {}
-    '''
-    input_data = request.get_json()
-    zid = input_data['zid']
+# every method a route answers, OPTIONS for CORS preflight requests, which
+# api.handle() answers itself.
+METHODS = ['GET', 'POST', 'DELETE', 'OPTIONS']
+
+@APP.route('/', defaults={'path': ''}, methods=METHODS)
+@APP.route('/<path:path>', methods=METHODS)
+def answer(path):
+    '''
+    Answers every request by api.handle(), once api.admit() lets it.
+    '''
+    headers = {name.lower(): value for name, value in request.headers.items()}
+    call = api.Call(request.method, request.full_path.rstrip('?'), headers, request.get_data())
+    reply = api.admit(call)
+    if reply is None:
+        try:
+            reply = api.handle(call)
+        except Exception:
+            reply = api.failure(call)
+        finally:
+            api.finish(call)
+    if isinstance(reply, api.Stream):
+        return Response(event_stream(reply), reply.status, reply.headers)
+    return Response(reply.body, reply.status, reply.headers)
+
+def event_stream(reply):
+    '''
+    Yields the events of a Stream until the client goes away, when Flask
+    closes the generator.
+    '''
+    events = SimpleQueue()
+    listener = events.put
+    first_event = reply.subscribe(listener)
     try:
-        helpr.cancel(zid)
-    except KeyError:
-        raise BadRequest
-    return dumps({})
-
-@APP.route('/revert', methods=['POST'])
-def revert():
-    '''
-    A route for helpr.revert()
-
-    Params: {"zid"}
-
-    Raises: BadRequest if helpr.revert() raises a KeyError.
-
-    Returns: {}
-    '''
-    input_data = request.get_json()
-    zid = input_data['zid']
-    try:
-        helpr.revert(zid)
-    except KeyError:
-        raise BadRequest
-    return dumps({})
-
-@APP.route('/reprioritise', methods=['POST'])
-def reprioritise():
-    '''
-    A route for helpr.reprioritise()
-
-    Returns: {}
-    '''
-    helpr.reprioritise()
-    return dumps({})
-
-@APP.route('/end', methods=['DELETE'])
-def end():
-    '''
-    A route for helpr.end()
-
-    Returns: {}
-    '''
-    helpr.end()
-    return dumps({})
+        yield api.event_text(first_event)
+        while True:
+            try:
+                event = events.get(timeout=config.STREAM_KEEPALIVE)
+            except Empty:
+                yield api.KEEPALIVE
+            else:
+                yield api.event_text(event)
+    finally:
+        reply.unsubscribe(listener)
 
 if __name__ == "__main__":
-    # Run the Flask webserver.
-    # Listen for all requests to localhost at config.PORT.
-    APP.run(port=config.PORT, debug=True)
\ No newline at end of file
+    # Listen for all requests to localhost at config.PORT plus the shard, or
+    # at config.FOLLOWER_PORT plus the shard when following.
+    port = helpr.start(sys.argv[1:])
+    APP.run(port=port, debug=True, use_reloader=False)
@@ -0,0 +1,131 @@
+'''
+The help sessions, e.g. one per lab, that a helpr server hosts at once.
+
+Every session has a queue engine and scheduler of its own, each with its own
+lock and storage, so operations on different sessions never wait for each
+other. Sessions are shared out between server processes by shard_of(), so that
+sessions on different shards run on different cores.
+'''
+
+import re
+import threading
+import zlib
+
+import config
+from broadcaster import PositionBroadcaster
+from engine import QueueEngine
+from scheduler import Scheduler
+from storage import MemoryStorage, open_storage, stored
+
+SESSION_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+class Session:
+    '''
+    The queue engine and scheduler of one session, and the broadcaster
+    pushing students their standing in its queue. standby is set for a
+    follower's copy of a session, whose scheduler times no tutors out.
+    '''
+
+    def __init__(self, name, storage=None, standby=False):
+        self.name = name
+        self.engine = QueueEngine(storage or open_storage(name))
+        self.scheduler = Scheduler(self.engine, standby=standby)
+        self.broadcaster = PositionBroadcaster(self.engine)
+
+class SessionRegistry:
+    '''
+    The sessions of the shard config.SHARD, opened on first use.
+
+    Only the calls that change a session create it: a session that is
+    neither open nor stored is not opened just to be read, so that reads of
+    made-up names neither create files nor take up one of the
+    config.MAX_SESSIONS sessions.
+
+    lock is only held while a session is opened, so looking up a session that
+    is already open takes no lock at all.
+
+    While following is set, the sessions are copies of a primary's, see
+    replication.py, kept in memory alone. watchers are called with every
+    session as it is opened.
+    '''
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.following = False
+        self.watchers = []
+
+    def get(self, name, create=True):
+        '''
+        Returns the session called name, opening it if it is not open yet.
+
+        Params:
+          create (bool): whether to create the session if it is neither open
+          nor stored, see storage.stored(). A follower only stores its
+          sessions in memory, so it only creates them when told to by the
+          primary.
+
+        Raises:
+          ValueError: if name is not a valid session id, the session belongs
+          to another shard, or config.MAX_SESSIONS sessions are already open.
+
+          KeyError: if create is False and the session is neither open nor
+          stored.
+        '''
+        session = self.sessions.get(name)
+        if session is not None:
+            return session
+        if not valid_session(name) or shard_of(name) != config.SHARD:
+            raise ValueError
+        with self.lock:
+            if name not in self.sessions:
+                if not create and (self.following or not stored(name)):
+                    raise KeyError(name)
+                if len(self.sessions) >= config.MAX_SESSIONS:
+                    raise ValueError
+                storage = MemoryStorage() if self.following else None
+                self.sessions[name] = Session(name, storage, self.following)
+                for watcher in self.watchers:
+                    watcher(self.sessions[name])
+            return self.sessions[name]
+
+    def names(self):
+        return sorted(self.sessions)
+
+    def watch(self, watcher):
+        '''
+        Adds a watcher and calls it with every session already open, so that
+        it sees every session exactly once.
+        '''
+        with self.lock:
+            self.watchers.append(watcher)
+            for session in self.sessions.values():
+                watcher(session)
+
+    def unwatch(self, watcher):
+        with self.lock:
+            self.watchers.remove(watcher)
+
+    def promote(self):
+        '''
+        Stops following, moving the sessions from memory onto storage of their
+        own, see QueueEngine.take_over(), and timing their tutors out.
+        '''
+        with self.lock:
+            self.following = False
+            for session in self.sessions.values():
+                session.engine.take_over(open_storage(session.name))
+                session.scheduler.resume()
+
+def valid_session(name):
+    '''
+    Returns whether name may name a session: 1 to 64 letters, digits, "-" or
+    "_", so that it is safe in file names.
+    '''
+    return isinstance(name, str) and SESSION_ID.fullmatch(name) is not None
+
+def shard_of(name):
+    '''
+    Returns the shard hosting the session called name.
+    '''
+    return zlib.crc32(name.encode()) % config.SHARDS
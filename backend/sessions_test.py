@@ -0,0 +1,82 @@
+'''
+Unit tests for the sessions a server hosts
+'''
+
+import pytest
+
+import config
+from sessions import SessionRegistry, valid_session, shard_of
+
+@pytest.fixture(name='registry')
+def fixture_registry(monkeypatch, tmp_path):
+    """
+    returns an empty registry keeping its sessions in tmp_path.
+    """
+    monkeypatch.setattr(config, "JOURNAL_FILE", str(tmp_path / "journal.jsonl"))
+    monkeypatch.setattr(config, "SNAPSHOT_FILE", str(tmp_path / "snapshot.json"))
+    return SessionRegistry()
+
+def test_session_ids():
+    """
+    session ids are short names safe to put in file names.
+    """
+    assert valid_session("lab-1_A")
+    assert not valid_session("")
+    assert not valid_session("../lab1")
+    assert not valid_session("a" * 65)
+    assert not valid_session(None)
+
+def test_sessions_have_own_files(registry, tmp_path):
+    """
+    two sessions each get an engine journalling to a file of its own.
+    opening a session again returns the same session.
+    """
+    lab1 = registry.get("lab1")
+    lab2 = registry.get("lab2")
+    assert registry.get("lab1") is lab1
+    assert lab1.engine is not lab2.engine
+    lab1.engine.make_request("z1234567","help me")
+    assert not lab2.engine.queue()
+    assert (tmp_path / "journal.lab1.jsonl").exists()
+    assert registry.names() == ["lab1", "lab2"]
+
+def test_sessions_limited(registry, monkeypatch):
+    """
+    no more than config.MAX_SESSIONS sessions are opened, and none with
+    invalid ids.
+    """
+    monkeypatch.setattr(config, "MAX_SESSIONS", 1)
+    registry.get("lab1")
+    with pytest.raises(ValueError):
+        registry.get("lab2")
+    with pytest.raises(ValueError):
+        registry.get("lab/1")
+
+def test_sessions_sharded(registry, monkeypatch):
+    """
+    with two shards, each shard only opens the sessions hashed to it.
+    """
+    monkeypatch.setattr(config, "SHARDS", 2)
+    names = [f"lab{number}" for number in range(8)]
+    shards = [shard_of(name) for name in names]
+    assert set(shards) == {0, 1}
+    for name, shard in zip(names, shards):
+        if shard == config.SHARD:
+            registry.get(name)
+        else:
+            with pytest.raises(ValueError):
+                registry.get(name)
+
+def test_reads_do_not_create(registry, tmp_path):
+    """
+    a session that was never changed is looked up without creating it.
+    it is neither opened nor given files, until it is created, and once stored
+    it is opened again by a registry that had not opened it.
+    """
+    with pytest.raises(KeyError):
+        registry.get("lab1", create=False)
+    assert registry.names() == []
+    assert not list(tmp_path.iterdir())
+    registry.get("lab1").engine.make_request("z1234567","help me")
+    assert registry.get("lab1", create=False) is registry.get("lab1")
+    assert SessionRegistry().get("lab1", create=False).engine.queue()
@@ -0,0 +1,196 @@
+'''
+The ordered index the queue engine keeps over a sequence of requests.
+'''
+
+import heapq
+from bisect import bisect_right
+
+from fenwick import FenwickTree
+
+class SlotIndex:
+    '''
+    Gives every request of a sequence a slot, an integer that increases along
+    the sequence, and counts the requests of each status in a Fenwick tree over
+    the slots.
+
+    slots maps each zid to its slot and zids maps each slot back to its zid, or
+    None for a hole. New requests take the next unused slot; removed requests
+    leave a hole behind. The slots are renumbered from 0 by rebuild() and when
+    the trees run out of room and more than half of them is holes.
+
+    Every slot also has a key, in keys, which increases along the slots and is
+    never renumbered: new requests take the next key, and a hole keeps the key
+    of its request until the holes are dropped. Only rebuild(), which may
+    reorder the requests, gives out new keys, all of them from first_key on.
+    Cursors name keys, so they stay valid while slots are renumbered.
+
+    Counting the "waiting" slots before a request's slot is a single prefix
+    sum, and the k-th request with either status is found in O(log n), so a
+    page of the sequence is read without visiting the requests before it.
+    '''
+
+    def __init__(self):
+        self.slots = {}
+        self.zids = []
+        self.next_slot = 0
+        self.keys = []
+        self.next_key = 0
+        self.first_key = 0
+        self.trees = {
+            'waiting': FenwickTree(),
+            'receiving': FenwickTree(),
+        }
+
+    def rebuild(self, requests):
+        '''
+        Gives the given requests, in order, consecutive slots and rebuilds the
+        trees, in O(n).
+        '''
+        requests = list(requests)
+        zids = [request['zid'] for request in requests]
+        statuses = [request['status'] for request in requests]
+        counts = {}
+        for status in self.trees:
+            counts[status] = [1 if other == status else 0 for other in statuses]
+        # the order may have changed, so the keys start again after every key
+        # given out before.
+        self.first_key = self.next_key
+        self.next_key += len(zids)
+        self.renumber(zids, counts, list(range(self.first_key, self.next_key)))
+
+    def renumber(self, zids, counts, keys):
+        self.zids = zids
+        self.keys = keys
+        self.slots = {zid: slot for slot, zid in enumerate(zids)}
+        self.next_slot = len(zids)
+        # leave room for as many new requests again before growing.
+        room = [0] * max(self.next_slot, 16)
+        for status, tree in self.trees.items():
+            tree.build(counts[status] + room)
+
+    def compact(self):
+        '''
+        Renumbers the requests already indexed, dropping the holes, in O(n).
+        '''
+        zids = []
+        keys = []
+        counts = {status: [] for status in self.trees}
+        values = {status: tree.values() for status, tree in self.trees.items()}
+        for slot, zid in enumerate(self.zids):
+            if zid is None:
+                continue
+            zids.append(zid)
+            keys.append(self.keys[slot])
+            for status in self.trees:
+                counts[status].append(values[status][slot])
+        self.renumber(zids, counts, keys)
+
+    def add(self, request):
+        '''
+        Gives a request the next unused slot, after every other request.
+        '''
+        if self.next_slot == len(self.trees['waiting']):
+            if len(self.slots) * 2 < self.next_slot:
+                self.compact()
+            else:
+                for tree in self.trees.values():
+                    tree.resize(max(self.next_slot * 2, 16))
+        slot = self.next_slot
+        self.next_slot += 1
+        self.slots[request['zid']] = slot
+        self.zids.append(request['zid'])
+        self.keys.append(self.next_key)
+        self.next_key += 1
+        self.trees[request['status']].add(slot, 1)
+
+    def remove(self, request):
+        slot = self.slots.pop(request['zid'])
+        self.zids[slot] = None
+        self.trees[request['status']].add(slot, -1)
+
+    def change(self, request, old_status):
+        '''
+        Moves a request whose status has just changed from old_status.
+        '''
+        slot = self.slots[request['zid']]
+        self.trees[old_status].add(slot, -1)
+        self.trees[request['status']].add(slot, 1)
+
+    def ahead(self, request, status):
+        '''
+        Returns the number of requests with status before a request.
+        '''
+        return self.trees[status].prefix_sum(self.slots[request['zid']])
+
+    def count(self, status):
+        return self.trees[status].total()
+
+    def __iter__(self):
+        for zid in self.zids:
+            if zid is not None:
+                yield zid
+
+    def cursor(self, zid):
+        '''
+        Returns a cursor naming the key and zid of a request, e.g.
+        "1041.z1234567", for following() to carry on after it.
+        '''
+        return f"{self.keys[self.slots[zid]]}.{zid}"
+
+    def cursor_slot(self, cursor):
+        '''
+        Returns the slot a cursor carries on after: the last slot whose key is
+        not after the cursor's, so the first request after it is the first one
+        still indexed, even once the request of the cursor is gone. A cursor
+        from before the last rebuild() carries on after its zid's request
+        instead, wherever it is now.
+
+        Raises:
+          ValueError: if the cursor is malformed, or is from before the last
+          rebuild() and its zid is no longer indexed.
+        '''
+        parts = cursor.split('.', 1)
+        if len(parts) != 2:
+            raise ValueError
+        key, zid = int(parts[0]), parts[1]
+        if key >= self.first_key:
+            return bisect_right(self.keys, key) - 1
+        if zid in self.slots:
+            return self.slots[zid]
+        raise ValueError
+
+    def following(self, cursor=None, status=None):
+        '''
+        Returns an iterator over the zids after cursor, or from the start if it
+        is None, in order and in O(log n) each, only those with status if it is
+        given.
+
+        Raises:
+          ValueError: as cursor_slot() does.
+        '''
+        after = self.cursor_slot(cursor) if cursor is not None else -1
+        return self.walk(after, status)
+
+    def after(self, zid):
+        '''
+        Returns the zid after zid's, or None if it is the last.
+        '''
+        return next(self.walk(self.slots[zid]), None)
+
+    def walk(self, after, status=None):
+        if status is not None:
+            slots = self.counted(self.trees[status], after)
+        else:
+            slots = heapq.merge(*(self.counted(tree, after) for tree in self.trees.values()))
+        for slot in slots:
+            yield self.zids[slot]
+
+    def counted(self, tree, slot):
+        '''
+        Yields the counted slots of a tree after slot, in order.
+        '''
+        k = tree.prefix_sum(slot + 1)
+        total = tree.total()
+        while k < total:
+            yield tree.find(k)
+            k += 1
@@ -0,0 +1,59 @@
+'''
+Unit tests for the slot index used by the queue engine
+'''
+
+import pytest
+
+from slots import SlotIndex
+
+def request(zid, status='waiting'):
+    return {'zid': zid, 'status': status}
+
+def test_slots_count_and_follow():
+    """
+    requests are added, changed and removed.
+    ahead() counts and following() visits them in order, by status.
+    """
+    index = SlotIndex()
+    for number in range(5):
+        index.add(request(f"z{number}"))
+    index.change(request("z1", 'receiving'), 'waiting')
+    index.remove(request("z3"))
+    assert list(index) == ["z0", "z1", "z2", "z4"]
+    assert index.ahead(request("z4"), 'waiting') == 2
+    assert index.count('receiving') == 1
+    assert list(index.following()) == ["z0", "z1", "z2", "z4"]
+    assert list(index.following(status='waiting')) == ["z0", "z2", "z4"]
+    assert list(index.following(index.cursor("z1"), 'waiting')) == ["z2", "z4"]
+
+def test_slots_cursor_survives_compaction():
+    """
+    enough requests come and go that the slots are renumbered.
+    a cursor carries on after its request.
+    """
+    index = SlotIndex()
+    index.add(request("z0"))
+    index.add(request("z1"))
+    cursor = index.cursor("z0")
+    for number in range(2, 100):
+        index.add(request(f"z{number}"))
+        index.remove(request(f"z{number}"))
+    assert index.next_slot < 10
+    assert list(index.following(cursor)) == ["z1"]
+    index.remove(request("z0"))
+    assert list(index.following(cursor)) == ["z1"]
+
+def test_slots_cursor_after_rebuild():
+    """
+    the requests are rebuilt in another order.
+    a cursor carries on after its request while it is indexed, and is refused after.
+    """
+    index = SlotIndex()
+    for number in range(3):
+        index.add(request(f"z{number}"))
+    cursor = index.cursor("z0")
+    index.rebuild([request("z2"), request("z0"), request("z1")])
+    assert list(index.following(cursor)) == ["z1"]
+    index.remove(request("z0"))
+    with pytest.raises(ValueError):
+        list(index.following(cursor))
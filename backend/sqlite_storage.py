@@ -0,0 +1,290 @@
+'''
+A storage backend that keeps the queue in an SQLite database in WAL mode.
+
+Unlike the JSON journal, the database always holds the current state of the
+session rather than a history of operations, so it can be inspected or shared
+directly. Every operation is applied with a few statements that reach the rows
+they touch through an index:
+
+  requests_by_zid: finding the request of a student, for status changes and
+  removals.
+
+  requests_by_status: the requests with a given status in queue order, so that
+  e.g. the "waiting" requests ahead of a slot are counted from the index alone
+  by anything else reading the database.
+
+  requests_by_priority: the requests in prioritised order, so that
+  reprioritise() reads them in order instead of sorting the table.
+
+config.DURABILITY is kept as SYNCHRONOUS says below. "group-commit" is weaker
+here than for the journal: a commit survives the server crashing, but the
+last commits before a power failure or operating system crash may be lost,
+although the database is never left corrupt.
+
+When several processes share the database, the operations are also kept in an
+operations table, so that each process can catch up with the others by
+replaying only the operations it has not seen.
+'''
+
+import json
+import sqlite3
+from contextlib import contextmanager
+
+import config
+from storage import Storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    slot INTEGER PRIMARY KEY,
+    zid TEXT NOT NULL,
+    description TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    tutor TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS requests_by_zid ON requests (zid);
+CREATE INDEX IF NOT EXISTS requests_by_status ON requests (status, slot);
+CREATE INDEX IF NOT EXISTS requests_by_priority ON requests (priority, slot);
+CREATE TABLE IF NOT EXISTS priorities (
+    zid TEXT PRIMARY KEY,
+    priority INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS operations (
+    seq INTEGER PRIMARY KEY,
+    op TEXT NOT NULL,
+    args TEXT NOT NULL
+);
+"""
+
+# how hard SQLite syncs to disk for each durability mode. In WAL mode "NORMAL"
+# only syncs at checkpoints, so commits share syncs much like group commit,
+# but a commit is acknowledged before it is synced: it survives the process
+# crashing, not the machine losing power before the next checkpoint.
+SYNCHRONOUS = {
+    'sync': "FULL",
+    'group-commit': "NORMAL",
+    'write-behind': "OFF",
+}
+
+class SqliteStorage(Storage):
+    '''
+    Keeps the requests, the priority dictionary and the sequence number of the
+    last operation in an SQLite database.
+
+    The slot of a request in the database orders the queue like the engine's
+    slots do, but is numbered independently: new requests take the slot after
+    the largest one, and reprioritise() moves every request past it.
+    '''
+
+    def __init__(self, path=None, durability=None, shared=None):
+        self.path = path or config.SQLITE_FILE
+        durability = durability or config.DURABILITY
+        if durability not in SYNCHRONOUS:
+            raise ValueError(f"unknown durability mode {durability!r}")
+        self.shared = config.SHARED_STORAGE if shared is None else shared
+        # transactions are begun and committed explicitly.
+        self.connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                                          timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"PRAGMA synchronous={SYNCHRONOUS[durability]}")
+        self.connection.executescript(SCHEMA)
+        # databases made before requests were assigned to tutors.
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(requests)")]
+        if 'tutor' not in columns:
+            self.connection.execute("ALTER TABLE requests ADD COLUMN tutor TEXT")
+        # changes whenever another connection commits to the database.
+        self.data_version = None
+        # number of operations appended since the last compaction.
+        self.length = 0
+
+    def load(self):
+        # a read transaction sees one consistent state of the database, unless
+        # locked() already holds one.
+        reading = not self.connection.in_transaction
+        if reading:
+            self.connection.execute("BEGIN")
+        try:
+            queue_list = []
+            for zid, description, status, priority, tutor in self.connection.execute(
+                    "SELECT zid, description, status, priority, tutor FROM requests ORDER BY slot"):
+                request = {
+                    'zid': zid,
+                    'description': description,
+                    'status': status,
+                    'priority': priority,
+                }
+                if tutor is not None:
+                    request['tutor'] = tutor
+                queue_list.append(request)
+            priority_dictionary = dict(self.connection.execute("SELECT zid, priority FROM priorities"))
+            snapshot = {
+                'seq': self.seq(),
+                'queue_list': queue_list,
+                'priority_dictionary': priority_dictionary,
+            }
+        finally:
+            if reading:
+                self.connection.execute("COMMIT")
+        self.data_version = self.read_data_version()
+        return snapshot, []
+
+    def seq(self):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+        return row[0] if row else 0
+
+    def read_data_version(self):
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    @contextmanager
+    def locked(self):
+        '''
+        Holds an immediate transaction, SQLite's write lock, if the database is
+        shared. append() then runs inside it instead of in its own transaction.
+        '''
+        if not self.shared:
+            yield
+            return
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def changes(self, seq):
+        if not self.shared:
+            return []
+        data_version = self.read_data_version()
+        if data_version == self.data_version:
+            return []
+        self.data_version = data_version
+        records = []
+        for row_seq, op, args in self.connection.execute(
+                "SELECT seq, op, args FROM operations WHERE seq > ? ORDER BY seq", (seq,)):
+            if row_seq != seq + len(records) + 1:
+                return None
+            records.append({
+                'seq': row_seq,
+                'op': op,
+                'args': json.loads(args),
+            })
+        if not records and self.seq() != seq:
+            return None
+        return records
+
+    def append(self, record):
+        self.append_all([record])
+
+    def append_all(self, records):
+        '''
+        Applies records to the tables in one transaction, unless locked()
+        already holds one.
+        '''
+        if self.connection.in_transaction:
+            for record in records:
+                self.apply(record)
+            return
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            for record in records:
+                self.apply(record)
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def apply(self, record):
+        '''
+        Applies one operation to the tables. The caller holds a transaction.
+        '''
+        execute = self.connection.execute
+        op = record['op']
+        args = record['args']
+        if op == 'make_request':
+            zid, description = args
+            execute("INSERT OR IGNORE INTO priorities (zid, priority) VALUES (?, 0)", (zid,))
+            execute("INSERT INTO requests (slot, zid, description, status, priority) "
+                    "VALUES ((SELECT IFNULL(MAX(slot), 0) + 1 FROM requests), ?, ?, 'waiting', "
+                    "(SELECT priority FROM priorities WHERE zid = ?))",
+                    (zid, description, zid))
+        elif op == 'help':
+            # args is [zid] or [zid, tutor].
+            execute("UPDATE requests SET status = 'receiving', tutor = ? WHERE zid = ?",
+                    (args[1] if len(args) > 1 else None, args[0]))
+        elif op == 'revert':
+            execute("UPDATE requests SET status = 'waiting', tutor = NULL WHERE zid = ?", args)
+        elif op == 'cancel':
+            execute("DELETE FROM requests WHERE zid = ?", args)
+        elif op == 'resolve':
+            execute("DELETE FROM requests WHERE zid = ?", args)
+            execute("UPDATE priorities SET priority = priority + 1 WHERE zid = ?", args)
+        elif op == 'reprioritise':
+            self.reprioritise()
+        elif op == 'end':
+            execute("DELETE FROM requests")
+            execute("DELETE FROM priorities")
+        else:
+            raise ValueError(f"unknown operation {op!r}")
+        execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seq', ?)", (record['seq'],))
+        if self.shared:
+            execute("INSERT INTO operations (seq, op, args) VALUES (?, ?, ?)",
+                    (record['seq'], op, json.dumps(args)))
+        self.length += 1
+
+    def reprioritise(self):
+        '''
+        Moves every request past the current largest slot, ordered by priority
+        and then by their current order.
+        '''
+        (largest,) = self.connection.execute("SELECT IFNULL(MAX(slot), 0) FROM requests").fetchone()
+        ordered = self.connection.execute("SELECT zid FROM requests ORDER BY priority, slot").fetchall()
+        self.connection.executemany(
+            "UPDATE requests SET slot = ? WHERE zid = ?",
+            [(largest + position, zid) for position, (zid,) in enumerate(ordered, start=1)])
+
+    def needs_compaction(self):
+        return self.length >= config.COMPACT_EVERY
+
+    def compact(self, snapshot):
+        '''
+        The tables are always current, so only the operations other processes
+        can no longer need are deleted. A process that falls further behind
+        loads the tables again.
+        '''
+        self.connection.execute("DELETE FROM operations WHERE seq <= ?",
+                                (snapshot['seq'] - config.COMPACT_EVERY,))
+        self.length = 0
+
+    def replace(self, snapshot):
+        '''
+        Rewrites the tables with the snapshot in one transaction, as compact()
+        leaves them as they are.
+        '''
+        execute = self.connection.execute
+        execute("BEGIN IMMEDIATE")
+        try:
+            execute("DELETE FROM requests")
+            execute("DELETE FROM priorities")
+            execute("DELETE FROM operations")
+            self.connection.executemany(
+                "INSERT INTO requests (slot, zid, description, status, priority, tutor) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(slot, request['zid'], request['description'], request['status'],
+                  request['priority'], request.get('tutor'))
+                 for slot, request in enumerate(snapshot['queue_list'], start=1)])
+            self.connection.executemany("INSERT INTO priorities (zid, priority) VALUES (?, ?)",
+                                        snapshot['priority_dictionary'].items())
+            execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seq', ?)", (snapshot['seq'],))
+        except BaseException:
+            execute("ROLLBACK")
+            raise
+        execute("COMMIT")
+        self.length = 0
+
+    def close(self):
+        self.connection.close()
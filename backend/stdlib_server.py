@@ -0,0 +1,101 @@
+'''
+A server for the backend of the 'helpr' application built on http.server alone,
+serving the same routes as server.py, see api.py.
+
+It imports nothing outside the standard library, so it starts in a fraction of
+the time and memory Flask needs, for short-lived servers started for one lab
+and stopped after it. Each connection gets a thread, as with Flask's server.
+
+Run from the backend directory, optionally with the shard to serve, as with
+server.py:
+
+    python3 stdlib_server.py [shard]
+'''
+
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, SimpleQueue
+
+import api
+import config
+import helpr
+
+class Handler(BaseHTTPRequestHandler):
+    '''
+    Answers every method by api.handle(), once api.admit() lets it.
+    '''
+
+    # keep connections open between requests.
+    protocol_version = "HTTP/1.1"
+    # send each answer in one write, flushed after it, so that it is not held
+    # back waiting for the client to acknowledge the headers.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def answer(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        headers = {name.lower(): value for name, value in self.headers.items()}
+        call = api.Call(self.command, self.path, headers, body)
+        reply = api.admit(call)
+        if reply is None:
+            try:
+                reply = api.handle(call)
+            except Exception:
+                reply = api.failure(call)
+            finally:
+                api.finish(call)
+        if isinstance(reply, api.Stream):
+            self.stream(reply)
+            return
+        self.send_response(reply.status)
+        for name, value in reply.headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(reply.body)))
+        self.end_headers()
+        self.wfile.write(reply.body)
+
+    do_GET = do_POST = do_DELETE = do_OPTIONS = answer
+
+    def stream(self, reply):
+        self.close_connection = True
+        events = SimpleQueue()
+        listener = events.put
+        first_event = reply.subscribe(listener)
+        try:
+            self.send_response(reply.status)
+            for name, value in reply.headers.items():
+                self.send_header(name, value)
+            self.send_header('Connection', 'close')
+            # the body has no length, so each event is sent as a chunk of it.
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.write(api.chunk(api.event_text(first_event)))
+            self.wfile.flush()
+            while True:
+                try:
+                    event = events.get(timeout=config.STREAM_KEEPALIVE)
+                except Empty:
+                    self.wfile.write(api.chunk(api.KEEPALIVE))
+                else:
+                    self.wfile.write(api.chunk(api.event_text(event)))
+                self.wfile.flush()
+        # the client went away.
+        except ConnectionError:
+            pass
+        finally:
+            reply.unsubscribe(listener)
+
+    def log_message(self, format, *args):
+        # one line per request costs more than answering it.
+        pass
+
+class Server(ThreadingHTTPServer):
+    # do not wait for open streams on shutdown.
+    daemon_threads = True
+
+if __name__ == "__main__":
+    # Listen for all requests to localhost at config.PORT plus the shard, or
+    # at config.FOLLOWER_PORT plus the shard when following.
+    port = helpr.start(sys.argv[1:])
+    Server(("127.0.0.1", port), Handler).serve_forever()
@@ -0,0 +1,171 @@
+'''
+The storage interface between the queue engine and wherever its state is kept.
+
+The engine keeps the whole session in memory and hands every operation it
+applies to a storage backend as a record:
+
+    {'seq': seq, 'op': op, 'args': args}
+
+config.STORAGE selects the backend:
+
+  "json": the operation journal and JSON snapshot in journal.py.
+
+  "sqlite": the indexed SQLite database in sqlite_storage.py.
+
+  "binary": the memory-mapped binary tables in binary_storage.py.
+'''
+
+import os
+from contextlib import contextmanager
+
+import config
+
+class Storage:
+    '''
+    The interface every storage backend implements.
+
+    A snapshot is a dictionary in the form:
+    {
+        'seq': seq,
+        'queue_list': queue_list,
+        'priority_dictionary': priority_dictionary,
+    }
+    where queue_list is in queue order and seq is the sequence number of the
+    last operation it includes.
+
+    shared tells whether other processes share the storage, see locked().
+    '''
+
+    shared = False
+
+    def load(self):
+        '''
+        Returns:
+          (tuple) : (snapshot, records) where records are the operations made
+          after the snapshot, to be replayed on it in order.
+        '''
+        raise NotImplementedError
+
+    @contextmanager
+    def locked(self):
+        '''
+        Excludes every other process sharing this storage while the engine
+        catches up with changes() and applies and appends an operation.
+        '''
+        yield
+
+    def changes(self, seq):
+        '''
+        Returns the operations after seq that other processes sharing this
+        storage have appended, or None if the engine must load() again.
+        '''
+        return []
+
+    def append(self, record):
+        '''
+        Persists one operation that the engine has just applied.
+        '''
+        raise NotImplementedError
+
+    def append_all(self, records):
+        '''
+        Persists several operations the engine has just applied at once, e.g.
+        a batch, in one write where the backend allows.
+        '''
+        for record in records:
+            self.append(record)
+
+    def commit(self):
+        '''
+        Blocks until the operations appended so far are as durable as
+        config.DURABILITY promises to acknowledge.
+        '''
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, snapshot):
+        '''
+        Replaces the persisted operations with the given snapshot.
+        '''
+
+    def replace(self, snapshot):
+        '''
+        Replaces everything persisted with the given snapshot, even what was
+        stored by operations the engine never applied, e.g. when a follower
+        takes over the primary's storage. Backends whose compact() rewrites
+        all of it already do this.
+        '''
+        self.compact(snapshot)
+
+    def close(self):
+        pass
+
+class MemoryStorage(Storage):
+    '''
+    Keeps nothing: the storage of the engines of a follower, see
+    replication.py, whose operations are stored by the primary it follows.
+    '''
+
+    def load(self):
+        return empty_snapshot(), []
+
+    def append(self, record):
+        pass
+
+def empty_snapshot():
+    return {
+        'seq': 0,
+        'queue_list': [],
+        'priority_dictionary': {},
+    }
+
+def open_storage(session=None):
+    '''
+    Returns a new instance of the storage backend chosen by config.STORAGE.
+
+    Params:
+      (str) session: the session whose queue is stored, see sessions.py. Each
+      session other than config.DEFAULT_SESSION has files of its own, named
+      after the configured ones, e.g. "queue_journal.lab1.jsonl".
+
+    Raises:
+      ValueError: if config.STORAGE does not name a backend.
+    '''
+    # backends are imported when chosen, since not every python is built with
+    # sqlite3.
+    if config.STORAGE == "json":
+        from journal import Journal
+        return Journal(session_path(config.JOURNAL_FILE, session),
+                       session_path(config.SNAPSHOT_FILE, session),
+                       legacy=session in (None, config.DEFAULT_SESSION))
+    if config.STORAGE == "sqlite":
+        from sqlite_storage import SqliteStorage
+        return SqliteStorage(session_path(config.SQLITE_FILE, session))
+    if config.STORAGE == "binary":
+        from binary_storage import BinaryStorage
+        return BinaryStorage(session_path(config.BINARY_FILE, session))
+    raise ValueError(f"unknown storage backend {config.STORAGE!r}")
+
+def stored(session=None):
+    '''
+    Returns whether the storage backend chosen by config.STORAGE has files for
+    session, i.e. whether open_storage(session) would find anything to load
+    rather than creating them.
+    '''
+    if config.STORAGE == "json":
+        paths = (config.JOURNAL_FILE, config.SNAPSHOT_FILE)
+    elif config.STORAGE == "sqlite":
+        paths = (config.SQLITE_FILE,)
+    else:
+        paths = (config.BINARY_FILE,)
+    return any(os.path.exists(session_path(path, session)) for path in paths)
+
+def session_path(path, session):
+    '''
+    Returns the name of a session's copy of the file at path.
+    '''
+    if session in (None, config.DEFAULT_SESSION):
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{session}{extension}"
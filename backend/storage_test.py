@@ -0,0 +1,144 @@
+'''
+Unit tests for the storage backends of the queue engine
+'''
+
+import pytest
+
+from engine import QueueEngine
+from journal import Journal
+from sqlite_storage import SqliteStorage
+from storage import MemoryStorage
+from binary_storage import BinaryStorage
+
+@pytest.fixture(name='open_storage', params=["json", "sqlite", "binary"])
+def fixture_open_storage(request, tmp_path):
+    """
+    returns a function opening the same storage of each backend in tmp_path.
+    """
+    def open_storage():
+        if request.param == "json":
+            return Journal(str(tmp_path / "journal.jsonl"), str(tmp_path / "snapshot.json"))
+        if request.param == "sqlite":
+            return SqliteStorage(str(tmp_path / "queue.sqlite3"))
+        return BinaryStorage(str(tmp_path / "queue.bin"))
+    return open_storage
+
+def test_storage_round_trip(open_storage):
+    """
+    a fresh engine over the same storage sees the same session.
+    """
+    engine = QueueEngine(open_storage())
+    engine.make_request("z1234567","help me")
+    engine.help("z1234567")
+    engine.resolve("z1234567")
+    engine.make_request("z7654321","help me")
+    engine.make_request("z5258270","help me")
+    engine.make_request("z1234567","big problem")
+    engine.help("z5258270")
+    engine.cancel("z7654321")
+    engine.storage.close()
+
+    reloaded = QueueEngine(open_storage())
+    assert reloaded.queue() == [{'zid':'z5258270','description':'help me','status':'receiving'},
+                                {'zid':'z1234567','description':'big problem','status':'waiting'}]
+    assert reloaded.priority_dictionary == {"z1234567": 1, "z7654321": 0, "z5258270": 0}
+    assert reloaded.seq == engine.seq
+    reloaded.storage.close()
+
+def test_storage_keeps_reprioritised_order(open_storage):
+    """
+    the stored queue is in the order reprioritise() left it in.
+    """
+    engine = QueueEngine(open_storage())
+    engine.make_request("z1234567","help me")
+    engine.help("z1234567")
+    engine.resolve("z1234567")
+    engine.make_request("z1234567","help me")
+    engine.make_request("z7654321","help me")
+    engine.make_request("z5258270","help me")
+    engine.reprioritise()
+    engine.make_request("z5258271","help me")
+    engine.storage.close()
+
+    reloaded = QueueEngine(open_storage())
+    assert [request['zid'] for request in reloaded.queue()] == ["z7654321", "z5258270", "z1234567", "z5258271"]
+    reloaded.end()
+    reloaded.storage.close()
+    assert not QueueEngine(open_storage()).queue()
+
+def test_storage_keeps_batch(open_storage):
+    """
+    a batch is stored, and a failed batch leaves nothing behind.
+    """
+    engine = QueueEngine(open_storage())
+    engine.make_request("z1234567","help me")
+    engine.batch([('make_request', ("z7654321","help me")), ('help', ("z1234567",)), ('resolve', ("z1234567",))])
+    with pytest.raises(KeyError):
+        engine.batch([('help', ("z7654321",)), ('resolve', ("z0000000",))])
+    assert engine.queue() == [{'zid':'z7654321','description':'help me','status':'waiting'}]
+    assert engine.seq == 4
+    engine.storage.close()
+
+    reloaded = QueueEngine(open_storage())
+    assert reloaded.queue() == [{'zid':'z7654321','description':'help me','status':'waiting'}]
+    assert reloaded.priority_dictionary == {"z1234567": 1, "z7654321": 0}
+    assert reloaded.seq == 4
+    reloaded.storage.close()
+
+def test_storage_keeps_auto_prioritised_order(open_storage):
+    """
+    an auto-prioritised engine reloads the queue in prioritised order.
+    """
+    engine = QueueEngine(open_storage(), auto_prioritise=True)
+    engine.make_request("z1234567","help me")
+    engine.help("z1234567")
+    engine.resolve("z1234567")
+    engine.make_request("z1234567","help me")
+    engine.make_request("z7654321","help me")
+    engine.make_request("z5258270","help me")
+    assert [request['zid'] for request in engine.queue()] == ["z7654321", "z5258270", "z1234567"]
+    engine.storage.close()
+
+    reloaded = QueueEngine(open_storage(), auto_prioritise=True)
+    assert reloaded.queue() == engine.queue()
+    assert reloaded.remaining("z1234567") == 2
+    reloaded.storage.close()
+
+def test_storage_keeps_tutor(open_storage):
+    """
+    the tutor a request was given to by help_next() is stored, and forgotten
+    on revert().
+    """
+    engine = QueueEngine(open_storage())
+    engine.make_request("z1234567","help me")
+    engine.make_request("z7654321","help me")
+    engine.help_next("tutor1")
+    engine.help_next("tutor2")
+    engine.revert("z7654321")
+    engine.storage.close()
+
+    reloaded = QueueEngine(open_storage())
+    assert reloaded.requests["z1234567"]['tutor'] == "tutor1"
+    assert 'tutor' not in reloaded.requests["z7654321"]
+    reloaded.storage.close()
+
+def test_take_over(open_storage):
+    """
+    an engine takes over storage holding an operation it never applied.
+    the storage then holds only the engine's queue, and takes new operations.
+    """
+    primary = QueueEngine(open_storage())
+    primary.make_request("z1234567","help me")
+    follower = QueueEngine(MemoryStorage())
+    follower.restore(primary.snapshot())
+    primary.make_request("z7654321","help me too")
+    primary.storage.close()
+
+    follower.take_over(open_storage())
+    follower.make_request("z7654321","help me again")
+    follower.storage.close()
+    reloaded = QueueEngine(open_storage())
+    assert reloaded.queue() == [{'zid':'z1234567','description':'help me','status':'waiting'},
+                                {'zid':'z7654321','description':'help me again','status':'waiting'}]
+    assert reloaded.seq == follower.seq == 2
+    reloaded.storage.close()
@@ -0,0 +1,260 @@
+'''
+The immutable versions of a queue that the queue engine publishes, so that
+reading the queue never waits for the operations changing it.
+'''
+
+from bisect import bisect_left, bisect_right
+
+from encoding import encode
+
+# leaves are built with FANOUT entries and nodes with FANOUT children, and
+# either is split in two once it holds twice as many.
+FANOUT = 64
+
+class Node:
+    '''
+    An inner node of a version: its children, each a Node or a leaf, a tuple of
+    entries, along with the first key and the number of waiting requests under
+    each child.
+
+    encoded holds, for each child that is a leaf, its entries as tutors see
+    them encoded as JSON, see encode_leaf(), or None until they are first
+    asked for. It is the only part of a node filled in after it is made, and
+    a node made in place of another keeps the encodings of the leaves they
+    share, so only leaves that changed are ever encoded again.
+    '''
+
+    __slots__ = ('firsts', 'children', 'waiting', 'encoded')
+
+    def __init__(self, firsts=(), children=(), waiting=(), encoded=None):
+        self.firsts = firsts
+        self.children = children
+        self.waiting = waiting
+        self.encoded = encoded if encoded is not None else [None] * len(children)
+
+class QueueVersion:
+    '''
+    The queue as it was at one seq, which never changes once made.
+
+    Every request has a key, its place in the queue, and is kept as an entry
+    (key, zid, description, status) in a tree ordered by key: a B-tree whose
+    leaves are tuples of entries. Changing one request makes a new version by
+    copying the leaf it is in and the nodes above it, a few hundred references
+    in all, and sharing every other node and leaf with the version before.
+
+    keys maps each zid to the key of its request. It is the engine's own
+    dictionary, which keeps changing after the version is made, so a key found
+    in it is only trusted if the version has the zid's entry under that key.
+    '''
+
+    __slots__ = ('seq', 'keys', 'root')
+
+    def __init__(self, seq, keys, root=None):
+        self.seq = seq
+        self.keys = keys
+        self.root = root or Node()
+
+    @classmethod
+    def build(cls, seq, keys, entries):
+        '''
+        Returns the version holding entries, sorted by key, in O(n).
+        '''
+        level = [tuple(entries[start:start + FANOUT]) for start in range(0, len(entries), FANOUT)]
+        while True:
+            level = [make_node(level[start:start + FANOUT]) for start in range(0, len(level), FANOUT)]
+            if len(level) <= 1:
+                return cls(seq, keys, level[0] if level else None)
+
+    def at(self, seq):
+        '''
+        Returns this version of the queue as the version at seq.
+        '''
+        return QueueVersion(seq, self.keys, self.root)
+
+    def edit(self, key, edit):
+        '''
+        Returns the version with the leaf where key is, or would go, replaced
+        as edit() says, see update().
+        '''
+        nodes, _ = update(self.root, key, edit)
+        if len(nodes) == 1:
+            return QueueVersion(self.seq, self.keys, nodes[0])
+        return QueueVersion(self.seq, self.keys, make_node(nodes) if nodes else None)
+
+    def insert(self, entry):
+        '''
+        Returns the version with entry added at its key.
+        '''
+        def edit(leaf):
+            position = bisect_left(leaf, entry[:1])
+            leaf = leaf[:position] + (entry,) + leaf[position:]
+            return split(leaf), entry[3] == 'waiting'
+
+        return self.edit(entry[0], edit)
+
+    def change(self, key, status):
+        '''
+        Returns the version with the request of key given status.
+        '''
+        def edit(leaf):
+            position = bisect_left(leaf, (key,))
+            _, zid, description, old_status = leaf[position]
+            leaf = leaf[:position] + ((key, zid, description, status),) + leaf[position + 1:]
+            return (leaf,), (status == 'waiting') - (old_status == 'waiting')
+
+        return self.edit(key, edit)
+
+    def remove(self, key):
+        '''
+        Returns the version without the request of key.
+        '''
+        def edit(leaf):
+            position = bisect_left(leaf, (key,))
+            delta = -(leaf[position][3] == 'waiting')
+            leaf = leaf[:position] + leaf[position + 1:]
+            return ((leaf,) if leaf else ()), delta
+
+        return self.edit(key, edit)
+
+    def queue(self):
+        '''
+        Returns the queue, as QueueEngine.queue() does.
+        '''
+        level = [self.root]
+        while level and isinstance(level[0], Node):
+            level = [child for node in level for child in node.children]
+        return [{
+            'zid': zid,
+            'description': description,
+            'status': status,
+        } for leaf in level for _, zid, description, status in leaf]
+
+    def encoded_queue(self):
+        '''
+        Returns queue() encoded as JSON, see encoding.encode(), joined from the
+        encodings of the leaves, encoding only those not encoded before.
+        '''
+        parts = []
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            if node.children and isinstance(node.children[0], Node):
+                nodes.extend(reversed(node.children))
+                continue
+            encoded = node.encoded
+            for index, leaf in enumerate(node.children):
+                if encoded[index] is None:
+                    # filled in by whichever reader comes first; readers racing
+                    # for a leaf encode it the same.
+                    encoded[index] = encode_leaf(leaf)
+            parts.extend(encoded)
+        return b"[" + b",".join(parts) + b"]"
+
+    def remaining(self, zid):
+        '''
+        Returns the number of waiting requests ahead of zid's, as
+        QueueEngine.remaining() does, or None if this version cannot tell:
+        zid's request was not waiting, or keys has changed since.
+        '''
+        standing = self.standing(zid)
+        if standing is None:
+            return None
+        return standing['remaining']
+
+    def standing(self, zid):
+        '''
+        Returns where zid's request stands, as QueueEngine.standing() does, or
+        None if this version cannot tell: zid has no request now, or keys has
+        changed since.
+        '''
+        key = self.keys.get(zid)
+        if key is None:
+            return None
+        ahead = 0
+        node = self.root
+        while isinstance(node, Node):
+            if not node.children:
+                return None
+            index = max(bisect_right(node.firsts, key) - 1, 0)
+            ahead += sum(node.waiting[:index])
+            node = node.children[index]
+        position = bisect_left(node, (key,))
+        if position == len(node) or node[position][:2] != (key, zid):
+            return None
+        status = node[position][3]
+        if status != 'waiting':
+            return {'status': status, 'remaining': None}
+        return {'status': 'waiting', 'remaining': ahead + count_waiting(node[:position])}
+
+def update(node, key, edit):
+    '''
+    Applies edit to the leaf under node where key is, or would go. edit(leaf)
+    returns (leaves, delta): none, one or two leaves to replace it with and the
+    change in the number of waiting requests.
+
+    Returns:
+      (tuple) : (nodes, delta) where nodes are none, one or two nodes to
+      replace node with.
+    '''
+    children = node.children
+    if not children:
+        replacement, delta = edit(())
+        return (make_node(replacement),), delta
+    index = max(bisect_right(node.firsts, key) - 1, 0)
+    child = children[index]
+    if isinstance(child, Node):
+        replacement, delta = update(child, key, edit)
+    else:
+        replacement, delta = edit(child)
+    firsts = node.firsts
+    waiting = node.waiting
+    if len(replacement) == 1:
+        first = first_key(replacement[0])
+        if first != firsts[index]:
+            firsts = firsts[:index] + (first,) + firsts[index + 1:]
+        if delta:
+            waiting = waiting[:index] + (waiting[index] + delta,) + waiting[index + 1:]
+    else:
+        firsts = firsts[:index] + tuple(map(first_key, replacement)) + firsts[index + 1:]
+        waiting = waiting[:index] + tuple(map(waiting_under, replacement)) + waiting[index + 1:]
+    children = children[:index] + replacement + children[index + 1:]
+    if not children:
+        return (), delta
+    encoded = node.encoded[:index] + [None] * len(replacement) + node.encoded[index + 1:]
+    if len(children) > 2 * FANOUT:
+        return (Node(firsts[:FANOUT], children[:FANOUT], waiting[:FANOUT], encoded[:FANOUT]),
+                Node(firsts[FANOUT:], children[FANOUT:], waiting[FANOUT:], encoded[FANOUT:])), delta
+    return (Node(firsts, children, waiting, encoded),), delta
+
+def split(leaf):
+    if len(leaf) > 2 * FANOUT:
+        return (leaf[:FANOUT], leaf[FANOUT:])
+    return (leaf,)
+
+def make_node(children):
+    children = tuple(children)
+    return Node(tuple(map(first_key, children)), children, tuple(map(waiting_under, children)))
+
+def first_key(child):
+    if isinstance(child, Node):
+        return child.firsts[0]
+    return child[0][0]
+
+def waiting_under(child):
+    if isinstance(child, Node):
+        return sum(child.waiting)
+    return count_waiting(child)
+
+def encode_leaf(leaf):
+    '''
+    Returns the entries of leaf as tutors see them, encoded as the items of a
+    JSON array, without its brackets.
+    '''
+    return encode([{
+        'zid': zid,
+        'description': description,
+        'status': status,
+    } for _, zid, description, status in leaf])[1:-1]
+
+def count_waiting(entries):
+    return [entry[3] for entry in entries].count('waiting')
@@ -0,0 +1,104 @@
+'''
+Unit tests for the queue versions the queue engine publishes
+'''
+
+import threading
+
+import pytest
+
+import versions
+from encoding import encode
+from engine import QueueEngine
+from engine_test import churn
+from storage import MemoryStorage
+
+@pytest.mark.parametrize('auto_prioritise', [False, True])
+def test_versions_match_engine(monkeypatch, auto_prioritise):
+    """
+    students come and go, with leaves and nodes small enough to be split and emptied.
+    the latest version always reads as the engine does while held.
+    """
+    monkeypatch.setattr(versions, "FANOUT", 2)
+    engine = QueueEngine(MemoryStorage(), auto_prioritise=auto_prioritise)
+    for step in churn([engine], 400):
+        if step % 97 == 0:
+            engine.reprioritise()
+        current = engine.latest()
+        assert current.seq == engine.seq
+        with engine.lock:
+            assert current.queue() == engine.requests.views(engine.ordered_zids())
+        assert current.encoded_queue() == encode(current.queue())
+        for entry in current.queue():
+            if entry['status'] == 'waiting':
+                request = engine.find(entry['zid'], 'waiting')
+                assert current.remaining(entry['zid']) == engine.order.ahead(request, 'waiting')
+            else:
+                assert current.remaining(entry['zid']) is None
+            assert current.standing(entry['zid']) == engine.standing(entry['zid'])
+
+def test_versions_do_not_change(monkeypatch):
+    """
+    a version is kept while the queue changes and a batch fails.
+    it still reads as the queue did when it was released.
+    """
+    monkeypatch.setattr(versions, "FANOUT", 2)
+    engine = QueueEngine(MemoryStorage())
+    for number in range(10):
+        engine.make_request(f"z{number}", "help me")
+    kept = engine.latest()
+    queue = kept.queue()
+    engine.help("z3")
+    engine.cancel("z0")
+    with pytest.raises(KeyError):
+        engine.batch([('cancel', ("z1",)), ('help', ("z0",))])
+    engine.reprioritise()
+    assert kept.queue() == queue
+    assert kept.remaining("z5") == 5
+    assert engine.remaining("z5") == 3
+    assert engine.latest().seq == kept.seq + 3
+
+def test_only_changed_leaves_are_encoded(monkeypatch):
+    """
+    the queue is encoded, then one request changes.
+    encoding the new version encodes only the leaf that request is in.
+    """
+    encoded = []
+    encode_leaf = versions.encode_leaf
+    monkeypatch.setattr(versions, "encode_leaf", lambda leaf: encoded.append(leaf) or encode_leaf(leaf))
+    engine = QueueEngine(MemoryStorage())
+    engine.batch([('make_request', (f"z{number:07d}", "help me")) for number in range(1000)])
+    engine.latest().encoded_queue()
+    assert sum(map(len, encoded)) == 1000
+    encoded.clear()
+    engine.help("z0000500")
+    body = engine.latest().encoded_queue()
+    assert [entry[1] for entry in encoded[0]].count("z0000500") == 1
+    assert len(encoded) == 1
+    assert body == encode(engine.queue())
+
+def test_reads_do_not_wait_for_writers():
+    """
+    another thread holds the engine, as a long write would.
+    queue(), remaining() and version() answer without waiting for it.
+    """
+    engine = QueueEngine(MemoryStorage())
+    engine.make_request("z1234567", "help me")
+    engine.make_request("z7654321", "help me")
+    held = threading.Event()
+    done = threading.Event()
+
+    def writer():
+        with engine.lock:
+            held.set()
+            done.wait(5)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    held.wait(5)
+    try:
+        assert [entry['zid'] for entry in engine.queue()] == ["z1234567", "z7654321"]
+        assert engine.remaining("z7654321") == 1
+        assert engine.version() == 2
+    finally:
+        done.set()
+        thread.join()
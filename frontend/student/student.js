@@ -43,62 +43,49 @@ window.onload = function() {
 		let xmlhttp = new XMLHttpRequest();
 		xmlhttp.open("POST", `${backendURL}/make_request`, true);
 		xmlhttp.setRequestHeader("Content-Type", "application/json;charset=UTF-8");
-		xmlhttp.onreadystatechange = function () {
-			// when request has finished reset request status.
-			if (this.readyState === 4 && this.status === 200) {
-				loadRequestStatus();
-			}
-		};
+		// the stream sends the new request status once the request is made.
 		xmlhttp.send(requestBody);
 	});
 
-	// set this student's request status.
-	loadRequestStatus();
+	// follow this student's request status.
+	followRequestStatus();
 	
 }
 
 /**
- * Sends and processes queue request to fill in this student's request status.
+ * Opens a stream of this student's standing in the queue, which the backend
+ * pushes whenever it changes, to keep their request status up to date.
  */
-function loadRequestStatus() {
-	// send queue request.
-	let xmlhttp = new XMLHttpRequest();
-	xmlhttp.open("GET", `${backendURL}/queue`, true);
-	// process queue request.
-	xmlhttp.onreadystatechange = function () {
-		if (this.readyState === 4 && this.status === 200) {
-			// the returned queue of requests from backend.
-			let queue = JSON.parse(this.responseText);
-			processQueueRequest(queue);
-		}
-	}
-	xmlhttp.send();
+function followRequestStatus() {
+	const standings = new EventSource(`${backendURL}/remaining/stream?zid=${encodeURIComponent(zid)}`);
+	// the stream sends the standing when it opens, and again after every change.
+	// if the connection drops, EventSource opens it again by itself.
+	standings.onmessage = function (event) {
+		processStanding(JSON.parse(event.data));
+	};
 }
 
 /**
- * Fills in request status element given a queue.
- * @param {object} queue a list of requests.
+ * Fills in request status element given this student's standing.
+ * @param {object} standing contains status and remaining keys.
  */
-function processQueueRequest(queue) {
+function processStanding(standing) {
 	// reset old request status.
 	const requestStatus = document.getElementById("requestStatus");
 	requestStatus.innerHTML = "";
-	requestStatus.appendChild(document.createTextNode("please make a request"));
-	// load new request status.
-	for (let i = 0; i < queue.length; i++) {
-		if (queue[i]["zid"] === zid) {
-			requestStatus.innerHTML = "";
-			if (queue[i]["status"] === "waiting") {
-				requestStatus.appendChild(document.createTextNode("your request is waiting for a tutor to help."));
-			} else {
-				requestStatus.appendChild(document.createTextNode("your request is being received by a tutor."));
-			}
-			requestStatus.appendChild(generateCancelButton(queue[i]));
-			break;
-		}
+	// no request in the queue, status will be default status.
+	if (standing["status"] === null) {
+		requestStatus.appendChild(document.createTextNode("please make a request"));
+		return;
+	}
+	if (standing["status"] === "waiting") {
+		const ahead = standing["remaining"];
+		requestStatus.appendChild(document.createTextNode(
+			`your request is waiting for a tutor to help, with ${ahead} ${ahead === 1 ? "student" : "students"} ahead of you.`));
+	} else {
+		requestStatus.appendChild(document.createTextNode("your request is being received by a tutor."));
 	}
-	// if control reaches here, zid not found, status will be default status.
-	return;
+	requestStatus.appendChild(generateCancelButton(standing));
 }
 
 /**
@@ -120,12 +107,7 @@ function generateCancelButton(request) {
 		let xmlhttp = new XMLHttpRequest();
 		xmlhttp.open("DELETE", `${backendURL}/cancel`, true);
 		xmlhttp.setRequestHeader("Content-Type", "application/json;charset=UTF-8");
-		xmlhttp.onreadystatechange = function () {
-			// when request has finished reset request status.
-			if (this.readyState === 4 && this.status === 200) {
-				loadRequestStatus();
-			}
-		};
+		// the stream sends the new request status once the request is cancelled.
 		xmlhttp.send(requestBody);
 	})
 	return button;
@@ -4,6 +4,12 @@
 
 const backendURL = "http://127.0.0.1:8080";
 
+// the stream of queue events from the backend, if the browser supports it.
+let queueStream = null;
+
+// the queue of requests, kept up to date by the queue events.
+let requestQueue = [];
+
 ///////////////////////////////////////////////////////////
 // bootstrap.
 ///////////////////////////////////////////////////////////
@@ -28,8 +34,8 @@ window.onload = function () {
 		return p;
 	}());
 
-	// fill in requestList.
-	loadQueue();
+	// fill in requestList, and keep it filled in as the queue changes.
+	streamQueue();
 
 	const reprioritiseButton = document.getElementById("reprioritiseButton");
 	// add event listener for reprioritise button click.
@@ -41,7 +47,7 @@ window.onload = function () {
 		xmlhttp.onreadystatechange = function () {
 			// when request has finished refill requestList.
 			if (this.readyState === 4 && this.status === 200) {
-				loadQueue();
+				refreshQueue();
 			}
 		};
 		xmlhttp.send();
@@ -59,7 +65,7 @@ window.onload = function () {
 		xmlhttp.onreadystatechange = function () {
 			// when request has finished refill requestList.
 			if (this.readyState === 4 && this.status === 200) {
-				loadQueue();
+				refreshQueue();
 			}
 		};
 		xmlhttp.send();
@@ -71,6 +77,80 @@ window.onload = function () {
 // helper functions.
 ///////////////////////////////////////////////////////////
 
+/**
+ * Fills in the requestList element from the backend's stream of queue events,
+ * refilling it after every event. Falls back to loadQueue() if the browser
+ * cannot stream events.
+ */
+function streamQueue() {
+	if (!window.EventSource) {
+		loadQueue();
+		return;
+	}
+	queueStream = new EventSource(`${backendURL}/queue/stream`);
+	queueStream.onmessage = function (message) {
+		const event = JSON.parse(message.data);
+		if (event["type"] === "reset") {
+			// the backend reloaded the queue, so start again from a fresh copy.
+			queueStream.close();
+			streamQueue();
+			return;
+		}
+		applyQueueEvent(event);
+		processQueueRequest(requestQueue);
+	};
+}
+
+/**
+ * Updates requestQueue with a queue event from the backend.
+ * @param {object} event a queue event, with a type key.
+ */
+function applyQueueEvent(event) {
+	switch (event["type"]) {
+		case "queue":
+			requestQueue = event["queue"];
+			break;
+		case "added": {
+			// the backend may put a request in front of others by priority.
+			const index = requestQueue.findIndex(request => request["zid"] === event["before"]);
+			if (index === -1) {
+				requestQueue.push(event["request"]);
+			} else {
+				requestQueue.splice(index, 0, event["request"]);
+			}
+			break;
+		}
+		case "status":
+			for (const request of requestQueue) {
+				if (request["zid"] === event["zid"]) {
+					request["status"] = event["status"];
+				}
+			}
+			break;
+		case "removed":
+			requestQueue = requestQueue.filter(request => request["zid"] !== event["zid"]);
+			break;
+		case "reordered": {
+			const requests = new Map(requestQueue.map(request => [request["zid"], request]));
+			requestQueue = event["order"].map(zid => requests.get(zid));
+			break;
+		}
+		case "cleared":
+			requestQueue = [];
+			break;
+	}
+}
+
+/**
+ * Refills the requestList element after an action, unless the queue events
+ * from the backend already do.
+ */
+function refreshQueue() {
+	if (queueStream === null) {
+		loadQueue();
+	}
+}
+
 /**
  * Refills the requestList element.
  */
@@ -149,7 +229,7 @@ function generateButton(request, type) {
 		xmlhttp.onreadystatechange = function () {
 			// when request has finished reload queue.
 			if (this.readyState === 4 && this.status === 200) {
-				loadQueue();
+				refreshQueue();
 			}
 		};
 		xmlhttp.send(requestBody);